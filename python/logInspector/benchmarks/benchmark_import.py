@@ -0,0 +1,77 @@
+'''
+Import time benchmark of the log inspector modules
+
+Each module is imported in a new interpreter with python -X importtime, so nothing is cached by an
+earlier import.  The best time of a few runs is compared against a budget, and modules that must stay
+lazy (loaded only by the plots or features that need them) are checked to not be imported.  Exits with
+an error if a module is over budget or imports a lazy dependency.
+
+Usage: python benchmark_import.py [--only logReader,...] [--runs N] [--scale S] [--top N]
+'''
+import argparse
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+
+LOG_INSPECTOR_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Slow imports that only the plots or features needing them may load
+LAZY = ['allantools', 'pandas', 'scipy', 'matplotlib.pyplot', 'numba', 'PyQt5', 'ui']
+
+# module: (budget (ms), modules it must not import)
+BENCHMARKS = {
+    'logReader':    (150, LAZY),                # supernpp and RMS reports only need Log
+    'logPlotter':   (400, LAZY),
+    'plotExport':   (600, LAZY),
+    'logInspector': (2000, ['allantools', 'pandas', 'scipy', 'numba']),
+}
+
+
+def importTimes(module):
+    # Returns {imported module: cumulative import time (us)} of importing module in a new interpreter
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=LOG_INSPECTOR_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError('import %s failed:\n%s' % (module, result.stderr[-2000:]))
+    times = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)', line)
+        if m:
+            times[m.group(3)] = int(m.group(1))
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='log inspector import time benchmark')
+    parser.add_argument('--only', default=None, help='comma separated modules')
+    parser.add_argument('--runs', default=5, type=int, help='imports of each module, the best is used')
+    parser.add_argument('--scale', default=1.0, type=float, help='multiply the budgets, e.g. for slow machines')
+    parser.add_argument('--top', default=5, type=int, help='show the slowest imports of each module')
+    opts = parser.parse_args()
+
+    names = opts.only.split(',') if opts.only else list(BENCHMARKS)
+    failures = 0
+    print('%-14s %10s %10s' % ('module', 'time (ms)', 'budget'))
+    for name in names:
+        budget, lazy = BENCHMARKS[name]
+        if name == 'logInspector' and importlib.util.find_spec('PyQt5') is None:
+            print('%-14s %10s' % (name, 'skipped, PyQt5 is not installed'))
+            continue
+        runs = [importTimes(name) for _ in range(opts.runs)]
+        best = min(runs, key=lambda times: times[name])
+        ms = best[name] / 1000.0
+        status = ''
+        if ms > budget * opts.scale:
+            status = 'OVER BUDGET'
+            failures += 1
+        eager = [m for m in lazy if m in best]
+        if eager:
+            status += ' imports ' + ', '.join(eager)
+            failures += 1
+        print('%-14s %10.1f %10.0f  %s' % (name, ms, budget * opts.scale, status))
+        slowest = sorted((t, m) for m, t in best.items() if m != name and '.' not in m)[::-1][:opts.top]
+        for t, m in slowest:
+            print('    %-24s %8.1f' % (m, t / 1000.0))
+    sys.exit(1 if failures else 0)
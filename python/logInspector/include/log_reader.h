@@ -2,6 +2,10 @@
 #include <pybind11/stl.h>
 #include <pybind11/numpy.h>
 
+#include <atomic>
+#include <functional>
+#include <memory>
+
 #include "InertialSense.h"
 #include "ISLogger.h"
 #include "luna_data_sets.h"
@@ -17,7 +21,8 @@ namespace py = pybind11;
 
 typedef struct
 {
-  std::vector<std::vector<obsd_t>> obs;
+  std::vector<obsd_t> obs;              // observations of all epochs
+  std::vector<int64_t> obsOffsets;      // index in obs of the first observation of each epoch
   std::vector<eph_t> eph;
   std::vector<geph_t> gloEph;
   std::vector<sbsmsg_t> sbas;
@@ -112,6 +117,29 @@ struct DeviceLog
     std::vector<debug_array_t> gpxDebugArray;
 };
 
+// Per device read state, kept between records so it carries across poll() calls
+struct DeviceReadState
+{
+    double towOffset = -1.0;        // latest DID_GPS1_POS towOffset, places boot time records in GPS time
+    bool windowReached = false;
+    int pastWindow = 0;
+};
+
+// Read position of a device in follow mode
+struct DeviceProgress
+{
+    std::atomic<uint64_t> bytesRead{0};     // updated by the decode thread while progress() may read it
+    uint64_t bytesTotal = 0;                // size of the log files of the device
+};
+
+struct DeviceFollow
+{
+    uint32_t serialNumber;
+    std::string fileName;           // file being read, files are named in the order they are written
+    long offset = 0;                // start of the next unread chunk in fileName
+    DeviceReadState state;
+};
+
 template <typename T>
 struct DataLog
 {
@@ -130,15 +158,22 @@ class LogReader
 public:
     LogReader();
     ~LogReader();
-    bool init(py::object python_class, std::string log_directory, pybind11::list serials);
-    bool load();
+    bool init(std::string log_directory, pybind11::list serials, pybind11::list dids = pybind11::list(), pybind11::list exclude_dids = pybind11::list());
+    void setTimeWindow(double start_tow=-1.0, double end_tow=-1.0);
+    py::dict load(int threads=0, bool follow=false);
+    py::dict poll();
+    pybind11::list progress();
+    void cancel();
     pybind11::list getSerialNumbers();
     pybind11::list protocolVersion();
-    void ins1ToIns2(int device_id=0);
+    py::array_t<ins_2_t> ins1ToIns2(py::array_t<ins_1_t> ins1);
     void exitHack(int exit_code=0);
     
     template <typename T>
-    void forward_message(eDataIDs did, std::vector<T>& vec, int device_id);
+    void forward_message(eDataIDs did, std::vector<T>& vec, py::dict& dids);
+
+    template <typename T>
+    py::array_t<T> to_array(std::vector<T>& vec);
 
     template <typename T>
     void log_message(int did, uint8_t* msg, std::vector<T>& vec)
@@ -147,11 +182,35 @@ public:
     }
 
 private:
-    void organizeData(std::shared_ptr<cDeviceLog>);
-    void forwardData(int device_id);
+    void decodeDevices(int count, int threads, const std::function<void(int)>& decode);
+    void organizeData(std::shared_ptr<cDeviceLog> devLog, DeviceLog& log, DeviceProgress& progress);
+    void organizeWindow(uint32_t serialNumber, DeviceLog& log, DeviceProgress& progress);
+    bool organizeChunks(const std::string& fileName, long offset, int maxChunks, DeviceLog& log, DeviceProgress& progress, DeviceReadState& state);
+    bool organizeRecord(p_data_buf_t* data, DeviceLog& log, DeviceReadState& state);
+    void followData(DeviceFollow& follow, DeviceLog& log, DeviceProgress& progress);
+    std::vector<ISFileManager::file_info_t> deviceFiles(uint32_t serialNumber);
+    // Offset of the chunk after the chunk at offset and the GPS time of week of its first record (-1 if unknown), false at the end of the file
+    static bool chunkTow(cISLogFileBase* file, long offset, long& next, double& tow);
+    void initProgress(const std::vector<uint32_t>& serialNumbers);
+    py::dict forwardData(DeviceLog& log);
+    bool timeWindowEnabled();
+    // GPS time of week (s) of a record, -1 without a timestamp, NAN when it cannot be placed in GPS time.
+    // timeOfWeek is set when the record is timestamped in GPS time rather than time since boot.
+    static double recordTow(const p_data_buf_t* data, double towOffset, bool* timeOfWeek = NULL);
 
     cISLogger logger_;
-    DeviceLog* dev_log_ = nullptr;
+    std::string directory_;
+    cISLogger::eLogType logType_ = cISLogger::LOGTYPE_DAT;
+    std::vector<DeviceFollow> follow_;  // read positions for poll(), empty unless loaded in follow mode
+    int threads_ = 0;
     pybind11::list serialNumbers_; 
+    std::vector<bool> loadDid_;     // DIDs decoded by organizeData(), indexed by DID
+    bool useChunkHeader_ = true;    // false for *.raw logs, which have no data headers to validate
+    double startTow_ = -1.0;        // GPS time of week window (s) applied by organizeData(), negative for no bound
+    double endTow_ = -1.0;
+    std::unique_ptr<DeviceProgress[]> progress_;    // per device, allocated by load() while holding the GIL
+    int progressCount_ = 0;
+    std::atomic<bool> cancel_{false};   // set by cancel() from another thread to stop decoding
+
 
 };
@@ -0,0 +1,124 @@
+'''
+Level of detail for drawing long time series.
+
+Each long line of a figure gets a min/max pyramid of its samples.  The line draws the level whose bins
+are about one pixel wide, the minimum and maximum of each bin in sample order, so a zoomed out view of
+millions of samples draws a few thousand points and still shows every spike and transient.  The level
+is picked again when the x limits change, i.e. on zoom and pan.
+'''
+import math
+import numpy as np
+
+LOD_MIN_POINTS = 20000      # Lines with fewer points are drawn as they are
+LOD_BASE = 8                # Samples per bin of the finest level, smaller views draw every sample
+
+
+class LodPyramid:
+    """
+    Min/max pyramid of a series y(x), x increasing.  Level k has bins of LOD_BASE * 2**k samples and
+    keeps the index of the minimum and maximum of each bin.  NaN samples are only kept if a whole bin
+    is NaN, so gaps in the data remain gaps.
+    """
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.levels = []    # [(samples per bin, min index, max index)]
+        n = len(y)
+        dtype = np.int32 if n < 2**31 else np.int64
+
+        # Finest level from the samples
+        nb = -(-n // LOD_BASE)
+        blocks = np.concatenate((y, np.full(nb * LOD_BASE - n, np.nan))).reshape(nb, LOD_BASE)
+        nan = np.isnan(blocks)
+        first = np.arange(nb, dtype=dtype) * LOD_BASE
+        imin = np.minimum(np.argmin(np.where(nan, np.inf, blocks), axis=1) + first, n - 1).astype(dtype)
+        imax = np.minimum(np.argmax(np.where(nan, -np.inf, blocks), axis=1) + first, n - 1).astype(dtype)
+        self.levels.append((LOD_BASE, imin, imax))
+
+        # Each coarser level from pairs of bins of the previous level
+        binSize = LOD_BASE
+        while len(imin) > 1:
+            if len(imin) % 2:
+                imin = np.append(imin, imin[-1])
+                imax = np.append(imax, imax[-1])
+            a, b = imin[0::2], imin[1::2]
+            imin = np.where((y[a] <= y[b]) | np.isnan(y[b]), a, b)
+            a, b = imax[0::2], imax[1::2]
+            imax = np.where((y[a] >= y[b]) | np.isnan(y[b]), a, b)
+            binSize *= 2
+            self.levels.append((binSize, imin, imax))
+
+    def nbytes(self):
+        # Memory of the pyramid, x and y belong to the line
+        return sum(imin.nbytes + imax.nbytes for _, imin, imax in self.levels)
+
+    def view(self, xmin, xmax, pixels):
+        # Returns the x, y to draw between xmin and xmax on an axes pixels wide
+        n = len(self.x)
+        i0 = max(np.searchsorted(self.x, xmin) - 1, 0)
+        i1 = min(np.searchsorted(self.x, xmax, side='right') + 1, n)
+        samplesPerPixel = (i1 - i0) / max(pixels, 1.0)
+        if samplesPerPixel < 2 * LOD_BASE:
+            return self.x[i0:i1], self.y[i0:i1]
+
+        # Coarsest level with bins no wider than a pixel, 2 to 4 points per pixel
+        level = min(int(math.log2(samplesPerPixel / LOD_BASE)), len(self.levels) - 1)
+        binSize, imin, imax = self.levels[level]
+        b0 = i0 // binSize
+        b1 = -(-i1 // binSize)
+        lo = imin[b0:b1]
+        hi = imax[b0:b1]
+        index = np.empty(2 * len(lo), dtype=lo.dtype)
+        index[0::2] = np.minimum(lo, hi)
+        index[1::2] = np.maximum(lo, hi)
+        return self.x[index], self.y[index]
+
+
+def lodSeries(line):
+    # Returns the x, y of a line as float arrays if it should be drawn with a level of detail, else None
+    x = np.asarray(line.get_xdata(orig=False))
+    y = np.asarray(line.get_ydata(orig=False))
+    if x.ndim != 1 or len(x) < LOD_MIN_POINTS or x.shape != y.shape:
+        return None
+    if x.dtype.kind not in 'fiub' or y.dtype.kind not in 'fiub':
+        return None
+    x = x.astype(np.float64, copy=False)
+    # Only series with increasing x, e.g. not maps.  NaN x fails the comparison.
+    if not np.all(x[1:] >= x[:-1]):
+        return None
+    return x, y.astype(np.float64, copy=False)
+
+def enableLod(fig, cache=None):
+    '''
+    Draws the long time series lines of fig with a level of detail that follows the x limits of their
+    axes.  Call after the plot is drawn into fig.  Returns the number of lines with a level of detail.
+        cache: cache(key, compute) returning the pyramid compute() builds for a series, e.g. through
+               logPlot.cached(), so drawing the same plot again does not rebuild its pyramids.  The key
+               identifies the line in fig and its length and end points.
+    '''
+    count = 0
+    for i, ax in enumerate(fig.axes):
+        pyramids = []
+        for j, line in enumerate(ax.get_lines()):
+            series = lodSeries(line)
+            if series is None:
+                continue
+            x, y = series
+            if cache is None:
+                pyramid = LodPyramid(x, y)
+            else:
+                key = (i, j, len(x), x[0], x[-1], y[0], y[-1])
+                pyramid = cache(key, lambda: LodPyramid(x, y))
+            pyramids.append((line, pyramid))
+        if not pyramids:
+            continue
+
+        def update(ax, pyramids=pyramids):
+            xmin, xmax = sorted(ax.get_xlim())
+            for line, pyramid in pyramids:
+                line.set_data(*pyramid.view(xmin, xmax, ax.bbox.width))
+
+        update(ax)
+        ax.callbacks.connect('xlim_changed', update)
+        count += len(pyramids)
+    return count
@@ -0,0 +1,192 @@
+import json
+import os
+import uuid
+import numpy as np
+
+from pylib.data_sets import *
+from pylib.ISToolsGNSS import GnssObservations
+
+# Decoded logs are cached in this subdirectory of the log directory
+CACHE_DIR = '.logcache'
+CACHE_MANIFEST = 'manifest.json'
+CACHE_VERSION = 2
+
+LOG_FILE_EXTENSIONS = ('.dat', '.raw', '.sdat')
+
+# Raw GNSS DIDs are decoded as [GnssObservations, eph, gloEph, sbas, ion, sta]
+RAW_GNSS_DIDS = [DID_GPS1_RAW, DID_GPS2_RAW, DID_GPS_BASE_RAW]
+RAW_GNSS_FIELDS = ['eph', 'gloEph', 'sbas', 'ion', 'sta']
+
+
+def cachedDid(manifest, did):
+    # True if the cache of manifest holds the decoded data of did
+    return (manifest.get('dids') is None or did in manifest['dids']) and did not in (manifest.get('excludeDids') or [])
+
+def mergeDids(manifest, dids, excludeDids):
+    # Returns the (dids, excludeDids) of the cache of manifest after adding a save of dids (None = all DIDs) except excludeDids
+    oldDids = manifest.get('dids')
+    oldExcludeDids = set(manifest.get('excludeDids') or [])
+    excludeDids = set(excludeDids or [])
+    if oldDids is None and not dids:
+        return None, oldExcludeDids & excludeDids
+    if oldDids is None:
+        return None, oldExcludeDids - (set(dids) - excludeDids)
+    if not dids:
+        return None, excludeDids - (set(oldDids) - oldExcludeDids)
+    return (set(oldDids) - oldExcludeDids) | (set(dids) - excludeDids), None
+
+
+class LogCache:
+    """
+    Decoded log data cached next to the log files, one .npy file per device and DID.
+    The cache is keyed by the name, size and mtime of the log files, the SDK protocol
+    version and the requested serial numbers.  Cached arrays are memory mapped copy-on-write,
+    so reopening a log only reads the pages that are used.  Each save writes its arrays under new
+    file names and then replaces the manifest, so a log already mapping the cache keeps reading the
+    files it mapped and never sees a file rewritten in place.  A cache of a load of selected DIDs
+    only holds those DIDs, and a cache of a load with excluded DIDs holds all but those.  It
+    serves later loads that need no other DIDs.  Saving other DIDs of the same log files adds them
+    to the cache, the arrays already cached stay in place for logs that map them.
+    """
+    def __init__(self, directory, protocolVersion, serials):
+        self.directory = directory
+        self.path = os.path.join(directory, CACHE_DIR)
+        self.key = self.cacheKey(protocolVersion, serials)
+        self.manifest = None
+        self.generation = None      # names the arrays of a save apart from those of older saves
+        self.written = []           # files written by a save, removed if it fails
+
+    def cacheKey(self, protocolVersion, serials):
+        files = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.lower().endswith(LOG_FILE_EXTENSIONS):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append([name, stat.st_size, stat.st_mtime_ns])
+        return {'version': CACHE_VERSION, 'protocol': list(protocolVersion), 'serials': [str(s) for s in serials], 'files': files}
+
+    def readManifest(self):
+        # Returns the manifest of the cache of the current log files, or None
+        try:
+            with open(os.path.join(self.path, CACHE_MANIFEST), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('key') != self.key or not len(self.key['files']):
+            return None
+        return manifest
+
+    def valid(self, dids=None, excludeDids=None):
+        # Returns True if the cache exists, matches the log files and holds the DIDs (None = all DIDs) except excludeDids
+        manifest = self.readManifest()
+        if manifest is None:
+            return False
+        cachedDids = manifest.get('dids')
+        cachedExcludeDids = set(manifest.get('excludeDids') or [])
+        excludeDids = set(excludeDids or [])
+        if dids:
+            needed = set(dids) - excludeDids
+            if (cachedDids is not None and not needed <= set(cachedDids)) or needed & cachedExcludeDids:
+                return False
+        elif cachedDids is not None or not cachedExcludeDids <= excludeDids:
+            return False
+        self.manifest = manifest
+        return True
+
+    def serialNumbers(self):
+        return self.manifest['serialNumbers']
+
+    def numDev(self):
+        return len(self.manifest['devices'])
+
+    def loadArray(self, filename):
+        # Map copy-on-write so callers may modify the data without touching the cache
+        return np.load(os.path.join(self.path, filename), mmap_mode='c').view(np.ndarray)
+
+    def loadDid(self, dev, did, dids=None, excludeDids=None):
+        # Returns the DID data like LogReader.load(), or [] if the DID was not decoded.  DIDs that
+        # are not selected by dids/excludeDids are returned empty, the same as when they are not decoded.
+        entry = self.manifest['devices'][dev].get(str(did))
+        if entry is None:
+            return []
+        selected = not ((dids and did not in dids) or (excludeDids and did in excludeDids))
+        if did not in RAW_GNSS_DIDS:
+            data = self.loadArray(entry)
+            return data if selected else data[:0]
+        obs = GnssObservations(self.loadArray(entry['obs']), self.loadArray(entry['obsOffsets']))
+        data = [self.loadArray(entry[field]) for field in RAW_GNSS_FIELDS]
+        if not selected:
+            return [GnssObservations(obs.obs[:0], obs.offsets[:1])] + [a[:0] for a in data]
+        return [obs] + data
+
+    def save(self, logs, serialNumbers, dids=None, excludeDids=None):
+        # Returns True if the cache was written.  dids: the DIDs that were decoded (None = all DIDs), excludeDids: DIDs
+        # that were not decoded.  DIDs not decoded are cached empty, like LogReader returns them, and not served to
+        # loads that need them.
+        self.generation = uuid.uuid4().hex[:8]
+        self.written = []
+        old = self.readManifest()
+        if old is not None and len(old['devices']) != len(logs):
+            old = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            devices = []
+            for dev in range(len(logs)):
+                entries = dict(old['devices'][dev]) if old else {}
+                for did, data in logs[dev].items():
+                    if old and cachedDid(old, did) and str(did) in entries:
+                        continue
+                    name = 'dev%d_did%d_%s' % (dev, did, self.generation)
+                    if did in RAW_GNSS_DIDS:
+                        entries[str(did)] = self.saveRaw(name, data)
+                    else:
+                        entries[str(did)] = self.saveArray(name + '.npy', data)
+                devices.append(entries)
+
+            if old:
+                dids, excludeDids = mergeDids(old, dids, excludeDids)
+            manifest = {'key': self.key, 'serialNumbers': [int(s) for s in serialNumbers], 'devices': devices,
+                        'dids': sorted(dids) if dids else None, 'excludeDids': sorted(excludeDids) if excludeDids else None}
+            tmp = os.path.join(self.path, CACHE_MANIFEST + '.' + self.generation)
+            self.written.append(os.path.basename(tmp))
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp, os.path.join(self.path, CACHE_MANIFEST))
+            self.manifest = manifest
+            if not old:
+                self.removeUnused(devices)
+            return True
+        except OSError as e:
+            print("Unable to write log cache: " + str(e))
+            for filename in self.written:
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except OSError:
+                    pass
+            return False
+
+    def removeUnused(self, devices):
+        # Removes the arrays of a cache of older log files.  Arrays still mapped elsewhere may not be removable.
+        used = set()
+        for entries in devices:
+            for entry in entries.values():
+                used.update(entry.values() if isinstance(entry, dict) else [entry])
+        for filename in os.listdir(self.path):
+            if filename.endswith('.npy') and filename not in used:
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except OSError:
+                    pass
+
+    def saveArray(self, filename, data):
+        self.written.append(filename)
+        np.save(os.path.join(self.path, filename), data)
+        return filename
+
+    def saveRaw(self, name, data):
+        # data = [obs, obsOffsets, eph, gloEph, sbas, ion, sta] from LogReader.load()
+        entry = {}
+        entry['obs'] = self.saveArray(name + '_obs.npy', data[0])
+        entry['obsOffsets'] = self.saveArray(name + '_obsOffsets.npy', data[1])
+        for field, array in zip(RAW_GNSS_FIELDS, data[2:]):
+            entry[field] = self.saveArray('%s_%s.npy' % (name, field), array)
+        return entry
@@ -18,6 +18,8 @@ import numpy as np
 
 from logReader import Log
 from logPlotter import logPlot
+from plotExport import exportPlots, plotterSettings
+from lod import enableLod
 
 file_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.normpath(file_path + '/..'))
@@ -249,6 +251,64 @@ class MPlotter(QDialog):
         # Call the base class implementation
         super(MPlotter, self).closeEvent(event)
 
+class LogLoader(QtCore.QThread):
+    # Loads a log on a worker thread so the window stays responsive.  Decode progress is read from the
+    # LogReader by a timer on the GUI thread, since Log.load() does not return until decoding is done.
+    progress = pyqtSignal(list)     # [(bytes read, bytes total)] of each device
+    loaded = pyqtSignal(object)     # Log, not emitted if cancelled
+    failed = pyqtSignal(str, str)   # error message, traceback
+
+    PROGRESS_INTERVAL_MS = 200
+
+    def __init__(self, directory, parent=None):
+        super(LogLoader, self).__init__(parent)
+        self.directory = directory
+        self.log = Log()
+        self.progressTimer = QtCore.QTimer(self)
+        self.progressTimer.timeout.connect(lambda: self.progress.emit(self.log.progress()))
+        self.finished.connect(self.progressTimer.stop)
+
+    def start(self):
+        self.progressTimer.start(self.PROGRESS_INTERVAL_MS)
+        super(LogLoader, self).start()
+
+    def run(self):
+        try:
+            self.log.load(self.directory)
+        except Exception as e:
+            if not self.log.cancelled:
+                self.failed.emit(str(e), traceback.format_exc())
+            return
+        if not self.log.cancelled:
+            self.loaded.emit(self.log)
+
+    def cancel(self):
+        # Returns immediately, the thread finishes once the decode threads have stopped
+        self.log.cancel()
+
+class PlotExporter(QtCore.QThread):
+    # Saves plots to the figures directory with plotExport.exportPlots(), which renders them in worker processes
+    progress = pyqtSignal(int, int, str)    # plots done, plots total, plot function
+
+    def __init__(self, log, funcNames, format, settings, parent=None):
+        super(PlotExporter, self).__init__(parent)
+        self.log = log
+        self.directory = log.directory
+        self.funcNames = funcNames
+        self.format = format
+        self.settings = settings
+        self.results = []
+        self.error = None
+
+    def run(self):
+        # The workers load the log from its cache, a process with a GUI is not forked.  Without a cache the plots
+        # are rendered in this thread from the loaded log.
+        try:
+            self.results = exportPlots(self.directory, self.funcNames, self.format, settings=self.settings, log=self.log,
+                                       progress=lambda done, total, funcName, error: self.progress.emit(done, total, funcName), fork=False)
+        except Exception:
+            self.error = traceback.format_exc()
+
 class LogInspectorWindow(QMainWindow):
     def __init__(self, configFilePath):
         super(LogInspectorWindow, self).__init__()
@@ -277,12 +337,20 @@ class LogInspectorWindow(QMainWindow):
             file.close()
 
         self.selectedIndex = 0
-        self.downsample = 5
+        self.downsample = 1     # Long series are drawn at the level of detail of the view, see lod.py
         self.plotargs = None
         self.log = None
+        self.loader = None      # LogLoader of the log being loaded
+        self.loaders = []       # LogLoaders with running threads, including cancelled ones
+        self.exporter = None    # PlotExporter saving all plots
 
     def closeEvent(self, event):
         # Perform any cleanup if needed
+        for loader in self.loaders:
+            loader.cancel()
+            loader.wait()
+        if self.exporter is not None:
+            self.exporter.wait()
         super().closeEvent(event)  
 
     def popPlot(self):
@@ -380,13 +448,46 @@ class LogInspectorWindow(QMainWindow):
             self.load(self.config['directory'])
 
     def load(self, directory):
+        # Load in the background, the current log stays displayed until the new one is loaded.
+        # Loading another directory cancels the load in progress.
+        self.cancelLoad()
         self.config['directory'] = directory
         print("\nLoading files from " + directory)
+        loader = LogLoader(directory, self)
+        loader.progress.connect(self.onLoadProgress)
+        loader.loaded.connect(self.onLoaded)
+        loader.failed.connect(self.onLoadFailed)
+        loader.finished.connect(lambda: self.onLoaderFinished(loader))
+        self.loader = loader
+        self.loaders.append(loader)
+        self.cancelLoadButton.setVisible(True)
         self.setStatus("Loading...")
-        # if self.log is None:
-        self.log = Log()
-        self.log.load(directory)
+        loader.start()
+
+    def cancelLoad(self):
+        if self.loader is None:
+            return
+        print("Cancel loading " + self.loader.directory)
+        self.loader.cancel()
+        self.loader = None
+        self.cancelLoadButton.setVisible(False)
+        self.setStatus("Loading cancelled")
+
+    def onLoadProgress(self, progress):
+        # Signals of cancelled loaders may still be queued
+        if self.sender() is not self.loader or not len(progress):
+            return
+        percent = [min(100, 100 * read // total) if total else 0 for read, total in progress]
+        self.setStatus("Loading... %d%%  [%s]" % (sum(percent) // len(percent), " ".join("%d%%" % p for p in percent)))
+
+    def onLoaded(self, log):
+        if self.sender() is not self.loader:
+            return
+        directory = self.loader.directory
+        self.loader = None
+        self.cancelLoadButton.setVisible(False)
         print("done loading")
+        self.log = log
         for mplot in self.mplots:
             mplot.plotter.setLog(self.log)
             mplot.plotter.setDownSample(self.downsample)
@@ -394,6 +495,18 @@ class LogInspectorWindow(QMainWindow):
         self.setStatus("")
         self.expandAndSelectDirectory(directory)
 
+    def onLoadFailed(self, message, details):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.cancelLoadButton.setVisible(False)
+        self.setStatus("")
+        self.showError(message, details)
+
+    def onLoaderFinished(self, loader):
+        self.loaders.remove(loader)
+        loader.deleteLater()
+
     def setupUi(self):
         self.setObjectName("LogInspector")
         self.setWindowTitle("LogInspector")
@@ -600,7 +713,14 @@ class LogInspectorWindow(QMainWindow):
 
     def createStatus(self):
         self.statusLabel = QLabel()
-        self.controlLayout.addWidget(self.statusLabel)
+        self.cancelLoadButton = QPushButton("Cancel")
+        self.cancelLoadButton.setToolTip("Cancel loading the log.")
+        self.cancelLoadButton.clicked.connect(self.cancelLoad)
+        self.cancelLoadButton.setVisible(False)
+        self.statusLayout = QHBoxLayout()
+        self.statusLayout.addWidget(self.statusLabel, 1)
+        self.statusLayout.addWidget(self.cancelLoadButton)
+        self.controlLayout.addLayout(self.statusLayout)
         # self.statusLabel.setVisible(False)
 
     def setStatus(self, str):
@@ -692,21 +812,37 @@ class LogInspectorWindow(QMainWindow):
         if self.log == None:
             print("Log not opened.  Please select a log directory.")
             return
-        print("Saving all plots file")
-        for mplot in self.mplots:
-            mplot.plotter.save = True
-        for i in range(len(self.funcNameList)):
-            if self.setCurrentListRow(i) and self.funcNameList[i] != None:
-                self.plot(self.selectedPlot(), self.plotargs)
-            QtCore.QCoreApplication.processEvents()
-        for mplot in self.mplots:
-            mplot.plotter.save = False
+        if self.exporter is not None:
+            print("Already saving plots")
+            return
+        print("Saving all plots to " + os.path.join(self.log.directory, 'figures'))
+        plotter = self.mplots[0].plotter
+        funcNames = [funcName for funcName in self.funcNameList if funcName is not None]
+        self.exporter = PlotExporter(self.log, funcNames, plotter.format, plotterSettings(plotter), self)
+        self.exporter.progress.connect(lambda done, total, funcName: self.setStatus("Saving plots... %d/%d" % (done, total)))
+        self.exporter.finished.connect(self.onSavedAllPlots)
+        self.saveAllPushButton.setEnabled(False)
+        self.setStatus("Saving plots...")
+        self.exporter.start()
+
+    def onSavedAllPlots(self):
+        if self.exporter.error is not None:
+            print(self.exporter.error)
+        failed = [(funcName, error) for funcName, error, paths in self.exporter.results if error]
+        for funcName, error in failed:
+            print("Unable to save " + funcName + ":\n" + error)
+        self.setStatus("Saved %d plots to figures, %d failed" % (len(self.exporter.results) - len(failed), len(failed)))
+        self.exporter.deleteLater()
+        self.exporter = None
+        self.saveAllPushButton.setEnabled(True)
 
     def changeDownSample(self, val):
         self.downsample = max(val, 1)
+        # Plotting uses a strided view of the loaded arrays, see logPlot.getData(), so the log is not reloaded
         for mplot in self.mplots:
             mplot.plotter.setDownSample(self.downsample)
-        self.reload()
+        if self.log is not None and self.selectedPlot() is not None:
+            self.updatePlot()
 
     def setDownSampleToOne(self):
         self.downSampleInput.setValue(1)
@@ -737,11 +873,11 @@ class LogInspectorWindow(QMainWindow):
         except Exception as e:
             self.showError(e)
 
-    def showError(self, e):
+    def showError(self, e, details=None):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Critical)
         msg.setText("Unable to load log: " + e.__str__())
-        msg.setDetailedText(traceback.format_exc())
+        msg.setDetailedText(details if details is not None else traceback.format_exc())
         msg.exec()
 
     def updateFileTree(self):
@@ -916,6 +1052,11 @@ class LogInspectorWindow(QMainWindow):
                     ax = getattr(mplot.plotter, mplot.func)(*args, mplot.figure, axs=ax)
                 else:
                     ax = getattr(mplot.plotter, mplot.func)(mplot.figure, axs=ax)
+                # Draw long time series at the level of detail of the view, updated on zoom and pan.  The
+                # pyramids are cached with the plot data so redrawing the same plot does not rebuild them.
+                plotKey = (mplot.func,) + tuple(args or ())
+                enableLod(mplot.figure, lambda key, compute, mplot=mplot, plotKey=plotKey:
+                          mplot.plotter.cached('lod', compute, *(plotKey + key)))
             mplot.canvas.draw()
 
         print("done plotting")
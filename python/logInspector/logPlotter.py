@@ -1,16 +1,11 @@
-from ctypes import sizeof
-import math, allantools, sys, yaml, os
-from typing import List, Any, Union
+import math, sys, os
 
 import numpy as np
-import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
 from os.path import expanduser
-from inertialsense_math.pose import *
 from datetime import date, datetime
-import pandas as pd
 
-from ui import InteractiveLegend
+# allantools, pandas and matplotlib.pyplot are slow to import, so they are imported by the plots that use them
 
 BLACK = r"\u001b[30m"
 RED = r"\u001b[31m"
@@ -36,11 +31,19 @@ sys.path.append(os.path.normpath(file_path + '/..'))
 sys.path.append(os.path.normpath(file_path + '/../math/src'))
 
 from logReader import Log
-from pylib.ISToolsGNSS import refLla, getTimeFromGpsTowMs, getTimeFromGpsTow, setGpsWeek, getTimeFromGTime, setShowUtcTime
+from plotCache import PlotCache
+from pylib.ISToolsGNSS import refLla, getTimeFromGpsTowMs, getTimeFromGpsTow, setGpsWeek, getTimeFromGTime, setShowUtcTime, \
+    gnssEpochs, gnssSatList, gnssObsIndex, gnssObsCube
 from pylib.data_sets import *
-from inertialsense_math.pose import quat2euler, lla2ned, rotmat_ecef2ned, quatRot, quatConjRot, quat_ecef2ned
+from inertialsense_math.pose import quat2euler, lla2ned, rotmat_ecef2ned, quatRot, quatConjRot, quat_ecef2ned, mul_ConjQuat_Quat, \
+    unwrapAngle, continuousAngle
 import datetime
 
+def pyplot():
+    # Used only to create a figure when a plot is not given one, which the GUI and the exports never do
+    import matplotlib.pyplot as plt
+    return plt
+
 class logPlot: 
     def __init__(self, show=False, save=False, format='svg', log=None):
         self.show = show
@@ -52,7 +55,10 @@ class logPlot:
         self.xAxisSample = False
         self.utcTime = False
         self.enableLegends = False  # Enable interactive legends
+        self.plotCache = PlotCache()
+        self.savedFigures = []      # Paths of the figures saved by saveFig()
         if self.enableLegends:
+            from ui import InteractiveLegend    # Only needed for interactive legends
             self.legends = InteractiveLegend()
         if log:
             self.setLog(log)
@@ -69,6 +75,7 @@ class logPlot:
 
     def setLog(self, log):
         self.log = log
+        self.plotCache.clear()
         self.directory = log.directory
         self.setActiveSerials(self.log.serials)
         if len(self.log.data[0, DID_INS_2]):
@@ -99,6 +106,11 @@ class logPlot:
                 if ser != 'Ref INS':
                     self.active_devs_no_ref.append(d)
 
+    def cached(self, func, compute, *key):
+        # Returns compute() cached for the plot function, the active devices, the downsampling, the
+        # residual and UTC time settings and any additional key.  Cached data must not be modified.
+        return self.plotCache.get((func, tuple(self.active_devs), self.d, self.residual, self.utcTime) + key, compute)
+
     def configureSubplot(self, ax, title, ylabel='', xlabel=''):
         ax.set_title(title)
         ax.set_ylabel(ylabel)
@@ -120,10 +132,14 @@ class logPlot:
                     sizeInches = [11,8]
             fig.set_size_inches(sizeInches)
             directory = os.path.dirname(self.directory + '/figures/')
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-            fig.savefig(os.path.join(directory + "/" + name + '.' + self.format), bbox_inches='tight')
+            os.makedirs(directory, exist_ok=True)
+
+            # Write a temporary file and rename it, so plots saved by parallel exports never leave a partial file
+            path = os.path.join(directory + "/" + name + '.' + self.format)
+            tmpPath = '%s.%d.tmp' % (path, os.getpid())
+            fig.savefig(tmpPath, format=self.format, bbox_inches='tight')
+            os.replace(tmpPath, path)
+            self.savedFigures.append(path)
             fig.set_size_inches(restoreSize)
 
     def getData(self, dev, DID, field, removeLeadingZeros=0):
@@ -175,7 +191,7 @@ class logPlot:
 
     def posNED(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3, (2 if self.residual else 1), sharex=True, squeeze=False)
         self.configureSubplot(ax[0,0], 'North', 'm')
         self.configureSubplot(ax[1,0], 'East', 'm')
@@ -288,7 +304,7 @@ class logPlot:
 
     def posNEDMap(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         
         ax = fig.subplots(1,1)
         ax.set_xlabel('East (m)')
@@ -326,7 +342,7 @@ class logPlot:
 
     def gpsPosNEDMap(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(1,1)
         ax.set_xlabel('East (m)')
         ax.set_ylabel('North (m)')
@@ -365,7 +381,7 @@ class logPlot:
 
     def posLLA(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3,1, sharex=True)
         self.configureSubplot(ax[0], 'Latitude', 'deg')
         self.configureSubplot(ax[1], 'Longitude', 'deg')
@@ -404,7 +420,7 @@ class logPlot:
 
     def gpsLLA(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3,1, sharex=True)
         self.configureSubplot(ax[0], 'Latitude', 'deg')
         self.configureSubplot(ax[1], 'Longitude', 'deg')
@@ -439,7 +455,7 @@ class logPlot:
 
     def gpsPosNED(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(4,1, sharex=True)
         self.configureSubplot(ax[0], 'GPS North', 'm')
         self.configureSubplot(ax[1], 'GPS East', 'm')
@@ -489,7 +505,7 @@ class logPlot:
 
     def gpsVelNED(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(4, (2 if self.residual else 1), sharex=True, squeeze=False)
         self.configureSubplot(ax[0,0], 'GPS Velocity North', 'm/s')
         self.configureSubplot(ax[1,0], 'GPS Velocity East', 'm/s')
@@ -597,7 +613,7 @@ class logPlot:
 
     def velNED(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(4, (2 if self.residual else 1), sharex=True, squeeze=False)
         self.configureSubplot(ax[0,0], 'Vel North', 'm/s')
         self.configureSubplot(ax[1,0], 'Vel East',  'm/s')
@@ -677,47 +693,23 @@ class logPlot:
         return self.saveFigJoinAxes(ax, axs, fig, 'velNED')
 
     def angle_wrap(self, angle):
+        # Copy of angles constrained to [-pi, pi], any shape
         result = np.copy(angle)
-        for i in range(np.shape(result)[0]):
-            while result[i] > np.pi: 
-                result[i] -= 2*np.pi
-            while result[i] < -np.pi: 
-                result[i] += 2*np.pi
+        unwrapAngle(result.reshape(-1))
         return result
 
     def angle_unwrap(self, angle):
-        unwrap = 0.0
-        result = np.empty_like(angle)
-        anglePrev = angle[0]
-        for i in range(np.shape(angle)[0]):
-            result[i] = angle[i] + unwrap
-
-            deltaAngle = result[i]-anglePrev
-            if deltaAngle > np.pi:                
-                unwrap -= 2*np.pi
-                result[i] = angle[i] + unwrap
-            elif deltaAngle < -np.pi: 
-                unwrap += 2*np.pi
-                result[i] = angle[i] + unwrap
-
-            anglePrev = result[i]
-        return result
+        return continuousAngle(angle)
 
     def vec3_wrap(self, vec):
-        result = np.empty_like(vec)
-        for i in range(3):
-            result[:,i] = self.angle_wrap(vec[:,i])
-        return result
+        return self.angle_wrap(vec)
 
     def vec3_unwrap(self, vec):
-        result = np.empty_like(vec)
-        for i in range(3):
-            result[:,i] = self.angle_unwrap(vec[:,i])
-        return result
+        return continuousAngle(vec, axis=0)
 
     def velUVW(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(3, (2 if self.residual else 1), sharex=True, squeeze=False)
         fig.suptitle('INS uvw - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -796,7 +788,7 @@ class logPlot:
 
     def attitude(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(3, (2 if self.residual else 1), sharex=True, squeeze=False)
         fig.suptitle('INS Attitude - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -880,6 +872,7 @@ class logPlot:
         filepath = self.log.directory + "/enu.out"
         if ~os.path.isfile(filepath):
             return [], [], []
+        import pandas as pd
         df = pd.read_csv(filepath, skiprows=2, header=None, index_col=None, names=[ 'date', 'time', 'e-baseline', 'n-baseline', 'u-baseline', 'Q', 'ns', 'sde', 'sdn', 'sdu', 'sden', 'sdnu', 'sdue', 'age', 'ratio', 'baseline'], delim_whitespace=True)
 
         df['datetime'] = df[['date','time']].apply(lambda row: ' '.join(row.values.astype(str)), axis=1)
@@ -906,7 +899,7 @@ class logPlot:
 
     def heading(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3, (2 if self.residual else 1), sharex=True, squeeze=False)
         fig.suptitle('Heading - ' + os.path.basename(os.path.normpath(self.log.directory)))
         self.configureSubplot(ax[0,0], 'Magnetic Heading', 'deg')
@@ -1032,7 +1025,7 @@ class logPlot:
     def imuStatus(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
 
             for d in self.active_devs:
@@ -1125,7 +1118,7 @@ class logPlot:
     def insStatus(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
             fig.suptitle('INS Status - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -1249,7 +1242,7 @@ class logPlot:
     def hdwStatus(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
             fig.suptitle('Hardware Status - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -1366,7 +1359,7 @@ class logPlot:
     def genFaultCodes(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
             fig.suptitle('Gen Fault Codes - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -1475,7 +1468,7 @@ class logPlot:
     def gpxStatus(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
             fig.suptitle('GPX Status - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -1504,7 +1497,7 @@ class logPlot:
     def gpxHdwStatus(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(1, 1, sharex=True)
             fig.suptitle('GPX Hardware Status - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -1621,7 +1614,7 @@ class logPlot:
     def gpsStats(self, fig=None, axs=None, did_gps_pos=DID_GPS1_POS):
         # try:
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 1, sharex=True, gridspec_kw={'height_ratios': [1, 2, 2, 2, 1, 1]})
         did_gps_vel = did_gps_pos+(DID_GPS1_VEL-DID_GPS1_POS)
@@ -1697,7 +1690,7 @@ class logPlot:
         # try:
         n_plots = 6
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(n_plots, 1, sharex=True)
         fig.suptitle('RTK ' + name + ' Stats - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -1750,7 +1743,7 @@ class logPlot:
         # try:
         n_plots = 2
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(n_plots, 1, sharex=True)
         fig.suptitle('RTK ' + name + ' Stats - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -1797,7 +1790,7 @@ class logPlot:
         Nf = 2
         n_plots = 8
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(n_plots, 1, sharex=True)
         fig.suptitle('GNSS Receiver Observations')
@@ -1810,57 +1803,19 @@ class logPlot:
         self.configureSubplot(ax[6], 'L1 LLI')
         self.configureSubplot(ax[7], 'L5 LLI')
 
+        # Satellites with valid L1 observations and their observation arrays by epoch
+        def satObs(gps_data):
+            t, dt, nsat, epoch = gnssEpochs(gps_data)
+            obs = gps_data.obs[epoch >= 0]
+            epoch = epoch[epoch >= 0]
+            sat = gnssSatList(obs['sat'], (obs['time']['time'] > 0) & (obs['P'][:, 0] > 0) & (obs['L'][:, 0] > 0))
+            return (sat,) + gnssObsCube(obs, epoch, len(t), sat)
+
         for i, d in enumerate(self.active_devs):
             gps_data = self.log.data[d, relDid][0]
-            N = len(gps_data)
-
-            # Build satellite array
-            sat = np.empty(0, dtype=int)
-            for j in range(N):
-                obs = gps_data[j]
-                M = len(obs)
-                for k in range(M):
-                    sat_k = obs['sat'][k]
-                    # add satellite if not in the list and if L1 observations are valid
-                    if ( sat_k != 0 and (sat_k not in sat) and 
-                         obs['time']['time'][k] > 0 and obs['P'][k][0] > 0 and obs['L'][k][0] > 0 ):
-                        sat = np.append(sat, sat_k)
-
-            Nsat = len(sat)
-            tgps = np.zeros([N, Nsat])
-            P = np.empty([Nf, N, Nsat])
-            L = np.empty([Nf, N, Nsat])
-            D = np.empty([Nf, N, Nsat])
-            LLI  = np.empty([Nf, N, Nsat])
-            P[:] = np.nan
-            L[:] = np.nan
-            D[:] = np.nan
-            LLI[:]  = np.nan
-
-            # Fill observation arrays
-            for j in range(N):
-                obs = gps_data[j]
-                M = len(obs)
-                for k in range(M):
-                    sat_k = obs['sat'][k]
-                    if sat_k == 0:
-                        continue
-                    indo = np.where(obs['sat'] == sat_k)
-                    inds = np.where(sat == sat_k)
-                    if np.size(indo) == 0 or np.size(inds) == 0:
-                        continue
-                    indo = indo[0][0]
-                    inds = inds[0][0]
-                    tgps[j,inds] = obs['time']['time'][indo] + obs['time']['sec'][indo]
-                    # Use only non-zero pseudorange and phase
-                    indP = np.flatnonzero(obs['P'][indo])
-                    indL = np.flatnonzero(obs['L'][indo])
-                    indD = np.flatnonzero(obs['D'][indo])
-                    if np.size(indP) > 0 and np.size(indL) > 0:
-                        P[indP,j,inds] = obs['P'][indo][indP]
-                        L[indL,j,inds] = obs['L'][indo][indL]
-                        D[indD,j,inds] = obs['D'][indo][indD]
-                        LLI[:,j,inds]  = obs['LLI'][indo]
+            if not len(gps_data):
+                continue
+            sat, tgps, P, L, D, LLI = self.cached('rtkObs', lambda: satObs(gps_data), d, relDid)
 
             for k in range(len(sat)):
                 ind = np.where(tgps[:,k] != 0.0)
@@ -1889,10 +1844,9 @@ class logPlot:
 
     def rtkObsSingleDiff(self, fig=None, axs=None):
         name = "Compassing"
-        Nf = len(self.log.data[0, DID_GPS1_RAW][0][0]['P'][0])
         n_plots = 4
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(n_plots, 1, sharex=True)
         fig.suptitle('RTK Rover-Base Single Differences')
@@ -1901,133 +1855,62 @@ class logPlot:
         self.configureSubplot(ax[2], 'L1 Carier phase difference', 'cycles')
         self.configureSubplot(ax[3], 'L5 Carier phase difference', 'cycles')
 
-        for id_, d in enumerate(self.active_devs):
+        # Epoch times and the observations of the epochs with their epoch index
+        def mergeEpochs(gps_data):
+            t, dt, nsat, epoch = gnssEpochs(gps_data)
+            return t, gps_data.obs[epoch >= 0], epoch[epoch >= 0]
 
-            gps1_data = self.log.data[d, DID_GPS1_RAW][0]
-            gps2_data = self.log.data[d, DID_GPS2_RAW][0]
-
-            # Reassemble multiple chunks of data by timestamp
-            t1 = np.empty(0)
-            del_ind = np.empty(0, dtype=int)
-            for j in range(len(gps1_data)):
-                ind = np.flatnonzero(gps1_data[j]['time']['time'])
-                if len(ind) == 0:
-                    # Empty chunk of data (all time stamps are zero)
-                    del_ind = np.append(del_ind, j)
-                    continue
-                ind = ind[0]
-                t_ = gps1_data[j]['time']['time'][ind] + gps1_data[j]['time']['sec'][ind]
-                if j > 0 and t_ == t1[-1]:
-                    # add chunk to the previous data and mark for deletion
-                    gps1_data[j-1] = np.append(gps1_data[j-1], gps1_data[j])
-                    del_ind = np.append(del_ind, j)
-                    continue
-                else:
-                    # new data
-                    t1 = np.append(t1, t_)
-            gps1_data = np.asarray(gps1_data, dtype = object) # newer Numpy can't delete inhomogeneous arrays unless we set dtype=object
-            gps1_data = np.delete(gps1_data, del_ind)
-
-            t2 = np.empty(0)
-            del_ind = np.empty(0, dtype=int)
-            for j in range(len(gps2_data)):
-                ind = np.flatnonzero(gps2_data[j]['time']['time'])
-                if len(ind) == 0:
-                    # Empty chunk of data (all time stamps are zero)
-                    del_ind = np.append(del_ind, j)
-                    continue
-                ind = ind[0]
-                t_ = gps2_data[j]['time']['time'][ind] + gps2_data[j]['time']['sec'][ind]
-                if j > 0 and t_ == t2[-1]:
-                    # add chunk to the previous data and mark for deletion
-                    gps2_data[j-1] = np.append(gps2_data[j-1], gps2_data[j])
-                    del_ind = np.append(del_ind, j)
-                    continue
-                else:
-                    # new data
-                    t2 = np.append(t2, t_)
-            gps2_data = np.asarray(gps2_data, dtype = object) # newer Numpy can't delete inhomogeneous arrays unless we set dtype=object
-            gps2_data = np.delete(gps2_data, del_ind)
+        # Satellites with valid L1 observations
+        def validSats(obs):
+            return gnssSatList(obs['sat'], (obs['time']['time'] > 0) & (obs['P'][:,0] > 0) & (obs['L'][:,0] > 0))
 
-            N1 = len(gps1_data)
-            N2 = len(gps2_data)
+        # Single differences of the satellites in both GPS1 and GPS2 data at their common epochs,
+        # or None if the epochs do not match
+        def singleDiff(d):
+            t1, obs1, epoch1 = mergeEpochs(self.log.data[d, DID_GPS1_RAW][0])
+            t2, obs2, epoch2 = mergeEpochs(self.log.data[d, DID_GPS2_RAW][0])
 
             # Build common satellite array for gps1 and gps2
-            sat = np.empty(0, dtype=int)
-            for j in range(N1):
-                obs = gps1_data[j]
-                M = len(obs)
-                for k in range(M):
-                    sat_k = obs['sat'][k]
-                    # add satellite if not in the list and if L1 observations are valid
-                    if ( sat_k != 0 and (sat_k not in sat) and 
-                         obs['time']['time'][k] > 0 and obs['P'][k][0] > 0 and obs['L'][k][0] > 0 ):
-                        sat = np.append(sat, sat_k)
-            sat2 = np.empty(0, dtype=int)
-            for j in range(N2):
-                obs = gps2_data[j]
-                M = len(obs)
-                for k in range(M):
-                    sat_k = obs['sat'][k]
-                    # add satellite if not in the list and if L1 observations are valid
-                    if ( sat_k != 0 and (sat_k not in sat2) and 
-                         obs['time']['time'][k] > 0 and obs['P'][k][0] > 0 and obs['L'][k][0] > 0 ):
-                        sat2 = np.append(sat2, sat_k)
-            del_ind = np.empty(0, dtype = int)
-            for is_, j in enumerate(sat):
-                if j not in sat2:
-                    del_ind = np.append(del_ind, is_)
-            sat = np.delete(sat, del_ind)
+            sat = validSats(obs1)
+            sat = sat[np.isin(sat, validSats(obs2))]
 
             # Build array of common timestamps for gps1 and gps2
-            del_ind = np.empty(0, dtype = int)
-            for j in range(N1):
-                if t1[j] not in t2:
-                    del_ind = np.append(del_ind, j)
-            gps1_data = np.asarray(gps1_data, dtype = object) # newer Numpy can't delete inhomogeneous arrays unless we set dtype=object
-            gps1_data = np.delete(gps1_data, del_ind)
-            t1 = np.delete(t1, del_ind)
-            N1 = len(gps1_data)
-
-            del_ind = np.empty(0, dtype = int)
-            t = np.empty(0, dtype=int)
-            for j in range(N2):
-                if t2[j] not in t1:
-                    del_ind = np.append(del_ind, j)
-            gps2_data = np.asarray(gps2_data, dtype = object) # newer Numpy can't delete inhomogeneous arrays unless we set dtype=object
-            gps2_data = np.delete(gps2_data, del_ind)
-            t2 = np.delete(t2, del_ind)
-            N2 = len(gps2_data)
+            common1 = np.isin(t1, t2)
+            common2 = np.isin(t2, t1)
+            N1 = np.count_nonzero(common1)
+            N2 = np.count_nonzero(common2)
             if (N1 != N2): 
-                continue
+                return None
+            t1 = t1[common1]
+            # Index of each merged epoch in the common timestamps, -1 if not common
+            ind1 = np.cumsum(common1) - 1
+            ind2 = np.cumsum(common2) - 1
+            ind1[~common1] = -1
+            ind2[~common2] = -1
+            keep1 = ind1[epoch1] >= 0
+            keep2 = ind2[epoch2] >= 0
+            idx1 = gnssObsIndex(ind1[epoch1[keep1]], obs1['sat'][keep1], N1, sat)
+            idx2 = gnssObsIndex(ind2[epoch2[keep2]], obs2['sat'][keep2], N2, sat)
+            obs1 = obs1[keep1]
+            obs2 = obs2[keep2]
+
+            # Compute single differences where the satellite is present in both gps1 and gps2 data,
+            # using only non-zero pseudorange and phase
+            both = (idx1 >= 0) & (idx2 >= 0)
+            o1 = obs1[np.where(both, idx1, 0)] if len(obs1) else np.zeros(both.shape, dtype=obs1.dtype)
+            o2 = obs2[np.where(both, idx2, 0)] if len(obs2) else np.zeros(both.shape, dtype=obs2.dtype)
+            valid = (both[..., None] & (o1['P'] != 0) & (o2['P'] != 0)).transpose((2, 0, 1))
+            delta_P = np.where(valid, (o1['P'] - o2['P']).transpose((2, 0, 1)), np.nan)
+            delta_L = np.where(valid, (o1['L'] - o2['L']).transpose((2, 0, 1)), np.nan)
+            return (t1, sat, delta_P, delta_L)
 
+        for id_, d in enumerate(self.active_devs):
+            sd = self.cached('rtkObsSingleDiff', lambda: singleDiff(d), d)
+            if sd is None:
+                continue
+            t1, sat, delta_P, delta_L = sd
+            N1 = len(t1)
             Nsat = len(sat)
-            delta_P = np.empty([Nf, N1, Nsat])
-            delta_L = np.empty([Nf, N1, Nsat])
-            delta_P[:] = np.nan
-            delta_L[:] = np.nan
-
-            # Compute single differences
-            for j in range(N1):
-                obs1 = gps1_data[j]
-                obs2 = gps2_data[j]
-
-                for k in range(Nsat):
-                    sat_k = sat[k]
-                    # is this satellite present in both gps1 and gps2 data?
-                    ind1 = np.where(obs1['sat'] == sat_k)
-                    ind2 = np.where(obs2['sat'] == sat_k)
-                    if np.size(ind1) == 0 or np.size(ind2) == 0:
-                        continue
-                    ind1 = ind1[0][0]
-                    ind2 = ind2[0][0]
-
-                    # Use only non-zero pseudorange and phase
-                    indval1 = np.flatnonzero(obs1['P'][ind1])
-                    indval2 = np.flatnonzero(obs2['P'][ind2])
-                    if np.size(indval1) > 0 and np.size(indval2) > 0:
-                        delta_P[:,j,k] = obs1['P'][ind1][indval1] - obs2['P'][ind2][indval2]
-                        delta_L[:,j,k] = obs1['L'][ind1][indval1] - obs2['L'][ind2][indval2]
 
             for k in range(Nsat):
                 # Do not plot satellites that appeared only for a short time
@@ -2057,7 +1940,7 @@ class logPlot:
         # try:
         n_plots = 10
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(5, 2, sharex=True)
         fig.suptitle('RTK ' + name + ' Misc - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -2107,7 +1990,7 @@ class logPlot:
         # try:
         n_plots = 3
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(3, 1, sharex=True)
         fig.suptitle('RTK Rel - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -2128,63 +2011,63 @@ class logPlot:
 
     def gnssEphemeris(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
-
-        # Build array of SV present in the logs
-        sv = np.empty(0, dtype = int)
-        for d in self.active_devs:
-            satData1 = self.log.data[d, DID_GPS1_SAT]
-            if satData1.size == 0:
-                continue
-            for data in satData1:
-                rng = range(data['numSats'])
-                gnss = data['sat'][rng]['gnssId']
-                sat = data['sat'][rng]['svId']
-                sat[gnss==3] = sat[gnss==3] + 32
-                ind_new = ~np.isin(sat, sv)
-                if any(ind_new):
-                    sv = np.append(sv, sat[ind_new])
-        Nsat = len(sv)
-        if Nsat == 0:
-            return
-        sv = np.sort(sv)
+            fig = pyplot().figure()
+
+        # Satellites of each DID_GPS1_SAT sample: (sample index, RTKlib prn, status)
+        def satObs(satData):
+            rows, cols = np.nonzero(np.arange(satData['sat'].shape[1]) < satData['numSats'][:, None])
+            sats = satData['sat'][rows, cols]
+            # convert SV prn to RTKlib prn: add 32 (max number of GPS satellites) to Galileo, assuming no GLONASS satellites in the data (PRN sequence: [GPS, Galileo])
+            sat = sats['svId'] + np.where(sats['gnssId'] == 3, 32, 0)
+            return rows, sat, sats['status'] >> 12 & 0x7
+
+        # SV with ephemeris entries and the ephemeris counts (samples x Nsat) and time of each device
+        def ephemeris():
+            # Build array of SV present in the logs
+            sv = np.empty(0, dtype = int)
+            for d in self.active_devs:
+                satData1 = self.log.data[d, DID_GPS1_SAT]
+                if satData1.size == 0:
+                    continue
+                sv = np.append(sv, satObs(satData1)[1])
+            sv = gnssSatList(sv, sort=True)
+            if len(sv) == 0:
+                return (sv, {}, {})
 
-        # Array of ephemeris counts (Nsat x samples x Ndevices)
-        ephData = np.zeros([Nsat, len(satData1), len(self.active_devs)])
-        for d in self.active_devs:
-            satData1 = self.log.data[d, DID_GPS1_SAT]
-            time = getTimeFromGpsTowMs(satData1['timeOfWeekMs'], 1)
-            for i, data in enumerate(satData1):
-                rng = range(data['numSats'])
-                status = data['sat'][rng]['status'] >> 12 & 0x7
-                gnss = data['sat'][rng]['gnssId']
-                sat = data['sat'][rng]['svId']
-                # convert SV prn to RTKlib prn: add 32 (max number of GPS satellites) to Galileo, assuming no GLONASS satellites in the data (PRN sequence: [GPS, Galileo])
-                sat[gnss==3] = sat[gnss==3] + 32
-                ephData[np.isin(sv,sat),i,d] = status[rng]
-
-        # Delete SV that have zero ephemeris entries
-        ind = ephData > 0
-        del_ind = []
-        for j, sat in enumerate(sv):
-            if not any(ind[j,:,:]):
-                del_ind.append(j)
-        sv = np.delete(sv, del_ind)
-        ephData = np.delete(ephData, (del_ind), axis=0)
+            time = {}
+            ephData = {}
+            for d in self.active_devs:
+                satData1 = self.log.data[d, DID_GPS1_SAT]
+                if satData1.size == 0:
+                    continue
+                rows, sat, status = satObs(satData1)
+                index = gnssObsIndex(rows, sat, len(satData1), sv)
+                time[d] = getTimeFromGpsTowMs(satData1['timeOfWeekMs'], 1)
+                ephData[d] = np.where(index >= 0, status[np.maximum(index, 0)], 0) if len(status) else np.zeros(index.shape)
+
+            # Delete SV that have zero ephemeris entries
+            keep = np.zeros(len(sv), dtype=bool)
+            for d in ephData:
+                keep |= (ephData[d] > 0).any(axis=0)
+            for d in ephData:
+                ephData[d] = ephData[d][:, keep]
+            return (sv[keep], time, ephData)
+
+        sv, time, ephData = self.cached('gnssEphemeris', ephemeris)
         Nsat = len(sv)
         if Nsat == 0:
             return
 
         cols = 4
         rows = math.ceil(Nsat/float(cols))
-        ax = fig.subplots(rows, cols, sharex=True)
+        ax = fig.subplots(rows, cols, sharex=True, squeeze=False)
         fig.suptitle('Ephemeris Counters - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
-        for d in self.active_devs:
+        for d in ephData:
             for j, sat in enumerate(sv):
                 ax[j % rows, j // rows].set_title('SV '+ str(sat))
                 ax[j % rows, j // rows].title.set_fontsize(8)
-                ax[j % rows, j // rows].plot(time, ephData[j,:,d], label=self.log.serials[d])
+                ax[j % rows, j // rows].plot(time[d], ephData[d][:,j], label=self.log.serials[d])
 
         self.legends_add(ax[0,0].legend(ncol=2))
         for a in ax:
@@ -2194,10 +2077,10 @@ class logPlot:
 
 
     def loadGyros(self, device, useImu3=False):
-        return self.loadIMU(device, accelSensor=0, useImu3=useImu3)
+        return self.cached('loadIMU', lambda: self.loadIMU(device, accelSensor=0, useImu3=useImu3), device, 0, useImu3)
 
     def loadAccels(self, device, useImu3=False):
-        return self.loadIMU(device, accelSensor=1, useImu3=useImu3)
+        return self.cached('loadIMU', lambda: self.loadIMU(device, accelSensor=1, useImu3=useImu3), device, 1, useImu3)
 
     def loadIMU(self, device, accelSensor, useImu3=False):   # 0 = gyro, 1 = accelerometer
         imu1 = None
@@ -2313,7 +2196,7 @@ class logPlot:
 
     def imuPQR(self, fig=None, axs=None, useImu3=False, combineImu3=False):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         refTime = []
         refPqr = []
@@ -2398,7 +2281,7 @@ class logPlot:
 
     def imuAcc(self, fig=None, axs=None, useImu3=False, combineImu3=False):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         refTime = []
         refAcc = []
@@ -2479,9 +2362,25 @@ class logPlot:
         self.setup_and_wire_legend()
         return self.saveFigJoinAxes(ax, axs, fig, 'accIMU')
 
+    def allanDeviation(self, x, dt, rwTau):
+        # Overlapping Allan deviation, random walk at rwTau and bias instability
+        dtMean = np.mean(dt)
+        # Averaging window tau values from dt to dt*Nsamples/10
+        t = np.logspace(np.log10(dtMean), np.log10(0.1*np.sum(dt)), 200)
+        # Compute the overlapping ADEV
+        import allantools
+        (t2, ad, ade, adn) = allantools.oadev(x, rate=1/(dtMean/self.d), data_type="freq", taus=t)
+        # Compute random walk and bias instability
+        t_bi_max = 1000
+        idx_max = (np.abs(t2 - t_bi_max)).argmin()
+        bi = np.amin(ad[0:idx_max])
+        rw_idx = (np.abs(t2 - rwTau)).argmin()
+        rw = ad[rw_idx] * np.sqrt(t2[rw_idx])
+        return (t2, ad, rw, bi)
+
     def allanVariancePQR(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         (name, time, dt, snr0, snr1, snr2, snrCount) = self.loadGyros(0)
         ax = fig.subplots(3, snrCount, sharex=True, squeeze=False)
@@ -2502,20 +2401,10 @@ class logPlot:
             (name, time, dt, snr0, snr1, snr2, snrCount) = self.loadGyros(d)
 
             if snrCount:
-                dtMean = np.mean(dt)
                 for i in range(3):
                     for n, pqr in enumerate([ snr0, snr1, snr2 ]):
                         if np.all(pqr) != None and n<snrCount:
-                            # Averaging window tau values from dt to dt*Nsamples/10
-                            t = np.logspace(np.log10(dtMean), np.log10(0.1*np.sum(dt)), 200)
-                            # Compute the overlapping ADEV
-                            (t2, ad, ade, adn) = allantools.oadev(pqr[:,i], rate=1/(dtMean/self.d), data_type="freq", taus=t)
-                            # Compute random walk and bias instability
-                            t_bi_max = 1000
-                            idx_max = (np.abs(t2 - t_bi_max)).argmin()
-                            bi = np.amin(ad[0:idx_max])
-                            rw_idx = (np.abs(t2 - 1.0)).argmin()
-                            rw = ad[rw_idx] * np.sqrt(t2[rw_idx])
+                            (t2, ad, rw, bi) = self.cached('allanVariancePQR', lambda: self.allanDeviation(pqr[:,i], dt, 1.0), d, n, i)
                             
                             ax[i, n].loglog(t2, ad * RAD2DEG * 3600, label='%s: %.2g, %.2g' % (self.log.serials[d], rw * RAD2DEG * 3600/RTHR2RTS, bi * RAD2DEG * 3600))
 
@@ -2575,7 +2464,7 @@ class logPlot:
 
     def allanVarianceAcc(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         (name, time, dt, snr0, snr1, snr2, snrCount) = self.loadAccels(0)
         ax = fig.subplots(3, snrCount, sharex=True, squeeze=False)
@@ -2596,21 +2485,11 @@ class logPlot:
         for d in self.active_devs:
             (namae, time, dt, snr0, snr1, snr2, snrCount) = self.loadAccels(d)
 
-            dtMean = np.mean(dt)
             for i in range(3):
                 for n, acc in enumerate([ snr0, snr1, snr2 ]):
                     if np.all(acc) != None and n<snrCount:
                         if acc.any(None):
-                            # Averaging window tau values from dt to dt*Nsamples/10
-                            t = np.logspace(np.log10(dtMean), np.log10(0.1*np.sum(dt)), 200)
-                            # Compute the overlapping ADEV
-                            (t2, ad, ade, adn) = allantools.oadev(acc[:,i], rate=1/(dtMean/self.d), data_type="freq", taus=t)
-                            # Compute random walk and bias instability
-                            t_bi_max = 1000
-                            idx_max = (np.abs(t2 - t_bi_max)).argmin()
-                            bi = np.amin(ad[0:idx_max])
-                            rw_idx = (np.abs(t2 - 0.1)).argmin()
-                            rw = ad[rw_idx] * np.sqrt(t2[rw_idx])
+                            (t2, ad, rw, bi) = self.cached('allanVarianceAcc', lambda: self.allanDeviation(acc[:,i], dt, 0.1), d, n, i)
 
                             ax[i, n].loglog(t2, ad, label='%s: %.2g, %.2g' % (self.log.serials[d], rw * RTHR2RTS, bi))
 
@@ -2654,9 +2533,22 @@ class logPlot:
 
         return self.saveFigJoinAxes(ax, axs, fig, 'accIMU')
 
+    def powerSpectralDensity(self, x, N, dt, Nf):
+        # One-sided power spectral density of the 3 columns of x at the first Nf frequencies
+        psd = np.zeros((Nf, 3))
+        # 1/T = frequency
+        Fs = 1 / np.mean(dt)
+        f = np.linspace(0, 0.5*Fs, Nf)
+        for i in range(3):
+            sp0 = np.fft.fft(x[:,i])
+            sp0 = sp0[:Nf]
+            psd[:,i] = 1/N/Fs * np.abs(sp0)**2
+            psd[1:-1,i] = 2 * psd[1:-1,i]
+        return (f, psd)
+
     def accelPSD(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         (name, time, dt, snr0, snr1, snr2, snrCount) = self.loadAccels(0)
         ax = fig.subplots(3, snrCount, sharex=True, squeeze=False)
@@ -2671,21 +2563,10 @@ class logPlot:
                 refAcc = refVel / refDt[:,None]
 
             N = time.size
-            psd = np.zeros((N//2, 3))
-            # 1/T = frequency
-            Fs = 1 / np.mean(dt)
-            f = np.linspace(0, 0.5*Fs, N // 2)
 
             for n, acc in enumerate([ snr0, snr1, snr2 ]):
                 if np.all(acc) != None and n<snrCount:
-                    for i in range(3):
-                        sp0 = np.fft.fft(acc[:,i] / 9.8)
-                        sp0 = sp0[:N // 2]
-                        # psd = abssp*abssp
-                        # freq = np.fft.fftfreq(time.shape[-1])
-        #                    np.append(psd, [1/N/Fs * np.abs(sp0)**2], axis=1)
-                        psd[:,i] = 1/N/Fs * np.abs(sp0)**2
-                        psd[1:-1,i] = 2 * psd[1:-1,i]
+                    (f, psd) = self.cached('accelPSD', lambda: self.powerSpectralDensity(acc / 9.8, N, dt, N // 2), d, n)
 
                     for i in range(3):
                         axislable = 'X' if (i == 0) else 'Y' if (i==1) else 'Z'
@@ -2708,7 +2589,7 @@ class logPlot:
 
     def gyroPSD(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         (name, time, dt, snr0, snr1, snr2, snrCount) = self.loadGyros(0)
         ax = fig.subplots(3, snrCount, sharex=True, squeeze=False)
@@ -2723,22 +2604,10 @@ class logPlot:
                 refGyr = refTheta / refDt[:,None]
 
             N = time.size
-            Nhalf = N // 2 + 1
-            psd = np.zeros((Nhalf, 3))
-            # 1/T = frequency
-            Fs = 1 / np.mean(dt)
-            f = np.linspace(0, 0.5*Fs, Nhalf)
 
             for n, pqr in enumerate([ snr0, snr1, snr2 ]):
                 if np.all(pqr) != None and n<snrCount:
-                    for i in range(3):
-                        sp0 = np.fft.fft(pqr[:,i] * 180.0/np.pi)
-                        sp0 = sp0[:Nhalf]
-                        # psd = abssp*abssp
-                        # freq = np.fft.fftfreq(time.shape[-1])
-            #                    np.append(psd, [1/N/Fs * np.abs(sp0)**2], axis=1)
-                        psd[:,i] = 1/N/Fs * np.abs(sp0)**2
-                        psd[1:-1,i] = 2 * psd[1:-1,i]
+                    (f, psd) = self.cached('gyroPSD', lambda: self.powerSpectralDensity(pqr * 180.0/np.pi, N, dt, N // 2 + 1), d, n)
 
                     for i in range(3):
                         axislable = 'P' if (i == 0) else 'Q' if (i==1) else 'R'
@@ -2761,7 +2630,7 @@ class logPlot:
 
     def altitude(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(4, 1, sharex=True)
 
         self.configureSubplot(ax[0], 'Altitude: Barometer', 'm')
@@ -2810,7 +2679,7 @@ class logPlot:
 
     def climbRate(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3, 1, sharex=True)
 
         self.configureSubplot(ax[0], 'Climb Rate: Barometer', 'm/s')
@@ -2852,7 +2721,7 @@ class logPlot:
 
     def barometer(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3, 1, sharex=True)
 
         self.configureSubplot(ax[0], 'Baro MSL', 'm')
@@ -2879,7 +2748,7 @@ class logPlot:
 
     def magnetometer(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3, 1, sharex=True)
 
         self.configureSubplot(ax[0], 'Mag X', 'gauss')
@@ -2924,7 +2793,7 @@ class logPlot:
     def temp(self, fig=None, axs=None):
         try:
             if fig is None:
-                fig = plt.figure()
+                fig = pyplot().figure()
             ax = fig.subplots(3, 1, sharex=True)
             fig.suptitle('Temperature - ' + os.path.basename(os.path.normpath(self.log.directory)))
 
@@ -2956,7 +2825,7 @@ class logPlot:
 
     def debugfArr(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(5,2, sharex=True)
         fig.suptitle('Debug float Array - ' + os.path.basename(os.path.normpath(self.log.directory)))
         for d in self.active_devs:
@@ -2971,7 +2840,7 @@ class logPlot:
 
     def debugiArr(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(5,2, sharex=True)
         fig.suptitle('Debug int array - ' + os.path.basename(os.path.normpath(self.log.directory)))
         for d in self.active_devs:
@@ -2986,7 +2855,7 @@ class logPlot:
 
     def debuglfArr(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(3,1, sharex=True)
         fig.suptitle('Debug double Array - ' + os.path.basename(os.path.normpath(self.log.directory)))
         for d in self.active_devs:
@@ -3000,7 +2869,7 @@ class logPlot:
 
     def gpxDebugfArray(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(5,2, sharex=True)
         fig.suptitle('GPX Debug float Array - ' + os.path.basename(os.path.normpath(self.log.directory)))
         for d in self.active_devs:
@@ -3015,7 +2884,7 @@ class logPlot:
 
     def gpxDebugiArray(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(5,2, sharex=True)
         fig.suptitle('GPX Debug int array - ' + os.path.basename(os.path.normpath(self.log.directory)))
         for d in self.active_devs:
@@ -3030,7 +2899,7 @@ class logPlot:
 
     def magDec(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(2, 1, sharex=True)
         fig.suptitle('Magnetometer Declination - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -3053,7 +2922,7 @@ class logPlot:
 
     def deltatime(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         refImuPresent = False
         for d in self.active_devs:
@@ -3159,7 +3028,7 @@ class logPlot:
 
     def gpsTime(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         refImuPresent = False
         for d in self.active_devs:
@@ -3214,7 +3083,7 @@ class logPlot:
 
     def gpsRawTime(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 1, sharex=True)
         fig.suptitle('Timestamps - ' + os.path.basename(os.path.normpath(self.log.directory)))
@@ -3226,62 +3095,10 @@ class logPlot:
         self.configureSubplot(ax[5], 'GPS Base Raw Number of Satellites Observed', 's')
 
         for d in self.active_devs:
-            N1 = len(self.log.data[d, DID_GPS1_RAW][0])
-            N2 = len(self.log.data[d, DID_GPS2_RAW][0])
-            NB = len(self.log.data[d, DID_GPS_BASE_RAW][0])
-            tgps1 = np.zeros(N1)
-            nsat1 = np.zeros(N1)
-            tgps2 = np.zeros(N2)
-            nsat2 = np.zeros(N2)
-            tgpsB = np.zeros(NB)
-            nsatB = np.zeros(NB)
-            cnt = 0
-            for iobs in range(N1):
-                ns = round(len(self.log.data[d, DID_GPS1_RAW][0][iobs]) * 0.5) # 0.5 because there is a bug that pads half of the data with zeros
-                t0 = self.log.data[d, DID_GPS1_RAW][0][iobs]['time']['time'][-1] + \
-                     self.log.data[d, DID_GPS1_RAW][0][iobs]['time']['sec'][-1]
-                nsat1[cnt] = nsat1[cnt] + ns
-                tgps1[cnt] = t0
-                if iobs < N1 - 1:
-                    t1 = self.log.data[d, DID_GPS1_RAW][0][iobs + 1]['time']['time'][-1] + \
-                         self.log.data[d, DID_GPS1_RAW][0][iobs + 1]['time']['sec'][-1]
-                    if t1 > t0 + 0.01:
-                        cnt = cnt + 1
-            tgps1 = tgps1[0: cnt + 1]
-            nsat1 = nsat1[0: cnt + 1]
-            cnt = 0
-            for iobs in range(N2):
-                ns = round(len(self.log.data[d, DID_GPS2_RAW][0][iobs]) * 0.5) # 0.5 because there is a bug that pads half of the data with zeros
-                t0 = self.log.data[d, DID_GPS2_RAW][0][iobs]['time']['time'][-1] + \
-                     self.log.data[d, DID_GPS2_RAW][0][iobs]['time']['sec'][-1]
-                nsat2[cnt] = nsat2[cnt] + ns
-                tgps2[cnt] = t0
-                if iobs < N2 - 1:
-                    t1 = self.log.data[d, DID_GPS2_RAW][0][iobs + 1]['time']['time'][-1] + \
-                         self.log.data[d, DID_GPS2_RAW][0][iobs + 1]['time']['sec'][-1]
-                    if t1 > t0 + 0.01:
-                        cnt = cnt + 1
-            tgps2 = tgps2[0: cnt + 1]
-            nsat2 = nsat2[0: cnt + 1]
-            cnt = 0
-            for iobs in range(NB):
-                ns = round(len(self.log.data[d, DID_GPS_BASE_RAW][0][iobs]) * 0.5) # 0.5 because there is a bug that pads half of the data with zeros
-                t0 = self.log.data[d, DID_GPS_BASE_RAW][0][iobs]['time']['time'][-1] + \
-                     self.log.data[d, DID_GPS_BASE_RAW][0][iobs]['time']['sec'][-1]
-                nsatB[cnt] = nsatB[cnt] + ns
-                tgpsB[cnt] = t0
-                if iobs < NB - 1:
-                    t1 = self.log.data[d, DID_GPS_BASE_RAW][0][iobs + 1]['time']['time'][-1] + \
-                         self.log.data[d, DID_GPS_BASE_RAW][0][iobs + 1]['time']['sec'][-1]
-                    if t1 > t0 + 0.01:
-                        cnt = cnt + 1
-            tgpsB = tgpsB[0: cnt + 1]
-            nsatB = nsatB[0: cnt + 1]
-            dtGps1 = tgps1[1:] - tgps1[0:-1]
-#            dtGps1 = dtGps1 / self.d
-            dtGps2 = tgps2[1:] - tgps2[0:-1]
-#            dtGps2 = dtGps2 / self.d
-            dtGpsB = tgpsB[1:] - tgpsB[0:-1]
+            # Chunks less than 10 ms apart are one epoch
+            tgps1, dtGps1, nsat1, _ = gnssEpochs(self.log.data[d, DID_GPS1_RAW][0], 0.01)
+            tgps2, dtGps2, nsat2, _ = gnssEpochs(self.log.data[d, DID_GPS2_RAW][0], 0.01)
+            tgpsB, dtGpsB, nsatB, _ = gnssEpochs(self.log.data[d, DID_GPS_BASE_RAW][0], 0.01)
 
             ax[0].plot(tgps1[1:], dtGps1, label=self.log.serials[d])
             ax[1].plot(tgps2[1:], dtGps2)
@@ -3306,7 +3123,7 @@ class logPlot:
 
     def ekfBiases(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         ax = fig.subplots(4, 2, sharex=True)
         self.configureSubplot(ax[0,0], 'bias P', 'deg/s')
         self.configureSubplot(ax[1,0], 'bias Q', 'deg/s')
@@ -3338,7 +3155,7 @@ class logPlot:
 
     def rtkResiduals(self, type, page, fig=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         if type == 'phase':
             did = DID_RTK_PHASE_RESIDUAL
@@ -3366,7 +3183,7 @@ class logPlot:
 
     def rtkDebugP1(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         rtkData = self.log.data[0, DID_RTK_DEBUG]
         if rtkData.size == 0:
@@ -3420,7 +3237,7 @@ class logPlot:
 
     def rtkDebugP2(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         rtkData = self.log.data[0, DID_RTK_DEBUG]
         if rtkData.size == 0:
@@ -3474,7 +3291,7 @@ class logPlot:
 
     def rtkDebug2(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 4, sharex=True)
 
@@ -3507,7 +3324,7 @@ class logPlot:
 
     def rtkDebug2Sat(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 4, sharex=True)
 
@@ -3540,7 +3357,7 @@ class logPlot:
 
     def rtkDebug2Std(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 4, sharex=True)
 
@@ -3573,7 +3390,7 @@ class logPlot:
 
     def rtkDebug2Lock(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         ax = fig.subplots(6, 4, sharex=True)
 
@@ -3606,7 +3423,7 @@ class logPlot:
 
     def wheelEncoder(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         fig.suptitle('Wheel Encoder - ' + os.path.basename(os.path.normpath(self.log.directory)))
         ax = fig.subplots(4, 1, sharex=True)
@@ -3630,7 +3447,7 @@ class logPlot:
 
     def groundVehicleStatus(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         fig.suptitle('Ground Vehicle - ' + os.path.basename(os.path.normpath(self.log.directory)))
         ax = fig.subplots(3, 2, sharex=True)
@@ -3665,7 +3482,7 @@ class logPlot:
 
     def groundVehicle(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         fig.suptitle('Ground Vehicle - ' + os.path.basename(os.path.normpath(self.log.directory)))
         ax = fig.subplots(7, 2, sharex=True)
@@ -3709,7 +3526,7 @@ class logPlot:
 
     def wheelControllerTime(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         fig.suptitle('Wheel Controller Time - ' + os.path.basename(os.path.normpath(self.log.directory)))
         ax = fig.subplots(4, 1, sharex=True)
@@ -3739,7 +3556,7 @@ class logPlot:
 
     def wheelControllerVel(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
 
         fig.suptitle('Wheel Controller Velocity - ' + os.path.basename(os.path.normpath(self.log.directory)))
         ax = fig.subplots(2, 1, sharex=True)
@@ -3815,32 +3632,32 @@ class logPlot:
 
     def sensorCompGyrTemp(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'pqr', useTemp=True)
 
     def sensorCompAccTemp(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'acc', useTemp=True)
 
     def sensorCompMagTemp(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'mag', useTemp=True)
 
     def sensorCompGyr(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'pqr')
 
     def sensorCompAcc(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'acc')
 
     def sensorCompMag(self, fig=None, axs=None):
         if fig is None:
-            fig = plt.figure()
+            fig = pyplot().figure()
         self.sensorCompGen(fig, 'mag')
 
     def sensorCompGen(self, fig, name, useTemp=False):
@@ -4089,10 +3906,11 @@ class logPlot:
 
     def showFigs(self):
         if self.show:
-            plt.show()
+            pyplot().show()
 
 
 if __name__ == '__main__':
+    import yaml
     np.set_printoptions(linewidth=200)
     home = expanduser("~")
     file = open(home + "/Documents/Inertial_Sense/config.yaml", 'r')
@@ -1,22 +1,22 @@
 import numpy as np
 import sys
 import glob
-import serial
 import os
 import subprocess
 import yaml
 import datetime
 
 from os.path import expanduser, exists
-from scipy.interpolate import interp1d
 
 file_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.normpath(file_path + '/..'))
 sys.path.append(os.path.normpath(file_path + '/../math/src'))
 
 from log_reader import LogReader
+from logCache import LogCache, RAW_GNSS_DIDS
 # from ci_hdw.data_sets import *
 from pylib.data_sets import *
+from pylib.ISToolsGNSS import utcToGpsTow, GnssObservations
 from inertialsense_math.pose import *
 
 RAD2DEG = 180.0 / np.pi
@@ -29,9 +29,128 @@ INS_STATUS_NAV_MODE                         = 0x00001000
 GPS_STATUS_FLAGS_GPS1_RTK_POSITION_ENABLED  = 0x00100000
 GPS_STATUS_FLAGS_GPS2_RTK_COMPASS_ENABLED   = 0x00400000
 
+# DIDs Log.load() needs for device bookkeeping, always decoded when loading selected DIDs
+LOAD_REQUIRED_DIDS = [DID_DEV_INFO, DID_FLASH_CONFIG]
+
+# DIDs Log.load() and calculateRMS() / printRMSReport() use, INS_1 for logs without INS_2
+RMS_DIDS = [DID_DEV_INFO, DID_FLASH_CONFIG, DID_INS_1, DID_INS_2, DID_GPS1_POS]
+
+def rawGnssData(raw):
+    # LogReader returns raw GNSS DIDs as [obs, obsOffsets, eph, gloEph, sbas, ion, sta],
+    # Log.data holds them as [GnssObservations, eph, gloEph, sbas, ion, sta]
+    return [GnssObservations(raw[0], raw[1])] + list(raw[2:])
+
+
+class LogData:
+    """
+    Lazy [device, DID] container for Log.data.  Each entry is loaded by loadDid(dev, did) the first
+    time it is accessed, so only the DIDs that are used get memory mapped from the log cache.  Loads
+    that are not cached (cache=False, a time window or follow) decode all selected DIDs up front and
+    the container only wraps them.  Supports the indexing of the object ndarray it replaces:
+    data[dev, did], data[dev][did], data[devIdxList], iterating over devices, assignment, len() and shape.
+    """
+    def __init__(self, numDev, loadDid, devIdx=None, entries=None):
+        self.loadDid = loadDid
+        self.devIdx = list(range(numDev)) if devIdx is None else list(devIdx)
+        self.entries = {} if entries is None else entries   # { (source device, did): data }
+        self.buffers = {}                                   # { (source device, did, i): array entries are views of }
+
+    @property
+    def shape(self):
+        return (len(self.devIdx), NUM_DIDS+1)
+
+    def __len__(self):
+        return len(self.devIdx)
+
+    def __iter__(self):
+        for dev in range(len(self.devIdx)):
+            yield LogDataDevice(self, dev)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            dev, did = key
+            return self.get(dev, did)
+        if isinstance(key, (int, np.integer)):
+            return LogDataDevice(self, key)
+        # Device subset, i.e. data[refIdx]
+        devIdx = np.array(self.devIdx)[key].tolist()
+        return LogData(0, self.loadDid, np.atleast_1d(devIdx), self.entries)
+
+    def __setitem__(self, key, value):
+        dev, did = key
+        self.entries[(self.devIdx[dev], did)] = value
+
+    def get(self, dev, did):
+        key = (self.devIdx[dev], did)
+        if key not in self.entries:
+            self.entries[key] = self.loadDid(*key) if did < NUM_DIDS else []
+        return self.entries[key]
+
+    def append(self, dev, did, values):
+        # Append records to an entry.  Entries are views of buffers that double in size when full,
+        # so appending is amortized O(1) per record.
+        data = self.get(dev, did)
+        key = (self.devIdx[dev], did)
+        if did in RAW_GNSS_DIDS:
+            # [GnssObservations, eph, gloEph, sbas, ion, sta]
+            if not len(data):
+                data = [GnssObservations(values[0].obs[:0], np.zeros(1, dtype=np.int64))] + [v[:0] for v in values[1:]]
+            obs = data[0]
+            offsets = self.appendArray(key + ('offsets',), obs.offsets, values[0].offsets[1:] + len(obs.obs))
+            obs = GnssObservations(self.appendArray(key + ('obs',), obs.obs, values[0].obs), offsets)
+            data = [obs] + [self.appendArray(key + (i,), data[i], values[i]) for i in range(1, len(values))]
+        else:
+            data = self.appendArray(key + (0,), data, values)
+        self.entries[key] = data
+
+    def appendArray(self, key, data, values):
+        if not len(values):
+            return data
+        n = len(data)
+        buffer = self.buffers.get(key)
+        if buffer is None or n + len(values) > len(buffer) or getattr(data, 'base', None) is not buffer:
+            buffer = np.empty(max(2 * (n + len(values)), 16), dtype=values.dtype)
+            buffer[:n] = data
+            self.buffers[key] = buffer
+        buffer[n:n+len(values)] = values
+        return buffer[:n+len(values)]
+
+    def copy(self):
+        return LogData(0, self.loadDid, self.devIdx, dict(self.entries))
+
+    def __array__(self, dtype=None, copy=None):
+        # Loads every DID
+        array = np.empty(self.shape, dtype=object)
+        for dev in range(self.shape[0]):
+            for did in range(self.shape[1]):
+                array[dev, did] = self.get(dev, did)
+        return array
+
+
+class LogDataDevice:
+    # One device row of LogData, data[dev][did]
+    def __init__(self, data, dev):
+        self.data = data
+        self.dev = dev
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __iter__(self):
+        for did in range(len(self)):
+            yield self.data.get(self.dev, did)
+
+    def __getitem__(self, did):
+        return self.data.get(self.dev, did)
+
+    def __setitem__(self, did, value):
+        self.data[self.dev, did] = value
+
+
 class Log:
     def __init__(self):
         self.c_log = LogReader()
+        self.cancelled = False
         self.init_vars()
 
     def init_vars(self):
@@ -49,13 +168,40 @@ class Log:
         self.refINS = False
         self.using_mounting_bias = False
 
-    def load(self, directory, serials=['ALL']):
+    def load(self, directory, serials=['ALL'], dids=None, excludeDids=None, threads=0, startTime=None, endTime=None, cache=True, follow=False):
+        # dids: only decode these DIDs (None = all), excludeDids: never decode these DIDs
+        # threads: devices decoded in parallel (0 = one per CPU core, 1 = serial)
+        # startTime, endTime: only decode records in this window, GPS time of week (s) or UTC datetime (None = no bound)
+        #   Records without a timestamp are kept from the parts of the log that are read, *.dat chunks before the window are skipped
+        # cache: map the decoded log cache next to the log files, and write it after a decode.  A decode of selected
+        #        dids, or with excludeDids, adds the DIDs it decoded to the cache of the log files.
+        # follow: keep reading the log as it is written, see poll().  Not cached since the log is growing.
         self.init_vars()
-        self.c_log.init(self, directory, serials)
-        self.c_log.load()
-        self.serials = self.c_log.getSerialNumbers()
+        dids = sorted(set(dids) | set(LOAD_REQUIRED_DIDS)) if dids else []
+        excludeDids = [did for did in (excludeDids or []) if did not in LOAD_REQUIRED_DIDS]
+        timeWindow = startTime is not None or endTime is not None
+        logCache = LogCache(directory, self.c_log.protocolVersion(), serials) if cache and not timeWindow and not follow and os.path.isdir(directory) else None
+        if logCache and logCache.valid(dids, excludeDids):
+            print("Loading from cache: " + logCache.path)
+            self.serials = logCache.serialNumbers()
+        else:
+            self.c_log.setTimeWindow(self.timeWindowTow(startTime), self.timeWindowTow(endTime))
+            self.c_log.init(directory, serials, dids, excludeDids)
+            if self.cancelled:
+                return False
+            logs = self.c_log.load(threads, follow)
+            if self.cancelled:
+                print("Loading cancelled")
+                return False
+            self.serials = self.c_log.getSerialNumbers()
+            if not (logCache and len(logs) and logCache.save(logs, self.serials, dids, excludeDids)):
+                logCache = None
+        if logCache:
+            # DIDs are mapped from the cache on first access, decoded arrays are freed once cached
+            self.data = LogData(logCache.numDev(), lambda dev, did: logCache.loadDid(dev, did, dids, excludeDids))
+        else:
+            self.setData(logs)
         # self.sanitize()
-        self.data = np.array(self.data, dtype=object)
         self.directory = directory
         self.mount_bias_filepath = directory + '/angular_mount_bias.yml'
         self.numDev = self.data.shape[0]
@@ -91,7 +237,7 @@ class Log:
                 if len(self.data[i, DID_DEV_INFO]):
                     self.refSerials.clear()
                     self.refSerials.append(self.data[i, DID_DEV_INFO]['serialNumber'][0])
-            if len(self.data[0, DID_INS_2]) == 0 and len(self.data[0, DID_INS_1]) != 0:
+            if len(self.data[i, DID_INS_2]) == 0 and len(self.data[i, DID_INS_1]) != 0:
                 self.ins1ToIns2(i)
             #If you want to view data of log with only refIns:
             if len(self.serials) == 1 and self.refINS == True:
@@ -138,6 +284,30 @@ class Log:
             # print(RED + "error loading log" + sys.exc_info()[0] + RESET)
         return True
 
+    def poll(self):
+        # Append the records written since load(follow=True) or the last poll(), returns the number of new records
+        count = 0
+        for dev, dids in self.c_log.poll().items():
+            for did, values in dids.items():
+                if did in RAW_GNSS_DIDS:
+                    values = rawGnssData(values)
+                    n = len(values[0].obs) + sum(len(v) for v in values[1:])
+                else:
+                    n = len(values)
+                if n and did < NUM_DIDS:
+                    self.data.append(dev, did, values)
+                    count += n
+        return count
+
+    def cancel(self):
+        # Stop load() from another thread, load() then returns False.  A new Log is needed to load again.
+        self.cancelled = True
+        self.c_log.cancel()
+
+    def progress(self):
+        # [(bytes read, bytes total)] of each device while load() is decoding, may be called from another thread
+        return self.c_log.progress()
+
     def getSerialNumbers(self):
         return self.c_log.getSerialNumbers()
 
@@ -145,37 +315,22 @@ class Log:
         return self.c_log.protocolVersion()
 
     def ins1ToIns2(self, device_id=0):
-        self.c_log.ins1ToIns2(device_id)
+        self.data[device_id, DID_INS_2] = self.c_log.ins1ToIns2(self.data[device_id, DID_INS_1])
 
     def exitHack(self, exit_code=0):
         self.c_log.exitHack(exit_code)
-        
-    def did_callback(self, did, arr, dev_id):
-        if did >= NUM_DIDS:
-            return
-        while dev_id >= len(self.data):
-            self.data.append([[] for i in range(NUM_DIDS+1)])
-        self.data[dev_id][did] = arr
-
-    def gps_raw_data_callback(self, did, arr, dev_id, msg_type):
-        if did >= NUM_DIDS:
-            return
-        if self.data[dev_id][did] == []:
-            self.data[dev_id][did] = [[] for i in range(6)]
-        if dev_id < len(self.data) and did < len(self.data[dev_id]) and 6 <= len(self.data[dev_id][did]):
-            if msg_type == eRawDataType.raw_data_type_observation.value:
-                self.data[dev_id][did][0].append(arr)
-            elif msg_type == eRawDataType.raw_data_type_ephemeris.value:
-                self.data[dev_id][did][1] = arr
-            elif msg_type == eRawDataType.raw_data_type_glonass_ephemeris.value:
-                self.data[dev_id][did][2] = arr
-            elif msg_type == eRawDataType.raw_data_type_sbas.value:
-                self.data[dev_id][did][3] = arr
-            elif msg_type == eRawDataType.raw_data_type_ionosphere_model_utc_alm.value:
-                self.data[dev_id][did][4] = arr
-            elif msg_type == eRawDataType.raw_data_type_base_station_antenna_position.value:
-                self.data[dev_id][did][5] = arr
 
+    @staticmethod
+    def timeWindowTow(time):
+        if time is None:
+            return -1.0
+        if isinstance(time, datetime.datetime):
+            return utcToGpsTow(time)[1]
+        return float(time)
+
+    def setData(self, logs):
+        # logs = { device index: { did: ndarray } }, arrays own the buffers decoded by LogReader (no copy)
+        self.data = LogData(len(logs), lambda dev, did: rawGnssData(logs[dev][did]) if did in RAW_GNSS_DIDS and did in logs[dev] else logs[dev].get(did, []))
 
     def sanitize(self):
         return
@@ -235,6 +390,7 @@ class Log:
 
     def getRMSArray(self):
         if self.numDev > 1 or self.refINS:
+            from scipy.interpolate import interp1d     # scipy is slow to import and only needed here
             print("Computing RMS Accuracies: (%d devices)" % (self.numIns))
 
             # Build a 3D array of the data.  idx 0 = Device,    idx 1 = t,     idx 2 = [t, lla, uvw, log(q)]
@@ -291,7 +447,7 @@ class Log:
             # Convert lla to ned using first device lla at center of data as reference
             refLla = data[0, int(round(len(t) / 2.0)), 1:4].copy()
             for i in range(self.numDev):
-                data[i, :, 1:4] = lla2ned(refLla, data[i, :, 1:4])
+                lla2ned(refLla, data[i, :, 1:4], out=data[i, :, 1:4])
             self.stateArray = data
 
     def getRMSTruth(self):
@@ -312,7 +468,6 @@ class Log:
         self.att_error = att_error
 
     def calculateRMS(self):
-        self.data = np.array(self.data)
         self.getRMSArray()
         self.getRMSTruth()
         self.calcAttitudeError()
@@ -333,7 +488,8 @@ class Log:
             self.mount_bias_quat[dev,:] = euler2quat(self.mount_bias_euler[dev, :])
             self.using_mounting_bias = True
             self.att_error[n, :, :] = self.att_error[n, :, :] - mount_bias[None, :]
-            self.uvw_error[n, :, :] = quatRot(self.mount_bias_quat[dev,:], self.stateArray[n, :, 4:7]) - self.truth[:,3:6]
+            quatRot(self.mount_bias_quat[dev,:], self.stateArray[n, :, 4:7], out=self.uvw_error[n, :, :])
+            self.uvw_error[n, :, :] -= self.truth[:,3:6]
             mount_bias_output[int(self.serials[dev])] = mount_bias.tolist()
 
         # Writing mounting bias to file 
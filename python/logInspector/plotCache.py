@@ -0,0 +1,66 @@
+import collections
+import numpy as np
+
+# Default memory bound of a PlotCache
+PLOT_CACHE_MAX_BYTES = 256 * 1024**2
+
+
+def cachedArrays(value):
+    # Yields the numpy arrays in a cached value of nested tuples, lists and dicts
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            yield from cachedArrays(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from cachedArrays(v)
+
+
+class PlotCache:
+    """
+    Least recently used cache of data derived for plots, bounded by the memory of the cached arrays.
+    Cached arrays are made read-only since the same arrays are returned every time they are used.
+    A value with an nbytes() method, e.g. a LodPyramid, is counted by it and left as it is since it
+    may reference arrays it shares with others.
+    """
+    def __init__(self, maxBytes=PLOT_CACHE_MAX_BYTES):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()    # key: (value, bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, compute):
+        # Returns the value cached for key, computing and caching it if it is not cached
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = compute()
+        if callable(getattr(value, 'nbytes', None)):
+            arrays = []
+            nbytes = value.nbytes()
+        else:
+            arrays = list(cachedArrays(value))
+            nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.maxBytes:
+            return value
+        for a in arrays:
+            a.flags.writeable = False
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxBytes:
+            _, (_, n) = self.entries.popitem(last=False)
+            self.nbytes -= n
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+'''
+Headless export of logPlot plots to the figures/ directory of a log, the same files logPlot.saveFig()
+writes from the GUI.
+
+Plots are rendered without a GUI backend by a pool of worker processes.  Forked workers share the
+parent's Log read-only.  Otherwise each worker loads the log from its cache, which memory maps the
+arrays decoded by the parent instead of decoding the log files again.  Without a cache the plots are
+rendered in the calling process, so the log is never decoded by each worker.
+
+Usage: python3 plotExport.py <log directory> [--plots posNED,velNED,...] [--format svg|png] [--jobs N]
+                             [--downsample N] [--residual] [--utc] [--serials SN1,SN2,...]
+'''
+import argparse, contextlib, inspect, io, multiprocessing, os, sys, time, traceback
+
+from matplotlib.figure import Figure
+
+from logReader import Log
+from logCache import LogCache
+from logPlotter import logPlot
+
+# Settings of a logPlot applied to the plotters of the workers
+DEFAULT_SETTINGS = {'downsample': 1, 'residual': False, 'timestamp': False, 'xAxisSample': False, 'utcTime': False, 'serials': None}
+
+# logPlot of each worker process
+plotter = None
+
+
+def plotFunctions():
+    # Names of the logPlot methods that draw a complete figure, i.e. take fig and no other required arguments
+    names = []
+    for name, fn in inspect.getmembers(logPlot, inspect.isfunction):
+        params = inspect.signature(fn).parameters
+        if name.startswith('_') or 'fig' not in params:
+            continue
+        if all(p.default is not inspect.Parameter.empty for n, p in params.items() if n not in ('self', 'fig')):
+            names.append(name)
+    return names
+
+def plotterSettings(p):
+    # Settings of a logPlot to export its plots as shown
+    return {'downsample': p.d, 'residual': p.residual, 'timestamp': p.timestamp, 'xAxisSample': p.xAxisSample,
+            'utcTime': p.utcTime, 'serials': [p.log.serials[d] for d in p.active_devs]}
+
+def createPlotter(log, format, settings):
+    p = logPlot(False, True, format, log)
+    p.setDownSample(settings['downsample'])
+    p.enableResidualPlot(settings['residual'])
+    p.enableTimestamp(settings['timestamp'])
+    p.enableXAxisSample(settings['xAxisSample'])
+    p.enableUtcTime(settings['utcTime'])
+    if settings['serials'] is not None:
+        p.setActiveSerials(settings['serials'])
+    return p
+
+def logCached(directory):
+    # True if the workers can load the log from its cache, which they load with all serial numbers
+    return LogCache(directory, Log().protocolVersion(), ['ALL']).valid()
+
+def initWorker(directory, format, settings, log):
+    global plotter
+    if log is None:
+        log = Log()
+        with contextlib.redirect_stdout(io.StringIO()):
+            log.load(directory)
+    plotter = createPlotter(log, format, settings)
+
+def exportPlot(funcName):
+    # Returns (funcName, traceback or None, [saved figure paths]).  Plots that do not save their figure
+    # are saved under their function name.
+    fig = Figure()
+    saved = len(plotter.savedFigures)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            getattr(plotter, funcName)(fig)
+            if len(plotter.savedFigures) == saved and fig.axes:
+                plotter.saveFig(fig, funcName)
+        return (funcName, None, plotter.savedFigures[saved:])
+    except Exception:
+        return (funcName, traceback.format_exc(), plotter.savedFigures[saved:])
+
+def exportPlots(directory, funcNames=None, format='svg', jobs=0, settings=None, log=None, progress=None, fork=True):
+    '''
+    Saves plots of the log in directory to directory/figures.  Returns [(funcName, traceback or None,
+    [saved figure paths])] in the order of funcNames.
+        funcNames: logPlot methods to plot (None = plotFunctions())
+        jobs: worker processes (0 = one per CPU core, 1 = plot in this process)
+        settings: logPlot settings, see DEFAULT_SETTINGS and plotterSettings()
+        log: loaded Log to share with forked workers.  Without it, or where processes are not forked,
+             workers load the log from its cache.  Without a cache the plots are rendered in this process.
+        progress: called with (plots done, plots total, funcName, traceback or None) as plots finish
+        fork: share log with forked workers where possible.  False in processes that must not fork, e.g. with a GUI.
+    '''
+    funcNames = plotFunctions() if funcNames is None else list(funcNames)
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    jobs = min(jobs or os.cpu_count() or 1, max(len(funcNames), 1))
+    fork = fork and log is not None and 'fork' in multiprocessing.get_all_start_methods()
+    results = {}
+
+    if jobs > 1 and not fork and not logCached(directory):
+        if log is None:
+            # Loading the log writes its cache for the workers
+            log = Log()
+            with contextlib.redirect_stdout(io.StringIO()):
+                log.load(directory)
+        if not logCached(directory):
+            # The cache cannot be written, e.g. a read only directory.  Plot here instead of decoding the log in each worker.
+            jobs = 1
+
+    def finished(result):
+        results[result[0]] = result
+        if progress:
+            progress(len(results), len(funcNames), result[0], result[1])
+
+    if jobs == 1:
+        initWorker(directory, format, settings, log)
+        for funcName in funcNames:
+            finished(exportPlot(funcName))
+    else:
+        context = multiprocessing.get_context('fork' if fork else 'spawn')
+        # Forked workers inherit the log, it is not pickled
+        with context.Pool(jobs, initWorker, (directory, format, settings, log if fork else None)) as pool:
+            for result in pool.imap_unordered(exportPlot, funcNames):
+                finished(result)
+    return [results[funcName] for funcName in funcNames]
+
+
+def addArguments(parser):
+    # Command line options of the export, see settings()
+    parser.add_argument('directory', help='log directory')
+    parser.add_argument('--plots', default=None, help='comma separated logPlot functions (default: all)')
+    parser.add_argument('--format', default='svg', choices=['svg', 'png', 'pdf'], help='image format')
+    parser.add_argument('--jobs', default=0, type=int, help='worker processes (default: one per CPU core)')
+    parser.add_argument('--downsample', default=1, type=int, help='plot every Nth sample')
+    parser.add_argument('--residual', action='store_true', help='show residual plots')
+    parser.add_argument('--utc', action='store_true', help='show UTC time')
+    parser.add_argument('--serials', default=None, help='comma separated serial numbers to plot (default: all)')
+
+def parseArguments(parser):
+    # Returns the parsed options, the plot functions and the logPlot settings
+    opts = parser.parse_args()
+    allFuncNames = plotFunctions()
+    funcNames = opts.plots.split(',') if opts.plots else allFuncNames
+    unknown = [f for f in funcNames if f not in allFuncNames]
+    if unknown:
+        parser.error('unknown plots: ' + ', '.join(unknown))
+    settings = {'downsample': max(opts.downsample, 1), 'residual': opts.residual, 'utcTime': opts.utc}
+    if opts.serials:
+        settings['serials'] = [int(s) if s.isdigit() else s for s in opts.serials.split(',')]
+    return opts, funcNames, settings
+
+def printProgress(done, total, funcName, error):
+    print('[%d/%d] %s%s' % (done, total, funcName, ' FAILED' if error else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Save logInspector plots of a log to <directory>/figures')
+    addArguments(parser)
+    opts, funcNames, settings = parseArguments(parser)
+
+    start = time.time()
+    log = Log()
+    if not log.load(opts.directory):
+        sys.exit(1)
+
+    results = exportPlots(opts.directory, funcNames, opts.format, opts.jobs, settings, log, printProgress)
+    failed = [(f, e) for f, e, paths in results if e]
+    for funcName, error in failed:
+        print('\n%s failed:\n%s' % (funcName, error))
+    print('Saved %d plots to %s in %.1f s, %d failed' % (len(results) - len(failed), os.path.join(opts.directory, 'figures'), time.time() - start, len(failed)))
+    sys.exit(1 if failed else 0)
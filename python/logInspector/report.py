@@ -0,0 +1,76 @@
+'''
+Headless report of a log, e.g. for CI on nightly logs.  The log is loaded once, the selected logPlot
+plots are saved to <directory>/figures by plotExport and figures/index.html shows them all.  Plots are
+rendered with the Agg backend and PyQt is never imported.
+
+Usage, from the SDK python directory:
+    python -m logInspector.report <log directory> [--plots posNED,attitude,...] [--format png] [--jobs N]
+                                  [--downsample N] [--residual] [--utc] [--serials SN1,SN2,...] [--strict]
+'''
+import argparse, html, os, sys, time
+
+import matplotlib
+matplotlib.use('Agg')
+
+# The log inspector modules import each other by name
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from logReader import Log
+from plotExport import addArguments, exportPlots, parseArguments, printProgress
+
+INDEX_FILE = 'index.html'
+
+
+def writeIndex(directory, log, results, format, seconds):
+    # Writes figures/index.html with the figures of each plot and the traceback of failed plots
+    figuresDir = os.path.join(directory, 'figures')
+    os.makedirs(figuresDir, exist_ok=True)
+    failed = [funcName for funcName, error, paths in results if error]
+    title = 'Log Report - ' + os.path.basename(os.path.normpath(directory))
+
+    lines = ['<!DOCTYPE html>', '<html>', '<head>', '<meta charset="utf-8">', '<title>%s</title>' % html.escape(title),
+             '<style>body { font-family: sans-serif; } img { max-width: 100%; } pre { background: #fee; padding: 8px; }</style>',
+             '</head>', '<body>', '<h1>%s</h1>' % html.escape(title),
+             '<p>%s<br>Devices: %s<br>%d plots, %d failed, %.1f s</p>' % (html.escape(os.path.abspath(directory)),
+                html.escape(' '.join(str(s) for s in log.serials)), len(results), len(failed), seconds)]
+    lines.append('<ul>')
+    for funcName, error, paths in results:
+        lines.append('<li><a href="#%s">%s</a>%s</li>' % (funcName, funcName, ' (failed)' if error else ''))
+    lines.append('</ul>')
+
+    for funcName, error, paths in results:
+        lines.append('<h2 id="%s">%s</h2>' % (funcName, funcName))
+        if error:
+            lines.append('<pre>%s</pre>' % html.escape(error))
+        elif not paths:
+            lines.append('<p>No data</p>')
+        for path in paths:
+            src = html.escape(os.path.relpath(path, figuresDir).replace(os.sep, '/'))
+            if format == 'pdf':
+                lines.append('<p><a href="%s">%s</a></p>' % (src, src))
+            else:
+                lines.append('<p><img src="%s" alt="%s"></p>' % (src, src))
+    lines += ['</body>', '</html>']
+
+    path = os.path.join(figuresDir, INDEX_FILE)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Save logInspector plots of a log to <directory>/figures with an index.html')
+    addArguments(parser)
+    parser.add_argument('--strict', action='store_true', help='exit with an error if any plot fails')
+    opts, funcNames, settings = parseArguments(parser)
+
+    start = time.time()
+    log = Log()
+    if not log.load(opts.directory):
+        sys.exit(1)
+
+    results = exportPlots(opts.directory, funcNames, opts.format, opts.jobs, settings, log, printProgress)
+    index = writeIndex(opts.directory, log, results, opts.format, time.time() - start)
+    failed = [funcName for funcName, error, paths in results if error]
+    print('Saved %d plots to %s in %.1f s, %d failed: %s' % (len(results) - len(failed), index, time.time() - start, len(failed), ' '.join(failed)))
+    sys.exit(1 if opts.strict and failed else 0)
@@ -1,27 +1,80 @@
 #include "convert_ins.h"
 #include "log_reader.h"
+#include "time_conversion.h"
+#include "ISLogFileFactory.h"
+
+#include <atomic>
+#include <algorithm>
+#include <cmath>
+#include <memory>
+#include <mutex>
+#include <thread>
 
 #define STRINGIZE(x) #x
 #define STRINGIZE_VALUE_OF(x) STRINGIZE(x)
 #define MESSAGE_VALUE(x) message(__FILE__ "(" STRINGIZE_VALUE_OF(__LINE__) "): " #x " = " STRINGIZE_VALUE_OF(x))
 #define CONCAT_MESSAGE(text, value) message(__FILE__ "(" STRINGIZE_VALUE_OF(__LINE__) "): " text " = " STRINGIZE_VALUE_OF(value))
 
-using namespace std;
+// Time windows assume each device logs its time of week DIDs in time order.  A device stops reading after
+// TIME_WINDOW_STOP_COUNT consecutive time of week records more than TIME_WINDOW_STOP_MARGIN (s) past the end of the
+// window, and *.dat chunks are skipped while the next chunk starts more than the margin before the window.  The margin
+// and count tolerate records logged slightly out of order or with a bad timestamp.  Records timestamped with time since
+// boot are not used for either, they are only placed in GPS time once a DID_GPS1_POS towOffset has been read and a
+// device may log them (e.g. at boot) before the first one.
+#define TIME_WINDOW_STOP_MARGIN     5.0
+#define TIME_WINDOW_STOP_COUNT      100
 
-static py::object g_python_parent;  // Including this inside LogReader class causes problems w/ garbage collection.
+using namespace std;
 
 LogReader::LogReader()
 {
-    dev_log_ = nullptr;
+    loadDid_.assign(DID_COUNT, true);
 }
 
-LogReader::~LogReader()
+void LogReader::setTimeWindow(double start_tow, double end_tow)
 {
-    if (dev_log_ != nullptr)
+    startTow_ = start_tow;
+    endTow_ = end_tow;
+    if (timeWindowEnabled())
+        printf("Time window (GPS TOW): %.3f to %.3f\n", startTow_, endTow_);
+}
+
+bool LogReader::timeWindowEnabled()
+{
+    return startTow_ >= 0.0 || endTow_ >= 0.0;
+}
+
+double LogReader::recordTow(const p_data_buf_t* data, double towOffset, bool* timeOfWeek)
+{
+    if (timeOfWeek)
+        *timeOfWeek = false;
+    double time = cISDataMappings::Timestamp(&data->hdr, data->buf);
+    if (time == 0.0)
+        return -1.0;
+
+    if (data->hdr.id == DID_GPS1_RAW || data->hdr.id == DID_GPS2_RAW || data->hdr.id == DID_GPS_BASE_RAW)
+    {   // Observation time is GPS time since the unix epoch
+        if (timeOfWeek)
+            *timeOfWeek = true;
+        return fmod(time - C_GPS_TO_UNIX_OFFSET_S, C_SECONDS_PER_WEEK);
+    }
+
+    const data_info_t* field = cISDataMappings::DataSet(data->hdr.id)->timestampFields;
+    if (field->name == "timeOfWeek" || field->name == "timeOfWeekMs")
     {
-        delete dev_log_;
-        dev_log_ = nullptr;
+        if (timeOfWeek)
+            *timeOfWeek = true;
+        return time;
+    }
+    if (field->name == "time")
+    {   // Time since boot, cannot be placed in GPS time before the first GPS fix
+        return (towOffset >= 0.0 ? time + towOffset : NAN);
     }
+    return -1.0;
+}
+
+LogReader::~LogReader()
+{
 }
 
 template <>
@@ -31,13 +84,9 @@ void LogReader::log_message(int did, uint8_t* msg, std::vector<gps_raw_wrapper_t
   switch (raw_msg->dataType)
   {
   case raw_data_type_observation:
-  {
-    std::vector<obsd_t> obs{raw_msg->obsCount};
-    for (int i = 0; i < raw_msg->obsCount; i++)
-      obs.push_back(raw_msg->data.obs[i]);
-    vec[0].obs.push_back(obs);
+    vec[0].obsOffsets.push_back(vec[0].obs.size());
+    vec[0].obs.insert(vec[0].obs.end(), raw_msg->data.obs, raw_msg->data.obs + raw_msg->obsCount);
     break;
-  }
   case raw_data_type_ephemeris:
     vec[0].eph.push_back(raw_msg->data.eph);
     break;
@@ -59,27 +108,39 @@ void LogReader::log_message(int did, uint8_t* msg, std::vector<gps_raw_wrapper_t
 }
 
 template <typename T>
-void LogReader::forward_message(eDataIDs did, std::vector<T>& vec, int device_id)
+py::array_t<T> LogReader::to_array(std::vector<T>& vec)
 {
-    g_python_parent.attr("did_callback")(did, py::array_t<T>(std::vector<ptrdiff_t>{(py::ssize_t)vec.size()}, vec.data()), device_id);
+    // Move the vector to the heap and let the capsule free it with the numpy array, so the data is never copied
+    std::vector<T>* buf = new std::vector<T>(std::move(vec));
+    py::capsule owner(buf, [](void* p) { delete reinterpret_cast<std::vector<T>*>(p); });
+    return py::array_t<T>(std::vector<ptrdiff_t>{(py::ssize_t)buf->size()}, buf->data(), owner);
+}
+
+template <typename T>
+void LogReader::forward_message(eDataIDs did, std::vector<T>& vec, py::dict& dids)
+{
+    dids[py::int_(did)] = to_array(vec);
 }
 
 template <>
-void LogReader::forward_message(eDataIDs did, std::vector<gps_raw_wrapper_t>& vec, int device_id)
+void LogReader::forward_message(eDataIDs did, std::vector<gps_raw_wrapper_t>& vec, py::dict& dids)
 {
-    for (int i = 0; i < (int)vec[0].obs.size(); i++)
-    {
-        g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<obsd_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].obs[i].size()}, vec[0].obs[i].data()), device_id, (int)raw_data_type_observation);
-    }
-    g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<eph_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].eph.size()}, vec[0].eph.data()), device_id, (int)raw_data_type_ephemeris);
-    g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<geph_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].gloEph.size()}, vec[0].gloEph.data()), device_id, (int)raw_data_type_glonass_ephemeris);
-    g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<sbsmsg_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].sbas.size()}, vec[0].sbas.data()), device_id, (int)raw_data_type_sbas);
-    g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<ion_model_utc_alm_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].ion.size()}, vec[0].ion.data()), device_id, (int)raw_data_type_ionosphere_model_utc_alm);
-    g_python_parent.attr("gps_raw_data_callback")(did, py::array_t<sta_t>(std::vector<ptrdiff_t>{(py::ssize_t)vec[0].sta.size()}, vec[0].sta.data()), device_id, (int)raw_data_type_base_station_antenna_position);
+    // [observations, epoch offsets, ephemeris, glonass ephemeris, sbas, ionosphere, base station antenna position]
+    // Epoch i is observations[offsets[i]:offsets[i+1]]
+    vec[0].obsOffsets.push_back(vec[0].obs.size());
+    py::list raw;
+    raw.append(to_array(vec[0].obs));
+    raw.append(to_array(vec[0].obsOffsets));
+    raw.append(to_array(vec[0].eph));
+    raw.append(to_array(vec[0].gloEph));
+    raw.append(to_array(vec[0].sbas));
+    raw.append(to_array(vec[0].ion));
+    raw.append(to_array(vec[0].sta));
+    dids[py::int_(did)] = raw;
 }
 
 
-bool LogReader::init(py::object python_class, std::string log_directory, py::list serials)
+bool LogReader::init(std::string log_directory, py::list serials, py::list dids, py::list exclude_dids)
 {
     printf("SDK Protocol: %d.%d.%d.%d\n", 
         PROTOCOL_VERSION_CHAR0,
@@ -94,16 +155,23 @@ bool LogReader::init(py::object python_class, std::string log_directory, py::lis
         cout << stl_serials[i] << "\n";
 
     // first try DAT files, if that doesn't work, then try SDAT files
+    cancel_ = false;
+    directory_ = log_directory;
+    useChunkHeader_ = true;
+    logType_ = cISLogger::LOGTYPE_DAT;
     if (logger_.LoadFromDirectory(log_directory, cISLogger::LOGTYPE_DAT, stl_serials))
     {
         cout << "Found *.dat log with ";
     } 
     else if (logger_.LoadFromDirectory(log_directory, cISLogger::LOGTYPE_RAW, stl_serials))
     {
+        useChunkHeader_ = false;
+        logType_ = cISLogger::LOGTYPE_RAW;
         cout << "Found *.raw log with ";
     }
     else if (logger_.LoadFromDirectory(log_directory, cISLogger::LOGTYPE_SDAT, stl_serials))
     {
+        logType_ = cISLogger::LOGTYPE_SDAT;
         cout << "Found *.sdat log with ";
     }
     else
@@ -122,234 +190,587 @@ bool LogReader::init(py::object python_class, std::string log_directory, py::lis
     cout << endl;
     serialNumbers_ = py::cast(serialNumbers);
 
-    // python_parent_ = python_class;
-    g_python_parent = python_class;
+    // Select the DIDs to decode.  An empty allow-list selects all DIDs.
+    vector<int> stl_dids = dids.cast<vector<int>>();
+    vector<int> stl_exclude_dids = exclude_dids.cast<vector<int>>();
+    loadDid_.assign(DID_COUNT, stl_dids.empty());
+    for (int did : stl_dids)
+        if (did >= 0 && did < (int)DID_COUNT)
+            loadDid_[did] = true;
+    for (int did : stl_exclude_dids)
+        if (did >= 0 && did < (int)DID_COUNT)
+            loadDid_[did] = false;
+    if (!stl_dids.empty())
+    {
+        cout << "Loading DIDs:";
+        for (int did = 0; did < (int)DID_COUNT; did++)
+            if (loadDid_[did])
+                cout << " " << did;
+        cout << endl;
+    }
+    if (!stl_exclude_dids.empty())
+    {
+        cout << "Excluding DIDs:";
+        for (int did : stl_exclude_dids)
+            cout << " " << did;
+        cout << endl;
+    }
     return true;
 }
 
-void LogReader::organizeData(shared_ptr<cDeviceLog> devLog)
+void LogReader::organizeData(shared_ptr<cDeviceLog> devLog, DeviceLog& log, DeviceProgress& progress)
 {
+    DeviceReadState state;
+
+    // Read from the device log directly, cISLogger::ReadData() updates logger stats shared by all devices
     p_data_buf_t* data = NULL;
-    while ((data = logger_.ReadData(devLog)))
+    while (!cancel_ && (data = devLog->ReadData()))
     {
-        // if (data->hdr.id == DID_DEV_INFO)
-        //     volatile int debug = 0;
+        progress.bytesRead.fetch_add(data->hdr.size + sizeof(p_data_hdr_t), std::memory_order_relaxed);
+        if (!organizeRecord(data, log, state))
+            break;
+    }
+}
 
-        if (data->hdr.size == 0)
-            continue;
+void LogReader::organizeWindow(uint32_t serialNumber, DeviceLog& log, DeviceProgress& progress)
+{
+    // Reads a *.dat log of the device in a time window, seeking past the chunks before the window
+    vector<ISFileManager::file_info_t> files = deviceFiles(serialNumber);
+    size_t startFile = 0;
+    long startOffset = 0;
+    double skipTow = startTow_ - TIME_WINDOW_STOP_MARGIN;
 
-        switch (data->hdr.id)
+    if (startTow_ >= 0.0)
+    {
+        // Skip whole files while the next file starts before the window
+        long next, after;
+        double tow;
+        while (startFile + 1 < files.size())
         {
+            cISLogFileBase* file = CreateISLogFile(files[startFile + 1].name, "rb");
+            bool before = file != NULL && chunkTow(file, 0, next, tow) && tow >= 0.0 && tow < skipTow;
+            CloseISLogFile(file);
+            if (!before)
+                break;
+            progress.bytesRead.fetch_add(files[startFile].size, std::memory_order_relaxed);
+            startFile++;
+        }
 
-        // This is a helper macro, simply define the DID you want to forward,
-        // as well as the datatype of that DID.  So long as the data type
-        // has been defined in the PYBIND11_NUMPY_DTYPE macros below,
-        // then this will work.  It uses templates to abstract a lot
-        // of the tedium of this type of work
-        #define HANDLE_MSG(DID, vec) \
-        case DID: \
-            log_message(data->hdr.id, data->buf, vec); \
-            break;
+        // Then chunks of the file while the next chunk starts before the window
+        if (startFile < files.size())
+        {
+            cISLogFileBase* file = CreateISLogFile(files[startFile].name, "rb");
+            bool more = file != NULL && chunkTow(file, startOffset, next, tow);
+            while (more && !cancel_ && chunkTow(file, next, after, tow) && tow >= 0.0 && tow < skipTow)
+            {
+                progress.bytesRead.fetch_add(next - startOffset, std::memory_order_relaxed);
+                startOffset = next;
+                next = after;
+            }
+            CloseISLogFile(file);
+        }
+    }
 
-        HANDLE_MSG( DID_DEV_INFO, dev_log_->devInfo );
-        HANDLE_MSG( DID_SYS_FAULT, dev_log_->sysFault );
-        HANDLE_MSG( DID_INS_1, dev_log_->ins1 );
-        HANDLE_MSG( DID_INS_2, dev_log_->ins2 );
-        HANDLE_MSG( DID_GPS1_RCVR_POS, dev_log_->gps1UbxPos );
-        HANDLE_MSG( DID_SYS_CMD, dev_log_->sysCmd );
-        // HANDLE_MSG( DID_NMEA_BCAST_PERIOD, dev_log_->nmeaBcastPeriod );
-        // HANDLE_MSG( DID_RMC, dev_log_->rmc );
-        HANDLE_MSG( DID_SYS_PARAMS, dev_log_->sysParams );
-        HANDLE_MSG( DID_SYS_SENSORS, dev_log_->sysSensors );
-        HANDLE_MSG( DID_FLASH_CONFIG, dev_log_->flashCfg );
-        HANDLE_MSG( DID_GPS1_POS, dev_log_->gps1Pos );
-        HANDLE_MSG( DID_GPS2_POS, dev_log_->gps2Pos );
-        HANDLE_MSG( DID_GPS1_SAT, dev_log_->gps1Sat );
-        HANDLE_MSG( DID_GPS2_SAT, dev_log_->gps2Sat );
-        HANDLE_MSG( DID_GPS1_VERSION, dev_log_->gps1Version );
-        HANDLE_MSG( DID_GPS2_VERSION, dev_log_->gps2Version );
-        HANDLE_MSG( DID_MAG_CAL, dev_log_->magCal );
-        HANDLE_MSG( DID_GPS1_RTK_POS_REL, dev_log_->gps1RtkPosRel );
-        HANDLE_MSG( DID_GPS1_RTK_POS_MISC, dev_log_->gps1RtkPosMisc );
-        HANDLE_MSG( DID_GPS2_RTK_CMP_REL, dev_log_->gps1RtkCmpRel );
-        HANDLE_MSG( DID_GPS2_RTK_CMP_MISC, dev_log_->gps1RtkCmpMisc );
-        // HANDLE_MSG( DID_FEATURE_BITS, dev_log_->featureBits );
-        HANDLE_MSG( DID_SENSORS_UCAL, dev_log_->sensorsUcal );
-        HANDLE_MSG( DID_SENSORS_TCAL, dev_log_->sensorsTcal );
-        HANDLE_MSG( DID_SENSORS_MCAL, dev_log_->sensorsMcal );
-        HANDLE_MSG( DID_SENSORS_TC_BIAS, dev_log_->sensorsTcBias );
-        HANDLE_MSG( DID_IO, dev_log_->io );
-        // HANDLE_MSG( DID_SENSORS_ADC, dev_log_->sensorsAdc );
-        HANDLE_MSG( DID_SCOMP, dev_log_->scomp );
-        HANDLE_MSG( DID_REFERENCE_IMU, dev_log_->refImu );
-        HANDLE_MSG( DID_REFERENCE_PIMU, dev_log_->refPImu );
-        HANDLE_MSG( DID_REFERENCE_MAGNETOMETER, dev_log_->refMag );
-        HANDLE_MSG( DID_GPS1_VEL, dev_log_->gps1Vel );
-        HANDLE_MSG( DID_GPS2_VEL, dev_log_->gps2Vel );
-        // HANDLE_MSG( DID_HDW_PARAMS, dev_log_->hdwParams );
-        // HANDLE_MSG( DID_NVR_MANAGE_USERPAGE, dev_log_->nvrManageUserpage );
-        // HANDLE_MSG( DID_NVR_USERPAGE_SN, dev_log_->nvrUserpageSn );
-        // HANDLE_MSG( DID_NVR_USERPAGE_G0, dev_log_->nvrUserpageG0 );
-        // HANDLE_MSG( DID_NVR_USERPAGE_G1, dev_log_->nvrUserpageG1 );
-        // HANDLE_MSG( DID_RTOS_INFO, dev_log_->rtosInfo );
-        HANDLE_MSG( DID_DEBUG_STRING, dev_log_->debugString );
-        HANDLE_MSG( DID_DEBUG_ARRAY, dev_log_->debugArray );
-        // HANDLE_MSG( DID_CAL_SC, dev_log_->calSc );
-        // HANDLE_MSG( DID_CAL_SC1, dev_log_->calSc1 );
-        // HANDLE_MSG( DID_CAL_SC2, dev_log_->calSc2 );
-        HANDLE_MSG( DID_SENSORS_ADC_SIGMA, dev_log_->sensorsAdcSigma );
-        HANDLE_MSG( DID_INL2_STATES, dev_log_->inl2States );
-        HANDLE_MSG( DID_INL2_STATUS, dev_log_->inl2Status );
-        // HANDLE_MSG( DID_INL2_MISC, dev_log_->inl2Misc );
-        HANDLE_MSG( DID_MAGNETOMETER, dev_log_->magnetometer );
-        HANDLE_MSG( DID_BAROMETER, dev_log_->barometer );
-        HANDLE_MSG( DID_GPS1_RTK_POS, dev_log_->gps1RtkPos );
-        HANDLE_MSG( DID_IMU3_UNCAL, dev_log_->imu3Uncal );
-        HANDLE_MSG( DID_IMU3_RAW, dev_log_->imu3Raw );
-        HANDLE_MSG( DID_IMU_RAW, dev_log_->imuRaw );
-        HANDLE_MSG( DID_PIMU, dev_log_->pimu );
-        HANDLE_MSG( DID_IMU, dev_log_->imu );
-        HANDLE_MSG( DID_INL2_MAG_OBS_INFO, dev_log_->inl2MagObsInfo );
-        HANDLE_MSG( DID_GPS_BASE_RAW, dev_log_->gpsBaseRaw );
-        // HANDLE_MSG( DID_GPS_RTK_OPT, dev_log_->gpsRtkOpt );
-        HANDLE_MSG( DID_MANUFACTURING_INFO, dev_log_->manufacturingInfo );
-        HANDLE_MSG( DID_BIT, dev_log_->bit );
-        HANDLE_MSG( DID_INS_3, dev_log_->ins3 );
-        HANDLE_MSG( DID_INS_4, dev_log_->ins4 );
-        HANDLE_MSG( DID_INL2_NED_SIGMA, dev_log_->inl2NedSigma );
-        HANDLE_MSG( DID_STROBE_IN_TIME, dev_log_->strobeInTime );
-        HANDLE_MSG( DID_GPS1_RAW, dev_log_->gps1Raw );
-        HANDLE_MSG( DID_GPS2_RAW, dev_log_->gps2Raw );
-        HANDLE_MSG( DID_WHEEL_ENCODER, dev_log_->wheelEncoder );
-        HANDLE_MSG( DID_GROUND_VEHICLE, dev_log_->groundVehicle );
-        HANDLE_MSG( DID_EVB_LUNA_VELOCITY_CONTROL, dev_log_->evbVelocityControl );
-        HANDLE_MSG( DID_DIAGNOSTIC_MESSAGE, dev_log_->diagnosticMessage );
-        HANDLE_MSG( DID_SURVEY_IN, dev_log_->surveyIn );
-        // HANDLE_MSG( DID_EVB2, dev_log_->evb2 );
-        // HANDLE_MSG( DID_PORT_MONITOR, dev_log_->portMonitor );
-        // HANDLE_MSG( DID_RTK_STATE, dev_log_->rtkState);
-        HANDLE_MSG( DID_RTK_CODE_RESIDUAL, dev_log_->rtkCodeResidual);
-        HANDLE_MSG( DID_RTK_PHASE_RESIDUAL, dev_log_->rtkPhaseResidual);
-        HANDLE_MSG( DID_RTK_DEBUG, dev_log_->rtkDebug);
-        // HANDLE_MSG( DID_RTK_DEBUG_2, dev_log_->rtkDebug2);
-        HANDLE_MSG( DID_GPX_STATUS, dev_log_->gpxStatus );
-        HANDLE_MSG( DID_GPX_DEBUG_ARRAY, dev_log_->gpxDebugArray );
-
-        default:
-            //            printf("Unhandled IS message DID: %d\n", message_type);
+    // Records without a timestamp are only kept from the chunks that are read.  The first chunk is always read
+    // for the configuration logged at the start, e.g. DID_DEV_INFO.
+    if (startFile != 0 || startOffset != 0)
+    {
+        DeviceReadState state;
+        DeviceProgress skipped;     // counted in progress with the chunks skipped
+        organizeChunks(files[0].name, 0, 1, log, skipped, state);
+    }
+
+    DeviceReadState state;
+    for (size_t i = startFile; i < files.size(); i++)
+    {
+        if (!organizeChunks(files[i].name, (i == startFile ? startOffset : 0), -1, log, progress, state))
             break;
+    }
+}
+
+bool LogReader::organizeChunks(const string& fileName, long offset, int maxChunks, DeviceLog& log, DeviceProgress& progress, DeviceReadState& state)
+{
+    // Decodes up to maxChunks chunks (-1 = all) of a file from offset.  Returns false when the time window has been read.
+    cISLogFileBase* file = CreateISLogFile(fileName, "rb");
+    if (file == NULL)
+        return true;
+    file->seek(offset);
+
+    bool more = true;
+    std::unique_ptr<cDataChunk> chunk(new cDataChunk());
+    int32_t nBytes;
+    while (more && maxChunks-- != 0 && !cancel_ && (nBytes = chunk->ReadFromFile(file)) > 0)
+    {
+        progress.bytesRead.fetch_add(nBytes, std::memory_order_relaxed);
+        while (chunk->GetDataSize() > 0)
+        {
+            p_data_buf_t* data = (p_data_buf_t*)chunk->GetDataPtr();
+            if (!chunk->PopFront(data->hdr.size + sizeof(p_data_hdr_t)))
+                break;
+            if (!organizeRecord(data, log, state))
+            {
+                more = false;
+                break;
+            }
         }
     }
+    CloseISLogFile(file);
+    return more;
 }
 
-void LogReader::forwardData(int device_id)
+bool LogReader::chunkTow(cISLogFileBase* file, long offset, long& next, double& tow)
 {
-    forward_message( DID_DEV_INFO, dev_log_->devInfo , device_id);
-    forward_message( DID_SYS_FAULT, dev_log_->sysFault, device_id );
-    forward_message( DID_INS_1, dev_log_->ins1, device_id );
-    forward_message( DID_INS_2, dev_log_->ins2, device_id );
-    forward_message( DID_GPS1_RCVR_POS, dev_log_->gps1UbxPos, device_id );
-    forward_message( DID_SYS_CMD, dev_log_->sysCmd, device_id );
-    // forward_message( DID_NMEA_BCAST_PERIOD, dev_log_->nmeaBcastPeriod, device_id );
-    // forward_message( DID_RMC, dev_log_->rmc, device_id );
-    forward_message( DID_SYS_PARAMS, dev_log_->sysParams, device_id );
-    forward_message( DID_SYS_SENSORS, dev_log_->sysSensors, device_id );
-    forward_message( DID_FLASH_CONFIG, dev_log_->flashCfg, device_id );
-    forward_message( DID_GPS1_POS, dev_log_->gps1Pos, device_id );
-    forward_message( DID_GPS2_POS, dev_log_->gps2Pos, device_id );
-    forward_message( DID_GPS1_SAT, dev_log_->gps1Sat, device_id );
-    forward_message( DID_GPS2_SAT, dev_log_->gps2Sat, device_id );
-    forward_message( DID_GPS1_VERSION, dev_log_->gps1Version, device_id );
-    forward_message( DID_GPS2_VERSION, dev_log_->gps2Version, device_id );
-    forward_message( DID_MAG_CAL, dev_log_->magCal, device_id );
-    forward_message( DID_GPS1_RTK_POS_REL, dev_log_->gps1RtkPosRel, device_id );
-    forward_message( DID_GPS1_RTK_POS_MISC, dev_log_->gps1RtkPosMisc, device_id );
-    forward_message( DID_GPS2_RTK_CMP_REL, dev_log_->gps1RtkCmpRel, device_id );
-    forward_message( DID_GPS2_RTK_CMP_MISC, dev_log_->gps1RtkCmpMisc, device_id );
-    // forward_message( DID_FEATURE_BITS, dev_log_->featureBits, device_id );
-    forward_message( DID_SENSORS_UCAL, dev_log_->sensorsUcal, device_id );
-    forward_message( DID_SENSORS_TCAL, dev_log_->sensorsTcal, device_id );
-    forward_message( DID_SENSORS_MCAL, dev_log_->sensorsMcal, device_id );
-    forward_message( DID_SENSORS_TC_BIAS, dev_log_->sensorsTcBias, device_id );
-    forward_message( DID_IO, dev_log_->io, device_id );
-    // forward_message( DID_SENSORS_ADC, dev_log_->sensorsAdc, device_id );
-    forward_message( DID_SCOMP, dev_log_->scomp, device_id );
-    forward_message( DID_REFERENCE_IMU, dev_log_->refImu, device_id );
-    forward_message( DID_REFERENCE_PIMU, dev_log_->refPImu, device_id );
-    forward_message( DID_REFERENCE_MAGNETOMETER, dev_log_->refMag, device_id );
-    forward_message( DID_GPS1_VEL, dev_log_->gps1Vel, device_id );
-    forward_message( DID_GPS2_VEL, dev_log_->gps2Vel, device_id );
-    // forward_message( DID_HDW_PARAMS, dev_log_->hdwParams, device_id );
-    // forward_message( DID_NVR_MANAGE_USERPAGE, dev_log_->nvrManageUserpage, device_id );
-    // forward_message( DID_NVR_USERPAGE_SN, dev_log_->nvrUserpageSn, device_id );
-    // forward_message( DID_NVR_USERPAGE_G0, dev_log_->nvrUserpageG0, device_id );
-    // forward_message( DID_NVR_USERPAGE_G1, dev_log_->nvrUserpageG1, device_id );
-    // forward_message( DID_RTOS_INFO, dev_log_->rtosInfo, device_id );
-    forward_message( DID_DEBUG_STRING, dev_log_->debugString, device_id );
-    forward_message( DID_DEBUG_ARRAY, dev_log_->debugArray, device_id );
-    // forward_message( DID_CAL_SC, dev_log_->calSc, device_id );
-    // forward_message( DID_CAL_SC1, dev_log_->calSc1, device_id );
-    // forward_message( DID_CAL_SC2, dev_log_->calSc2, device_id );
-    forward_message( DID_SENSORS_ADC_SIGMA, dev_log_->sensorsAdcSigma, device_id );
-    forward_message( DID_INL2_STATES, dev_log_->inl2States, device_id );
-    forward_message( DID_INL2_STATUS, dev_log_->inl2Status, device_id );
-    // forward_message( DID_INL2_MISC, dev_log_->inl2Misc, device_id );
-    forward_message( DID_MAGNETOMETER, dev_log_->magnetometer, device_id );
-    forward_message( DID_BAROMETER, dev_log_->barometer, device_id );
-    forward_message( DID_GPS1_RTK_POS, dev_log_->gps1RtkPos, device_id );
-    forward_message( DID_IMU3_UNCAL, dev_log_->imu3Uncal, device_id );
-    forward_message( DID_IMU3_RAW, dev_log_->imu3Raw, device_id );
-    forward_message( DID_IMU_RAW, dev_log_->imuRaw, device_id );
-    forward_message( DID_PIMU, dev_log_->pimu, device_id );
-    forward_message( DID_IMU, dev_log_->imu, device_id );
-    forward_message( DID_INL2_MAG_OBS_INFO, dev_log_->inl2MagObsInfo, device_id );
-    forward_message( DID_GPS_BASE_RAW, dev_log_->gpsBaseRaw, device_id );
-    // forward_message( DID_GPS_RTK_OPT, dev_log_->gpsRtkOpt, device_id );
-    forward_message( DID_MANUFACTURING_INFO, dev_log_->manufacturingInfo, device_id );
-    forward_message( DID_BIT, dev_log_->bit, device_id );
-    forward_message( DID_INS_3, dev_log_->ins3, device_id );
-    forward_message( DID_INS_4, dev_log_->ins4, device_id );
-    forward_message( DID_INL2_NED_SIGMA, dev_log_->inl2NedSigma, device_id );
-    forward_message( DID_STROBE_IN_TIME, dev_log_->strobeInTime, device_id );
-    forward_message( DID_GPS1_RAW, dev_log_->gps1Raw, device_id );
-    forward_message( DID_GPS2_RAW, dev_log_->gps2Raw, device_id );
-    forward_message( DID_WHEEL_ENCODER, dev_log_->wheelEncoder, device_id );
-    forward_message( DID_GROUND_VEHICLE, dev_log_->groundVehicle, device_id );
-    forward_message( DID_EVB_LUNA_VELOCITY_CONTROL, dev_log_->evbVelocityControl, device_id );
-    forward_message( DID_DIAGNOSTIC_MESSAGE, dev_log_->diagnosticMessage, device_id );
-    forward_message( DID_SURVEY_IN, dev_log_->surveyIn, device_id );
-    // forward_message( DID_EVB2, dev_log_->evb2, device_id );
-    // forward_message( DID_PORT_MONITOR, dev_log_->portMonitor, device_id );
-
-    // forward_message( DID_RTK_STATE, dev_log_->rtkState, device_id);
-    forward_message( DID_RTK_CODE_RESIDUAL, dev_log_->rtkCodeResidual, device_id);
-    forward_message( DID_RTK_PHASE_RESIDUAL, dev_log_->rtkPhaseResidual, device_id);
-    forward_message( DID_RTK_DEBUG, dev_log_->rtkDebug, device_id);
-    // forward_message( DID_RTK_DEBUG_2, dev_log_->rtkDebug2, device_id);
-    forward_message( DID_GPX_STATUS, dev_log_->gpxStatus, device_id );
-    forward_message( DID_GPX_DEBUG_ARRAY, dev_log_->gpxDebugArray, device_id );
+    sChunkHeader hdr;
+    file->seek(offset);
+    if (file->read(&hdr, sizeof(hdr)) != sizeof(hdr) || hdr.marker != DATA_CHUNK_MARKER || hdr.dataSize != ~(hdr.invDataSize))
+        return false;
+    next = offset + (long)sizeof(hdr) + (long)hdr.dataSize;
+
+    // Only records timestamped in GPS time of week place the chunk in the log
+    tow = -1.0;
+    p_data_buf_t data;
+    bool timeOfWeek = false;
+    if (hdr.dataSize >= sizeof(p_data_hdr_t) &&
+        file->read(&data.hdr, sizeof(p_data_hdr_t)) == sizeof(p_data_hdr_t) &&
+        !cISLogger::isHeaderCorrupt(&data.hdr) &&
+        data.hdr.size + sizeof(p_data_hdr_t) <= hdr.dataSize &&
+        file->read(data.buf, data.hdr.size) == data.hdr.size)
+    {
+        double time = recordTow(&data, -1.0, &timeOfWeek);
+        if (timeOfWeek)
+            tow = time;
+    }
+    return true;
 }
 
-bool LogReader::load()
+bool LogReader::organizeRecord(p_data_buf_t* data, DeviceLog& log, DeviceReadState& state)
 {
-    // printf("LogReader::load() \n");
+    if (useChunkHeader_ && cISLogger::isHeaderCorrupt(&data->hdr))
+        return true;
 
-    std::vector<std::shared_ptr<cDeviceLog>> devices = logger_.DeviceLogs();
-    for (int i = 0; i < (int)devices.size(); i++)
+    if (timeWindowEnabled())
     {
-        if (dev_log_ != nullptr)
+        // Boot time records are placed in GPS time with the latest GPS towOffset
+        if (data->hdr.id == DID_GPS1_POS && data->hdr.offset == 0 && data->hdr.size == sizeof(gps_pos_t))
+            state.towOffset = ((gps_pos_t*)data->buf)->towOffset;
+
+        // Records without a timestamp (configuration, ephemeris, ...) are kept from every chunk that is read
+        bool timeOfWeek;
+        double tow = recordTow(data, state.towOffset, &timeOfWeek);
+        if (std::isnan(tow))
+            return true;
+        if (tow >= 0.0)
         {
-            delete dev_log_;
+            if (endTow_ >= 0.0 && tow > endTow_)
+            {   // Stop once the whole window has been read, see TIME_WINDOW_STOP_MARGIN
+                if (timeOfWeek && state.windowReached && tow > endTow_ + TIME_WINDOW_STOP_MARGIN && ++state.pastWindow >= TIME_WINDOW_STOP_COUNT)
+                    return false;
+                return true;
+            }
+            state.pastWindow = 0;
+            if (tow < startTow_)
+                return true;
+            state.windowReached = true;
         }
-        dev_log_ = new DeviceLog();
+    }
+
+    // if (data->hdr.id == DID_DEV_INFO)
+    //     volatile int debug = 0;
 
-        organizeData(devices[i]);
-        forwardData(i);
+    if (data->hdr.size == 0)
+        return true;
+
+    // Skip records of DIDs that were not selected before they are copied
+    if (data->hdr.id >= DID_COUNT || !loadDid_[data->hdr.id])
+        return true;
+
+    switch (data->hdr.id)
+    {
+
+    // This is a helper macro, simply define the DID you want to forward,
+    // as well as the datatype of that DID.  So long as the data type
+    // has been defined in the PYBIND11_NUMPY_DTYPE macros below,
+    // then this will work.  It uses templates to abstract a lot
+    // of the tedium of this type of work
+    #define HANDLE_MSG(DID, vec) \
+    case DID: \
+        log_message(data->hdr.id, data->buf, vec); \
+        break;
+
+    HANDLE_MSG( DID_DEV_INFO, log.devInfo );
+    HANDLE_MSG( DID_SYS_FAULT, log.sysFault );
+    HANDLE_MSG( DID_INS_1, log.ins1 );
+    HANDLE_MSG( DID_INS_2, log.ins2 );
+    HANDLE_MSG( DID_GPS1_RCVR_POS, log.gps1UbxPos );
+    HANDLE_MSG( DID_SYS_CMD, log.sysCmd );
+    // HANDLE_MSG( DID_NMEA_BCAST_PERIOD, log.nmeaBcastPeriod );
+    // HANDLE_MSG( DID_RMC, log.rmc );
+    HANDLE_MSG( DID_SYS_PARAMS, log.sysParams );
+    HANDLE_MSG( DID_SYS_SENSORS, log.sysSensors );
+    HANDLE_MSG( DID_FLASH_CONFIG, log.flashCfg );
+    HANDLE_MSG( DID_GPS1_POS, log.gps1Pos );
+    HANDLE_MSG( DID_GPS2_POS, log.gps2Pos );
+    HANDLE_MSG( DID_GPS1_SAT, log.gps1Sat );
+    HANDLE_MSG( DID_GPS2_SAT, log.gps2Sat );
+    HANDLE_MSG( DID_GPS1_VERSION, log.gps1Version );
+    HANDLE_MSG( DID_GPS2_VERSION, log.gps2Version );
+    HANDLE_MSG( DID_MAG_CAL, log.magCal );
+    HANDLE_MSG( DID_GPS1_RTK_POS_REL, log.gps1RtkPosRel );
+    HANDLE_MSG( DID_GPS1_RTK_POS_MISC, log.gps1RtkPosMisc );
+    HANDLE_MSG( DID_GPS2_RTK_CMP_REL, log.gps1RtkCmpRel );
+    HANDLE_MSG( DID_GPS2_RTK_CMP_MISC, log.gps1RtkCmpMisc );
+    // HANDLE_MSG( DID_FEATURE_BITS, log.featureBits );
+    HANDLE_MSG( DID_SENSORS_UCAL, log.sensorsUcal );
+    HANDLE_MSG( DID_SENSORS_TCAL, log.sensorsTcal );
+    HANDLE_MSG( DID_SENSORS_MCAL, log.sensorsMcal );
+    HANDLE_MSG( DID_SENSORS_TC_BIAS, log.sensorsTcBias );
+    HANDLE_MSG( DID_IO, log.io );
+    // HANDLE_MSG( DID_SENSORS_ADC, log.sensorsAdc );
+    HANDLE_MSG( DID_SCOMP, log.scomp );
+    HANDLE_MSG( DID_REFERENCE_IMU, log.refImu );
+    HANDLE_MSG( DID_REFERENCE_PIMU, log.refPImu );
+    HANDLE_MSG( DID_REFERENCE_MAGNETOMETER, log.refMag );
+    HANDLE_MSG( DID_GPS1_VEL, log.gps1Vel );
+    HANDLE_MSG( DID_GPS2_VEL, log.gps2Vel );
+    // HANDLE_MSG( DID_HDW_PARAMS, log.hdwParams );
+    // HANDLE_MSG( DID_NVR_MANAGE_USERPAGE, log.nvrManageUserpage );
+    // HANDLE_MSG( DID_NVR_USERPAGE_SN, log.nvrUserpageSn );
+    // HANDLE_MSG( DID_NVR_USERPAGE_G0, log.nvrUserpageG0 );
+    // HANDLE_MSG( DID_NVR_USERPAGE_G1, log.nvrUserpageG1 );
+    // HANDLE_MSG( DID_RTOS_INFO, log.rtosInfo );
+    HANDLE_MSG( DID_DEBUG_STRING, log.debugString );
+    HANDLE_MSG( DID_DEBUG_ARRAY, log.debugArray );
+    // HANDLE_MSG( DID_CAL_SC, log.calSc );
+    // HANDLE_MSG( DID_CAL_SC1, log.calSc1 );
+    // HANDLE_MSG( DID_CAL_SC2, log.calSc2 );
+    HANDLE_MSG( DID_SENSORS_ADC_SIGMA, log.sensorsAdcSigma );
+    HANDLE_MSG( DID_INL2_STATES, log.inl2States );
+    HANDLE_MSG( DID_INL2_STATUS, log.inl2Status );
+    // HANDLE_MSG( DID_INL2_MISC, log.inl2Misc );
+    HANDLE_MSG( DID_MAGNETOMETER, log.magnetometer );
+    HANDLE_MSG( DID_BAROMETER, log.barometer );
+    HANDLE_MSG( DID_GPS1_RTK_POS, log.gps1RtkPos );
+    HANDLE_MSG( DID_IMU3_UNCAL, log.imu3Uncal );
+    HANDLE_MSG( DID_IMU3_RAW, log.imu3Raw );
+    HANDLE_MSG( DID_IMU_RAW, log.imuRaw );
+    HANDLE_MSG( DID_PIMU, log.pimu );
+    HANDLE_MSG( DID_IMU, log.imu );
+    HANDLE_MSG( DID_INL2_MAG_OBS_INFO, log.inl2MagObsInfo );
+    HANDLE_MSG( DID_GPS_BASE_RAW, log.gpsBaseRaw );
+    // HANDLE_MSG( DID_GPS_RTK_OPT, log.gpsRtkOpt );
+    HANDLE_MSG( DID_MANUFACTURING_INFO, log.manufacturingInfo );
+    HANDLE_MSG( DID_BIT, log.bit );
+    HANDLE_MSG( DID_INS_3, log.ins3 );
+    HANDLE_MSG( DID_INS_4, log.ins4 );
+    HANDLE_MSG( DID_INL2_NED_SIGMA, log.inl2NedSigma );
+    HANDLE_MSG( DID_STROBE_IN_TIME, log.strobeInTime );
+    HANDLE_MSG( DID_GPS1_RAW, log.gps1Raw );
+    HANDLE_MSG( DID_GPS2_RAW, log.gps2Raw );
+    HANDLE_MSG( DID_WHEEL_ENCODER, log.wheelEncoder );
+    HANDLE_MSG( DID_GROUND_VEHICLE, log.groundVehicle );
+    HANDLE_MSG( DID_EVB_LUNA_VELOCITY_CONTROL, log.evbVelocityControl );
+    HANDLE_MSG( DID_DIAGNOSTIC_MESSAGE, log.diagnosticMessage );
+    HANDLE_MSG( DID_SURVEY_IN, log.surveyIn );
+    // HANDLE_MSG( DID_EVB2, log.evb2 );
+    // HANDLE_MSG( DID_PORT_MONITOR, log.portMonitor );
+    // HANDLE_MSG( DID_RTK_STATE, log.rtkState);
+    HANDLE_MSG( DID_RTK_CODE_RESIDUAL, log.rtkCodeResidual);
+    HANDLE_MSG( DID_RTK_PHASE_RESIDUAL, log.rtkPhaseResidual);
+    HANDLE_MSG( DID_RTK_DEBUG, log.rtkDebug);
+    // HANDLE_MSG( DID_RTK_DEBUG_2, log.rtkDebug2);
+    HANDLE_MSG( DID_GPX_STATUS, log.gpxStatus );
+    HANDLE_MSG( DID_GPX_DEBUG_ARRAY, log.gpxDebugArray );
+
+    default:
+        //            printf("Unhandled IS message DID: %d\n", message_type);
+        break;
+    }
+    return true;
+}
+
+py::dict LogReader::forwardData(DeviceLog& log)
+{
+    py::dict dids;
+    forward_message( DID_DEV_INFO, log.devInfo , dids );
+    forward_message( DID_SYS_FAULT, log.sysFault, dids );
+    forward_message( DID_INS_1, log.ins1, dids );
+    forward_message( DID_INS_2, log.ins2, dids );
+    forward_message( DID_GPS1_RCVR_POS, log.gps1UbxPos, dids );
+    forward_message( DID_SYS_CMD, log.sysCmd, dids );
+    // forward_message( DID_NMEA_BCAST_PERIOD, log.nmeaBcastPeriod, dids );
+    // forward_message( DID_RMC, log.rmc, dids );
+    forward_message( DID_SYS_PARAMS, log.sysParams, dids );
+    forward_message( DID_SYS_SENSORS, log.sysSensors, dids );
+    forward_message( DID_FLASH_CONFIG, log.flashCfg, dids );
+    forward_message( DID_GPS1_POS, log.gps1Pos, dids );
+    forward_message( DID_GPS2_POS, log.gps2Pos, dids );
+    forward_message( DID_GPS1_SAT, log.gps1Sat, dids );
+    forward_message( DID_GPS2_SAT, log.gps2Sat, dids );
+    forward_message( DID_GPS1_VERSION, log.gps1Version, dids );
+    forward_message( DID_GPS2_VERSION, log.gps2Version, dids );
+    forward_message( DID_MAG_CAL, log.magCal, dids );
+    forward_message( DID_GPS1_RTK_POS_REL, log.gps1RtkPosRel, dids );
+    forward_message( DID_GPS1_RTK_POS_MISC, log.gps1RtkPosMisc, dids );
+    forward_message( DID_GPS2_RTK_CMP_REL, log.gps1RtkCmpRel, dids );
+    forward_message( DID_GPS2_RTK_CMP_MISC, log.gps1RtkCmpMisc, dids );
+    // forward_message( DID_FEATURE_BITS, log.featureBits, dids );
+    forward_message( DID_SENSORS_UCAL, log.sensorsUcal, dids );
+    forward_message( DID_SENSORS_TCAL, log.sensorsTcal, dids );
+    forward_message( DID_SENSORS_MCAL, log.sensorsMcal, dids );
+    forward_message( DID_SENSORS_TC_BIAS, log.sensorsTcBias, dids );
+    forward_message( DID_IO, log.io, dids );
+    // forward_message( DID_SENSORS_ADC, log.sensorsAdc, dids );
+    forward_message( DID_SCOMP, log.scomp, dids );
+    forward_message( DID_REFERENCE_IMU, log.refImu, dids );
+    forward_message( DID_REFERENCE_PIMU, log.refPImu, dids );
+    forward_message( DID_REFERENCE_MAGNETOMETER, log.refMag, dids );
+    forward_message( DID_GPS1_VEL, log.gps1Vel, dids );
+    forward_message( DID_GPS2_VEL, log.gps2Vel, dids );
+    // forward_message( DID_HDW_PARAMS, log.hdwParams, dids );
+    // forward_message( DID_NVR_MANAGE_USERPAGE, log.nvrManageUserpage, dids );
+    // forward_message( DID_NVR_USERPAGE_SN, log.nvrUserpageSn, dids );
+    // forward_message( DID_NVR_USERPAGE_G0, log.nvrUserpageG0, dids );
+    // forward_message( DID_NVR_USERPAGE_G1, log.nvrUserpageG1, dids );
+    // forward_message( DID_RTOS_INFO, log.rtosInfo, dids );
+    forward_message( DID_DEBUG_STRING, log.debugString, dids );
+    forward_message( DID_DEBUG_ARRAY, log.debugArray, dids );
+    // forward_message( DID_CAL_SC, log.calSc, dids );
+    // forward_message( DID_CAL_SC1, log.calSc1, dids );
+    // forward_message( DID_CAL_SC2, log.calSc2, dids );
+    forward_message( DID_SENSORS_ADC_SIGMA, log.sensorsAdcSigma, dids );
+    forward_message( DID_INL2_STATES, log.inl2States, dids );
+    forward_message( DID_INL2_STATUS, log.inl2Status, dids );
+    // forward_message( DID_INL2_MISC, log.inl2Misc, dids );
+    forward_message( DID_MAGNETOMETER, log.magnetometer, dids );
+    forward_message( DID_BAROMETER, log.barometer, dids );
+    forward_message( DID_GPS1_RTK_POS, log.gps1RtkPos, dids );
+    forward_message( DID_IMU3_UNCAL, log.imu3Uncal, dids );
+    forward_message( DID_IMU3_RAW, log.imu3Raw, dids );
+    forward_message( DID_IMU_RAW, log.imuRaw, dids );
+    forward_message( DID_PIMU, log.pimu, dids );
+    forward_message( DID_IMU, log.imu, dids );
+    forward_message( DID_INL2_MAG_OBS_INFO, log.inl2MagObsInfo, dids );
+    forward_message( DID_GPS_BASE_RAW, log.gpsBaseRaw, dids );
+    // forward_message( DID_GPS_RTK_OPT, log.gpsRtkOpt, dids );
+    forward_message( DID_MANUFACTURING_INFO, log.manufacturingInfo, dids );
+    forward_message( DID_BIT, log.bit, dids );
+    forward_message( DID_INS_3, log.ins3, dids );
+    forward_message( DID_INS_4, log.ins4, dids );
+    forward_message( DID_INL2_NED_SIGMA, log.inl2NedSigma, dids );
+    forward_message( DID_STROBE_IN_TIME, log.strobeInTime, dids );
+    forward_message( DID_GPS1_RAW, log.gps1Raw, dids );
+    forward_message( DID_GPS2_RAW, log.gps2Raw, dids );
+    forward_message( DID_WHEEL_ENCODER, log.wheelEncoder, dids );
+    forward_message( DID_GROUND_VEHICLE, log.groundVehicle, dids );
+    forward_message( DID_EVB_LUNA_VELOCITY_CONTROL, log.evbVelocityControl, dids );
+    forward_message( DID_DIAGNOSTIC_MESSAGE, log.diagnosticMessage, dids );
+    forward_message( DID_SURVEY_IN, log.surveyIn, dids );
+    // forward_message( DID_EVB2, log.evb2, dids );
+    // forward_message( DID_PORT_MONITOR, log.portMonitor, dids );
+
+    // forward_message( DID_RTK_STATE, log.rtkState, dids );
+    forward_message( DID_RTK_CODE_RESIDUAL, log.rtkCodeResidual, dids );
+    forward_message( DID_RTK_PHASE_RESIDUAL, log.rtkPhaseResidual, dids );
+    forward_message( DID_RTK_DEBUG, log.rtkDebug, dids );
+    // forward_message( DID_RTK_DEBUG_2, log.rtkDebug2, dids );
+    forward_message( DID_GPX_STATUS, log.gpxStatus, dids );
+    forward_message( DID_GPX_DEBUG_ARRAY, log.gpxDebugArray, dids );
+    return dids;
+}
+
+void LogReader::decodeDevices(int count, int threads, const std::function<void(int)>& decode)
+{
+    if (threads <= 0)
+        threads = (int)std::thread::hardware_concurrency();
+    threads = std::max(1, std::min(threads, count));
+
+    std::exception_ptr error = nullptr;
+    {
+        // Decode devices concurrently without the GIL, each thread fills its own DeviceLog
+        py::gil_scoped_release release;
+        std::atomic<int> next{0};
+        std::mutex errorMutex;
+        auto worker = [&]()
+        {
+            for (int i = next++; i < count; i = next++)
+            {
+                try
+                {
+                    decode(i);
+                }
+                catch (...)
+                {
+                    std::lock_guard<std::mutex> lock(errorMutex);
+                    if (!error)
+                        error = std::current_exception();
+                }
+            }
+        };
+
+        std::vector<std::thread> pool;
+        for (int t = 1; t < threads; t++)
+            pool.emplace_back(worker);
+        worker();
+        for (auto& t : pool)
+            t.join();
+    }
+
+    if (error)
+        std::rethrow_exception(error);
+}
+
+py::dict LogReader::load(int threads, bool follow)
+{
+    // printf("LogReader::load() \n");
+
+    std::vector<std::shared_ptr<cDeviceLog>> devices = logger_.DeviceLogs();
+    std::vector<DeviceLog> devLogs(devices.size());
+
+    threads_ = threads;
+    follow_.clear();
+    if (follow && logType_ != cISLogger::LOGTYPE_DAT)
+    {
+        cout << "Follow mode only supports *.dat logs" << endl;
+        follow = false;
+    }
+
+    vector<uint32_t> serialNumbers;
+    for (auto dev : devices)
+        serialNumbers.push_back(dev->SerialNumber());
+    initProgress(serialNumbers);
+
+    if (follow)
+    {
+        // Read the files directly so the read position of each device is known for poll()
+        for (auto dev : devices)
+            follow_.push_back(DeviceFollow{ dev->SerialNumber() });
+        decodeDevices((int)devices.size(), threads, [&](int i) { followData(follow_[i], devLogs[i], progress_[i]); });
+    }
+    else if (timeWindowEnabled() && logType_ == cISLogger::LOGTYPE_DAT)
+    {
+        // Read the files directly so the chunks before the time window can be skipped
+        decodeDevices((int)devices.size(), threads, [&](int i) { organizeWindow(devices[i]->SerialNumber(), devLogs[i], progress_[i]); });
+    }
+    else
+    {
+        decodeDevices((int)devices.size(), threads, [&](int i) { organizeData(devices[i], devLogs[i], progress_[i]); });
+    }
+
+    // { device index: { did: ndarray } }
+    py::dict logs;
+    for (int i = 0; i < (int)devices.size(); i++)
+    {
+        logs[py::int_(i)] = forwardData(devLogs[i]);
     }
 
 	logger_.CloseAllFiles();
 
-    return true;
+    return logs;
+}
+
+py::dict LogReader::poll()
+{
+    // { device index: { did: ndarray } } of the records appended since the last load() or poll()
+    std::vector<DeviceLog> devLogs(follow_.size());
+    decodeDevices((int)follow_.size(), threads_, [&](int i) { followData(follow_[i], devLogs[i], progress_[i]); });
+
+    py::dict logs;
+    for (int i = 0; i < (int)follow_.size(); i++)
+    {
+        logs[py::int_(i)] = forwardData(devLogs[i]);
+    }
+    return logs;
+}
+
+void LogReader::initProgress(const vector<uint32_t>& serialNumbers)
+{
+    // Size of the log files of each device, the total reported by progress()
+    const char* extensionRegex = logType_ == cISLogger::LOGTYPE_RAW ? "\\.raw$" : (logType_ == cISLogger::LOGTYPE_SDAT ? "\\.sdat$" : "\\.dat$");
+    vector<ISFileManager::file_info_t> files;
+    ISFileManager::GetDirectorySpaceUsed(directory_, extensionRegex, files, false, false);
+
+    progress_.reset(new DeviceProgress[serialNumbers.size()]);
+    progressCount_ = (int)serialNumbers.size();
+    for (auto& file : files)
+    {
+        int serialNum, index;
+        string date, time;
+        if (!cISLogger::ParseFilename(ISFileManager::GetFileName(file.name), serialNum, date, time, index))
+            continue;
+        for (int i = 0; i < progressCount_; i++)
+            if ((uint32_t)serialNum == serialNumbers[i])
+                progress_[i].bytesTotal += file.size;
+    }
+}
+
+pybind11::list LogReader::progress()
+{
+    // [(bytes read, bytes total)] of each device for the running or last load() and poll().  Safe to call
+    // from another thread while load() is decoding, which releases the GIL.
+    py::list devices;
+    for (int i = 0; i < progressCount_; i++)
+        devices.append(py::make_tuple(progress_[i].bytesRead.load(std::memory_order_relaxed), progress_[i].bytesTotal));
+    return devices;
+}
+
+void LogReader::cancel()
+{
+    // Stop a running load() or poll() from another thread, it returns the records decoded so far.  Cleared by init().
+    cancel_ = true;
+}
+
+vector<ISFileManager::file_info_t> LogReader::deviceFiles(uint32_t serialNumber)
+{
+    // *.dat log files of the device in the order they are written
+    vector<ISFileManager::file_info_t> files;
+    ISFileManager::GetDirectorySpaceUsed(directory_, "\\.dat$", files, false, false);
+    vector<ISFileManager::file_info_t> deviceFiles;
+    for (auto& file : files)
+    {
+        int serialNum, index;
+        string date, time;
+        if (cISLogger::ParseFilename(ISFileManager::GetFileName(file.name), serialNum, date, time, index) && (uint32_t)serialNum == serialNumber)
+            deviceFiles.push_back(file);
+    }
+    sort(deviceFiles.begin(), deviceFiles.end(), [](const ISFileManager::file_info_t& a, const ISFileManager::file_info_t& b) { return a.name < b.name; });
+    return deviceFiles;
+}
+
+void LogReader::followData(DeviceFollow& follow, DeviceLog& log, DeviceProgress& progress)
+{
+    std::unique_ptr<cDataChunk> chunk(new cDataChunk());
+    for (auto& deviceFile : deviceFiles(follow.serialNumber))
+    {
+        const string& fileName = deviceFile.name;
+        if (fileName < follow.fileName)
+            continue;
+        if (fileName != follow.fileName)
+        {   // Earlier files are complete once the logger has moved on to a new file
+            follow.fileName = fileName;
+            follow.offset = 0;
+        }
+
+        cISLogFileBase* file = CreateISLogFile(fileName, "rb");
+        if (file == NULL)
+            break;
+        file->seek(follow.offset);
+
+        // A chunk that is still being written fails to read and is read again on the next poll()
+        int32_t nBytes;
+        while (!cancel_ && (nBytes = chunk->ReadFromFile(file)) > 0)
+        {
+            follow.offset += nBytes;
+            progress.bytesRead.fetch_add(nBytes, std::memory_order_relaxed);
+            while (chunk->GetDataSize() > 0)
+            {
+                p_data_buf_t* data = (p_data_buf_t*)chunk->GetDataPtr();
+                if (!chunk->PopFront(data->hdr.size + sizeof(p_data_hdr_t)))
+                    break;
+                organizeRecord(data, log, follow.state);
+            }
+        }
+        CloseISLogFile(file);
+    }
 }
 
 pybind11::list LogReader::getSerialNumbers()
@@ -372,17 +793,16 @@ pybind11::list LogReader::protocolVersion()
     return py::cast(version);
 }
 
-void LogReader::ins1ToIns2(int device_id)
+py::array_t<ins_2_t> LogReader::ins1ToIns2(py::array_t<ins_1_t> ins1)
 {
-    printf("LogReader::ins1ToIns2() converting ins1 to ins2 for device: %d\n", device_id);
-    ins_2_t ins2;
-    dev_log_->ins2.clear();
-    for (unsigned int i=0; i<dev_log_->ins1.size(); i++)
+    printf("LogReader::ins1ToIns2() converting ins1 to ins2\n");
+    std::vector<ins_2_t> ins2(ins1.size());
+    for (py::ssize_t i=0; i<ins1.size(); i++)
     {
-        convertIns1ToIns2(&(dev_log_->ins1[i]), &ins2);
-        dev_log_->ins2.push_back(ins2);
+        ins_1_t ins = *ins1.data(i);
+        convertIns1ToIns2(&ins, &ins2[i]);
     }
-    forward_message( DID_INS_2, dev_log_->ins2, device_id );
+    return to_array(ins2);
 }
 
 void LogReader::exitHack(int exit_code)
@@ -403,8 +823,12 @@ PYBIND11_MODULE(log_reader, m) {
     // Bind the Interface Class
     py::class_<LogReader>(m, "LogReader") // The object will be named IS_Comm in python
             .def(py::init<>()) // constructor
-            .def("init", &LogReader::init)
-            .def("load", &LogReader::load)
+            .def("init", &LogReader::init, py::arg("log_directory"), py::arg("serials"), py::arg("dids") = py::list(), py::arg("exclude_dids") = py::list())
+            .def("setTimeWindow", &LogReader::setTimeWindow, py::arg("start_tow") = -1.0, py::arg("end_tow") = -1.0)
+            .def("load", &LogReader::load, py::arg("threads") = 0, py::arg("follow") = false)
+            .def("poll", &LogReader::poll)
+            .def("progress", &LogReader::progress)
+            .def("cancel", &LogReader::cancel)
             .def("getSerialNumbers", &LogReader::getSerialNumbers)
             .def("protocolVersion", &LogReader::protocolVersion)
             .def("ins1ToIns2", &LogReader::ins1ToIns2)
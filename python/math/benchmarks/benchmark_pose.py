@@ -0,0 +1,201 @@
+'''
+Micro-benchmarks for inertialsense_math.pose
+
+Each benchmark times one function on random input at several row counts and reports the best of a
+few rounds, so the first call that compiles Numba kernels is not counted.  Functions that replaced a
+per-row Python loop are also checked against, and compared to, that loop.  Save a run with --save and compare a later run against it with --compare to see
+regressions.
+
+Usage: python benchmark_pose.py [--rows 1e3,1e4,...] [--only DCMquat,...] [--backend numpy|numba]
+                                [--save file.json] [--compare file.json]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from numpy import pi
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import inertialsense_math.pose as pose
+from inertialsense_math.pose import *
+
+DEFAULT_ROWS = [1e3, 1e4, 1e5, 1e6, 1e7]
+NUM_DEVICES = 4             # Quaternions averaged per row, i.e. number of devices in an RMS report
+MAX_LOOP_ROWS = 10000       # Per-row reference loops are timed on at most this many rows and scaled
+MIN_TIME = 0.2              # Repeat each benchmark for at least this long (s)
+REGRESSION = 1.2            # Flag results this much slower than the --compare baseline
+
+
+def randQuat(rng, rows):
+    return normalize(rng.normal(size=(rows, 4)), axis=1)
+
+def randLla(rng, rows):
+    return np.c_[rng.uniform(-80, 80, rows), rng.uniform(-180, 180, rows), rng.uniform(0, 3000, rows)]
+
+def headingSeries(rng, rows):
+    # Wrapped heading of a vehicle turning both ways, crossing +-pi many times
+    return unwrapAngle(np.cumsum(rng.normal(0.0, 0.05, rows)) + 0.002*np.arange(rows))
+
+def devicesQuat(rng, rows):
+    # Attitudes of several devices scattered around a common attitude
+    q0 = normalize(rng.normal(size=(rows, 1, 4)), axis=2)
+    return normalize(q0 + 0.05*rng.normal(size=(rows, NUM_DEVICES, 4)), axis=2)
+
+
+def DCMquatLoop(mat):
+    # Per-row implementation DCMquat() replaced
+    q = np.empty(shape=(np.shape(mat)[0], 4))
+    q_sq4 = np.empty_like(q)
+    q_sq4[:,0] = 1.0 + mat[:,0,0] + mat[:,1,1] + mat[:,2,2]
+    q_sq4[:,1] = 1.0 + mat[:,0,0] - mat[:,1,1] - mat[:,2,2]
+    q_sq4[:,2] = 1.0 - mat[:,0,0] + mat[:,1,1] - mat[:,2,2]
+    q_sq4[:,3] = 1.0 - mat[:,0,0] - mat[:,1,1] + mat[:,2,2]
+    for i in range(0, np.shape(mat)[0]):
+        ind = np.argmax(q_sq4[i, :])
+        q[i,ind] = 0.5 * np.sqrt(q_sq4[i,ind])
+        d = 0.25 / q[i,ind]
+        if ind == 0:
+            q[i,1] = d * (mat[i,1,2] - mat[i,2,1])
+            q[i,2] = d * (mat[i,2,0] - mat[i,0,2])
+            q[i,3] = d * (mat[i,0,1] - mat[i,1,0])
+        elif ind == 1:
+            q[i,0] = d * (mat[i,1,2] - mat[i,2,1])
+            q[i,2] = d * (mat[i,1,0] + mat[i,0,1])
+            q[i,3] = d * (mat[i,0,2] + mat[i,2,0])
+        elif ind == 2:
+            q[i,0] = d * (mat[i,2,0] - mat[i,0,2])
+            q[i,1] = d * (mat[i,1,0] + mat[i,0,1])
+            q[i,3] = d * (mat[i,2,1] + mat[i,1,2])
+        else:
+            q[i,0] = d * (mat[i,0,1] - mat[i,1,0])
+            q[i,1] = d * (mat[i,0,2] + mat[i,2,0])
+            q[i,2] = d * (mat[i,2,1] + mat[i,1,2])
+    ind = q[:,0] < 0
+    q[ind, :] = -q[ind, :]
+    return q
+
+def unwrapAngleLoop(angle):
+    # Per-element implementation unwrapAngle() replaced
+    for i in range(0, np.shape(angle)[0]):
+        while angle[i] < -pi:
+            angle[i] += 2*pi
+        while angle[i] > pi:
+            angle[i] -= 2*pi
+    return angle
+
+def continuousAngleLoop(angle):
+    # Per-sample implementation continuousAngle() replaced, logPlot.angle_unwrap()
+    unwrap = 0.0
+    result = np.empty_like(angle)
+    anglePrev = angle[0]
+    for i in range(np.shape(angle)[0]):
+        result[i] = angle[i] + unwrap
+        deltaAngle = result[i]-anglePrev
+        if deltaAngle > pi:
+            unwrap -= 2*pi
+            result[i] = angle[i] + unwrap
+        elif deltaAngle < -pi:
+            unwrap += 2*pi
+            result[i] = angle[i] + unwrap
+        anglePrev = result[i]
+    return result
+
+def meanOfQuatLoop(q):
+    return np.concatenate([meanOfQuat(q[i, :, :]) for i in range(q.shape[0])])
+
+
+# name: (function, input(rng, rows), per-row reference or None, max rows or None)
+# Functions that modify their input in place get a fresh copy of it every call.
+BENCHMARKS = {
+    'DCMquat':          (DCMquat, lambda rng, n: (quatDCM(randQuat(rng, n)),), DCMquatLoop, None),
+    'quat2euler':       (quat2euler, lambda rng, n: (randQuat(rng, n),), None, None),
+    'euler2quat':       (euler2quat, lambda rng, n: (rng.uniform(-pi, pi, (n, 3)),), None, None),
+    'mul_Quat_Quat':    (mul_Quat_Quat, lambda rng, n: (randQuat(rng, n), randQuat(rng, n)), None, None),
+    'quatRot':          (quatRot, lambda rng, n: (randQuat(rng, n), rng.normal(size=(n, 3))), None, None),
+    'lla2ned':          (lla2ned, lambda rng, n: (np.r_[40.0, -111.0, 1400.0], randLla(rng, n)), None, None),
+    'ecef2lla':         (ecef2lla, lambda rng, n: (lla2ecef(randLla(rng, n)),), None, None),
+    'meanOfQuat':       (meanOfQuat, lambda rng, n: (normalize(np.r_[1.0, 0, 0, 0] + 0.05*rng.normal(size=(n, 4)), axis=1),), None, None),
+    'meanOfQuatArray':  (meanOfQuatArray, lambda rng, n: (devicesQuat(rng, n),), meanOfQuatLoop, 1e6),
+    'unwrapAngle':      (unwrapAngle, lambda rng, n: (rng.uniform(-20, 20, n),), unwrapAngleLoop, None),
+    'continuousAngle':  (continuousAngle, lambda rng, n: (headingSeries(rng, n),), continuousAngleLoop, None),
+}
+INPLACE = {'unwrapAngle'}
+
+
+def timeFn(fn, args, copy):
+    # Best time of repeated calls
+    best = None
+    total = 0.0
+    calls = 0
+    while total < MIN_TIME or calls < 2:
+        a = [np.copy(x) for x in args] if copy else args
+        start = time.perf_counter()
+        result = fn(*a)
+        t = time.perf_counter() - start
+        total += t
+        calls += 1
+        best = t if best is None else min(best, t)
+    return best, result
+
+def run(name, rows):
+    fn, setup, ref, maxRows = BENCHMARKS[name]
+    args = setup(np.random.default_rng(0), rows)
+    copy = name in INPLACE
+    t, result = timeFn(fn, args, copy)
+    tRef = None
+    if ref is not None:
+        n = min(rows, MAX_LOOP_ROWS)
+        refArgs = [x[:n] if np.ndim(x) and len(x) == rows else x for x in args]
+        tRef, expected = timeFn(ref, refArgs, True)
+        assert np.max(np.abs(result[:n] - expected)) < 1e-8, name + ' does not match its per-row implementation'
+        tRef *= rows / float(n)
+    return t, tRef
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='inertialsense_math.pose micro-benchmarks')
+    parser.add_argument('--rows', default=','.join('%g' % n for n in DEFAULT_ROWS), help='comma separated row counts')
+    parser.add_argument('--only', default=None, help='comma separated benchmark names')
+    parser.add_argument('--backend', default=None, choices=BACKENDS, help='pose backend, see pose.setBackend()')
+    parser.add_argument('--save', default=None, help='write results to a JSON file')
+    parser.add_argument('--compare', default=None, help='compare with results saved by --save')
+    opts = parser.parse_args()
+
+    if opts.backend:
+        setBackend(opts.backend)
+    print('backend: ' + pose.backend)
+    rows = [int(float(n)) for n in opts.rows.split(',')]
+    names = opts.only.split(',') if opts.only else list(BENCHMARKS)
+    baseline = {}
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    print('%-16s %9s %11s %11s %8s %9s' % ('function', 'rows', 'time (s)', 'loop (s)', 'speedup', 'baseline'))
+    for name in names:
+        maxRows = BENCHMARKS[name][3]
+        for n in rows:
+            if maxRows and n > maxRows:
+                continue
+            t, tRef = run(name, n)
+            key = '%s/%d' % (name, n)
+            results[key] = t
+            loop = '%10.4f%s %7.1fx' % (tRef, '*' if n > MAX_LOOP_ROWS else ' ', tRef / t) if tRef else '%20s' % ''
+            base = ''
+            if key in baseline:
+                ratio = t / baseline[key]
+                base = '%8.2fx' % ratio
+                if ratio > REGRESSION:
+                    base += '  REGRESSION'
+                    regressions += 1
+            print('%-16s %9d %11.5f %s %s' % (name, n, t, loop, base))
+    print('* per-row loop timed on %d rows and scaled' % MAX_LOOP_ROWS)
+
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    sys.exit(1 if regressions else 0)
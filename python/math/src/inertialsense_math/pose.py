@@ -5,9 +5,66 @@ Author: Walt Johnson
 '''
 from __future__ import print_function
 
+import importlib.util
+import os
 import numpy as np
 from numpy import sin, cos, tan, arccos, arcsin, arctan2, arctan, r_, c_, dot, pi
 
+# Compiled kernels for mul_Quat_Quat(), quatRot() and lla2ned() are used when Numba is installed, unless
+# the INERTIALSENSE_MATH_BACKEND environment variable is set to 'numpy'.  See setBackend().  Numba is
+# slow to import, so the kernels are imported by their first call.
+poseKernels = None
+
+BACKENDS = ['numpy'] + (['numba'] if importlib.util.find_spec('numba') is not None else [])
+backend = os.environ.get('INERTIALSENSE_MATH_BACKEND', BACKENDS[-1])
+if backend not in BACKENDS:
+    backend = BACKENDS[-1]
+
+
+def setBackend(name):
+    """
+    Select the 'numpy' or 'numba' implementation of the functions that have compiled kernels.
+    Returns the previous backend.
+    """
+    global backend
+    assert name in BACKENDS, "Backend %s is not available" % name
+    previous = backend
+    backend = name
+    return previous
+
+
+def _kernels():
+    """
+    The poseKernels module, imported on first use
+    """
+    global poseKernels
+    if poseKernels is None:
+        from inertialsense_math import poseKernels as kernels
+        poseKernels = kernels
+    return poseKernels
+
+
+def _outRows(out, shape):
+    """
+    Result array of the given [rows, columns] shape, which is out if it is given (viewed as 2D)
+    """
+    if out is None:
+        return np.empty(shape)
+    rows = out if out.ndim == 2 else out[None, :]
+    assert rows.shape == shape, "out must have shape %s" % (shape,)
+    return rows
+
+
+def _broadcastRows(n1, n2):
+    """
+    Number of result rows of arrays with n1 and n2 rows, where a single row applies to every row
+    """
+    return n2 if n1 == 1 else n1
+
+
+def _floatRows(a):
+    return np.asarray(a, dtype=np.float64)
+
 
 def quatInit():
     """ 
@@ -34,7 +91,7 @@ def quatConj(q):
     return qc
 
 
-def mul_Quat_Quat(q1, q2):
+def mul_Quat_Quat(q1, q2, out=None):
     """
     Product of two Quaternions. 
     Order of q1 and q2 matters (same as applying two successive DCMs)!!!
@@ -42,6 +99,7 @@ def mul_Quat_Quat(q1, q2):
     result = q1 * q2
     Order of rotation in rotation matrix notation: R(result) = R(q1) * R(q2)
     i.e. rotation by q2 followed by rotation by q1
+    The result is written to out and out is returned if it is given (out may be q1 or q2).
     References:
     http://www.mathworks.com/help/aeroblks/quaternionmultiplication.html
     http://physicsforgames.blogspot.com/2010/02/quaternions.html
@@ -59,12 +117,21 @@ def mul_Quat_Quat(q1, q2):
     n2 = np.shape(q2)[0]
     assert n1 == n2 or n1 == 1 or n2 == 1, "Number of quaternions in arrays do not match"
 
-    result = np.empty((max(n1, n2), 4))
-    result[:,0] = q1[:,0]*q2[:,0] - q1[:,1]*q2[:,1] - q1[:,2]*q2[:,2] - q1[:,3]*q2[:,3]
-    result[:,1] = q1[:,0]*q2[:,1] + q1[:,1]*q2[:,0] - q1[:,2]*q2[:,3] + q1[:,3]*q2[:,2]
-    result[:,2] = q1[:,0]*q2[:,2] + q1[:,1]*q2[:,3] + q1[:,2]*q2[:,0] - q1[:,3]*q2[:,1]
-    result[:,3] = q1[:,0]*q2[:,3] - q1[:,1]*q2[:,2] + q1[:,2]*q2[:,1] + q1[:,3]*q2[:,0]
-
+    result = _outRows(out, (_broadcastRows(n1, n2), 4))
+    if backend == 'numba':
+        _kernels().mulQuatQuat(_floatRows(q1), _floatRows(q2), result)
+    else:
+        # Columns are written one at a time, so do not overwrite an input before it is used
+        if out is not None and (np.may_share_memory(out, q1) or np.may_share_memory(out, q2)):
+            q1 = np.copy(q1)
+            q2 = np.copy(q2)
+        result[:,0] = q1[:,0]*q2[:,0] - q1[:,1]*q2[:,1] - q1[:,2]*q2[:,2] - q1[:,3]*q2[:,3]
+        result[:,1] = q1[:,0]*q2[:,1] + q1[:,1]*q2[:,0] - q1[:,2]*q2[:,3] + q1[:,3]*q2[:,2]
+        result[:,2] = q1[:,0]*q2[:,2] + q1[:,1]*q2[:,3] + q1[:,2]*q2[:,0] - q1[:,3]*q2[:,1]
+        result[:,3] = q1[:,0]*q2[:,3] - q1[:,1]*q2[:,2] + q1[:,2]*q2[:,1] + q1[:,3]*q2[:,0]
+
+    if out is not None:
+        return out
     if array == 0:
         result = np.squeeze(result)
     return result
@@ -209,12 +276,13 @@ def normalize(v, axis=None):
     return result
 
 
-def quatRot(q, v):
+def quatRot(q, v, out=None):
     """
     Computationally simple means to apply quaternion rotation to a vector.
     Requires quaternion be normalized first.
     If quaternion describes current attitude, then rotation is body -> inertial frame.
     Equivalent to using rotation matrix: DCM(q).transpose * v
+    The result is written to out and out is returned if it is given (out may be v).
     """
     if len(np.shape(q)) == 1:
         q = np.expand_dims(q, axis=0)
@@ -229,10 +297,16 @@ def quatRot(q, v):
     n2 = np.shape(v)[0]
     assert n1 == n2 or n1 == 1 or n2 == 1, "Number of quaternions and vectors in arrays do not match"
 
-    result = np.empty((max(n1, n2), 3))
-    t = 2.0 * np.cross(q[:,1:4], v)
-    result = v + (q[:,0] * t.T).T + np.cross(q[:,1:4], t)
+    result = _outRows(out, (_broadcastRows(n1, n2), 3))
+    if backend == 'numba':
+        _kernels().quatRot(_floatRows(q), _floatRows(v), result)
+    else:
+        t = 2.0 * np.cross(q[:,1:4], v)
+        np.add(v, (q[:,0] * t.T).T, out=result)
+        result += np.cross(q[:,1:4], t)
 
+    if out is not None:
+        return out
     if array == 0:
         result = np.squeeze(result)
     return result
@@ -487,26 +561,28 @@ def DCMquat(mat):
     q_sq4[:,2] = 1.0 - mat[:,0,0] + mat[:,1,1] - mat[:,2,2]
     q_sq4[:,3] = 1.0 - mat[:,0,0] - mat[:,1,1] + mat[:,2,2]
 
-    for i in range(0, np.shape(mat)[0]):
-        ind = np.argmax(q_sq4[i, :])
-        q[i,ind] = 0.5 * np.sqrt(q_sq4[i,ind])
-        d = 0.25 / q[i,ind]
-        if ind == 0:
-            q[i,1] = d * (mat[i,1,2] - mat[i,2,1])
-            q[i,2] = d * (mat[i,2,0] - mat[i,0,2])
-            q[i,3] = d * (mat[i,0,1] - mat[i,1,0])
-        elif ind == 1:
-            q[i,0] = d * (mat[i,1,2] - mat[i,2,1])
-            q[i,2] = d * (mat[i,1,0] + mat[i,0,1])
-            q[i,3] = d * (mat[i,0,2] + mat[i,2,0])
-        elif ind == 2:
-            q[i,0] = d * (mat[i,2,0] - mat[i,0,2])
-            q[i,1] = d * (mat[i,1,0] + mat[i,0,1])
-            q[i,3] = d * (mat[i,2,1] + mat[i,1,2])
-        else:
-            q[i,0] = d * (mat[i,0,1] - mat[i,1,0])
-            q[i,1] = d * (mat[i,0,2] + mat[i,2,0])
-            q[i,2] = d * (mat[i,2,1] + mat[i,1,2])
+    # Compute the largest component first and the others from it, for numerical stability
+    ind = np.argmax(q_sq4, axis=1)
+    rows = np.arange(np.shape(mat)[0])
+    q[rows,ind] = 0.5 * np.sqrt(q_sq4[rows,ind])
+    d = 0.25 / q[rows,ind]
+
+    i = ind == 0
+    q[i,1] = d[i] * (mat[i,1,2] - mat[i,2,1])
+    q[i,2] = d[i] * (mat[i,2,0] - mat[i,0,2])
+    q[i,3] = d[i] * (mat[i,0,1] - mat[i,1,0])
+    i = ind == 1
+    q[i,0] = d[i] * (mat[i,1,2] - mat[i,2,1])
+    q[i,2] = d[i] * (mat[i,1,0] + mat[i,0,1])
+    q[i,3] = d[i] * (mat[i,0,2] + mat[i,2,0])
+    i = ind == 2
+    q[i,0] = d[i] * (mat[i,2,0] - mat[i,0,2])
+    q[i,1] = d[i] * (mat[i,1,0] + mat[i,0,1])
+    q[i,3] = d[i] * (mat[i,2,1] + mat[i,1,2])
+    i = ind == 3
+    q[i,0] = d[i] * (mat[i,0,1] - mat[i,1,0])
+    q[i,1] = d[i] * (mat[i,0,2] + mat[i,2,0])
+    q[i,2] = d[i] * (mat[i,2,1] + mat[i,1,2])
 
     ind = q[:,0] < 0
     q[ind, :] = -q[ind, :]
@@ -784,7 +860,7 @@ def ecef2lla(Pe, Niter=5):
     return LLA
 
 
-def lla2ned(lla_ref_deg, lla_deg):
+def lla2ned(lla_ref_deg, lla_deg, out=None):
     """
     Find NED (north, east, down) offset from lla_ref_deg to lla_deg
     lla_ref_deg[0] = reference latitude (decimal degree)
@@ -793,6 +869,7 @@ def lla2ned(lla_ref_deg, lla_deg):
     lla_deg[0] = latitude (decimal degree)
     lla_deg[1] = longitude (decimal degree)
     lla_deg[2] = msl altitude (m)
+    The result is written to out and out is returned if it is given (out may be lla_deg).
     """
     # Earth equatorial radius
     R = 6378137.0
@@ -808,6 +885,15 @@ def lla2ned(lla_ref_deg, lla_deg):
     if len(np.shape(lla_ref_deg)) == 1:
         lla_ref_deg = np.expand_dims(lla_ref_deg, axis=0)
 
+    if backend == 'numba':
+        Pn = _outRows(out, (_broadcastRows(np.shape(lla_deg)[0], np.shape(lla_ref_deg)[0]), 3))
+        _kernels().lla2ned(_floatRows(lla_ref_deg), _floatRows(lla_deg), Pn)
+        if out is not None:
+            return out
+        if array == 0:
+            Pn = np.squeeze(Pn)
+        return Pn
+
     lla = np.copy(lla_deg)
     lla_ref = np.copy(lla_ref_deg)
     # Convert deg to rad
@@ -821,11 +907,13 @@ def lla2ned(lla_ref_deg, lla_deg):
     # radius of curvature in the meridian
     Rm = Rn * (1.0 - e2) / (1.0 - e2 * sin_lat_ref**2)
 
-    Pn = np.empty(np.shape(lla))
+    Pn = _outRows(out, np.shape(deltaLLA))
     Pn[:,0] =  deltaLLA[:,0] * Rm
     Pn[:,1] =  deltaLLA[:,1] * Rn * cos(lla_ref[:, 0])
     Pn[:,2] = -deltaLLA[:,2]
 
+    if out is not None:
+        return out
     if array == 0:
         Pn = np.squeeze(Pn)
     return Pn
@@ -1129,17 +1217,40 @@ def unwrapAngle(angle):
         array = 1
 
     twoPi = pi*2
-    for i in range(0, np.shape(angle)[0]):
-        while angle[i] < -pi:
-            angle[i] += twoPi
-        while angle[i] > pi:
-            angle[i] -= twoPi
+    # Remove all but the last turn at once, then step like a while loop so angles on the
+    # boundaries are handled the same as adding or subtracting one turn at a time
+    ind = np.flatnonzero(angle > 3*pi)
+    angle[ind] -= twoPi * np.floor((angle[ind] - pi) / twoPi)
+    ind = np.flatnonzero(angle < -3*pi)
+    angle[ind] += twoPi * np.floor((-pi - angle[ind]) / twoPi)
+    ind = np.flatnonzero((angle < -pi) | (angle > pi))
+    while len(ind):
+        angle[ind] -= np.where(angle[ind] > pi, twoPi, -twoPi)
+        ind = ind[(angle[ind] < -pi) | (angle[ind] > pi)]
 
     if array == 0:
         angle = np.squeeze(angle)
     return angle
 
 
+def continuousAngle(angle, axis=0):
+    """
+    Remove the 2*pi jumps of a series of angles constrained to [-pi, pi], e.g. heading, along axis.
+    A step between samples larger than pi adds or removes one turn from the rest of the series.
+    Returns a new array.
+    """
+    result = np.array(angle, copy=True)
+    if result.shape[axis] < 2:
+        return result
+    step = np.diff(result, axis=axis)
+    # Whole turns so the offset of a sample does not depend on rounding accumulated over the series
+    turns = np.cumsum((step < -pi).astype(np.int64) - (step > pi), axis=axis)
+    rest = [slice(None)] * result.ndim
+    rest[axis] = slice(1, None)
+    result[tuple(rest)] += (turns * (2*pi)).astype(result.dtype)
+    return result
+
+
 def accellToEuler(acc):
     """
     Find body attitude as Euler angles (roll and pitch, yaw is kept zero)
@@ -1257,10 +1368,22 @@ def meanOfQuat(q):
 
 
 def meanOfQuatArray(q):
+    """
+    Mean of each row of quaternions q[i, :, :], same as meanOfQuat() applied to every row.
+    All rows are iterated together and each row stops updating once it has converged.
+    """
     assert q.shape[2] == 4
-    mu = np.empty((q.shape[0], 4))
-    for i in range(q.shape[0]):
-        mu[None, i, :] = meanOfQuat(q[i, :, :])
+    m = q.shape[1]
+    n = float(m)
+    mu = np.array(q[:, 0, :], dtype=float)
+    active = np.arange(q.shape[0])
+    while len(active):
+        prev_mu = mu[active]
+        dv = qboxminus(q[active].reshape(-1, 4), np.repeat(prev_mu, m, axis=0))
+        mu_a = qboxplus(prev_mu, np.sum(dv.reshape(-1, m, 3), axis=1)/n)
+        mu[active] = mu_a
+        active = active[norm(qboxminus(mu_a, prev_mu), axis=1) > 1e-3]
+    assert np.all(np.abs(1.0 - norm(mu, axis=1)) <= 1e-3)
     return mu
 
 
@@ -1286,6 +1409,11 @@ if __name__ == '__main__':
     R = quatDCM(q1)
     quat = DCMquat(R)
     assert np.sqrt(np.sum(np.square(q1 - quat))) < 1e-8
+    # All four branches of DCMquat, with the scalar part made positive
+    qp = np.copy(q)
+    qp[qp[:,0] < 0, :] *= -1.0
+    assert np.max(np.abs(DCMquat(quatDCM(qp)) - qp)) < 1e-8
+    assert np.max(np.abs(DCMquat(quatDCM(qp[0, :])) - qp[0, :])) < 1e-8
 
     # Test cross-product matrix,
     # see https://ajcr.net/Basic-guide-to-einsum/ for einsum() usage
@@ -1363,14 +1491,67 @@ if __name__ == '__main__':
     u = y[0:2,:]
     eul = accellToEuler(u)
     a = unwrapAngle(np.radians(205.0))
+    assert np.abs(a - np.radians(-155.0)) < 1e-8
+    ang = np.r_[-7*pi, -3*pi, -pi, 0.0, pi, 3*pi, 7*pi, 100.0, -100.0, np.radians(205.0)]
+    ang1 = np.copy(ang)
+    for i in range(len(ang1)):
+        while ang1[i] < -pi:
+            ang1[i] += 2*pi
+        while ang1[i] > pi:
+            ang1[i] -= 2*pi
+    assert np.max(np.abs(unwrapAngle(ang) - ang1)) < 1e-8
+    # Heading turning both ways across +-pi, with a NaN gap
+    hdg = np.cumsum(np.r_[0.0, np.full(400, 0.1), np.full(900, -0.1), np.full(300, 0.3)]) + 3.0
+    hdgWrapped = unwrapAngle(np.copy(hdg))
+    hdgWrapped[700] = np.nan
+    hdg1 = np.copy(hdgWrapped)
+    turns = 0
+    for i in range(1, len(hdg1)):
+        if hdgWrapped[i] - hdgWrapped[i-1] > pi:
+            turns -= 1
+        elif hdgWrapped[i] - hdgWrapped[i-1] < -pi:
+            turns += 1
+        hdg1[i] = hdgWrapped[i] + turns*2*pi
+    assert np.array_equal(continuousAngle(hdgWrapped), hdg1, equal_nan=True)
+    assert np.max(np.abs(continuousAngle(hdgWrapped)[:700] - hdg[:700])) < 1e-8
+    hdg3 = np.c_[hdgWrapped, -hdgWrapped, hdgWrapped[::-1]]
+    assert np.array_equal(continuousAngle(hdg3), np.c_[hdg1, continuousAngle(-hdgWrapped), continuousAngle(hdgWrapped[::-1])], equal_nan=True)
+    assert np.array_equal(continuousAngle(hdg3.T, axis=1), continuousAngle(hdg3).T, equal_nan=True)
+    assert continuousAngle(hdg1[:0]).shape == (0,)
     eul, bias = acc2AttAndBias(u)
 
+    # Test out= and every backend against the NumPy backend
+    previous = setBackend('numpy')
+    llas = np.c_[y[:, 0:2] * 80.0, y[:, 2] * 3000.0]
+    cases = [(mul_Quat_Quat, (q, q[::-1, :])), (mul_Quat_Quat, (q[0, :], q)), (mul_Quat_Quat, (q1[0, :], q2[0, :])),
+             (quatRot, (q, y)), (quatRot, (q[0, :], y)), (quatRot, (q[0, :], y[0, :])),
+             (lla2ned, (lla_ref, llas)), (lla2ned, (lla_ref, llas[0, :])), (lla2ned, (llas, llas[::-1, :]))]
+    expected = [fn(*args) for fn, args in cases]
+    for name in BACKENDS:
+        setBackend(name)
+        for (fn, args), result in zip(cases, expected):
+            assert np.max(np.abs(fn(*args) - result)) < 1e-8
+            out = np.empty_like(result)
+            assert fn(*args, out=out) is out
+            assert np.max(np.abs(out - result)) < 1e-8
+            # In place on the last argument
+            if np.shape(args[-1]) == np.shape(result):
+                inplace = np.copy(args[-1])
+                fn(*(args[:-1] + (inplace,)), out=inplace)
+                assert np.max(np.abs(inplace - result)) < 1e-8
+        # A single row applied to no rows gives no rows
+        assert np.shape(mul_Quat_Quat(q[0:1, :], q[:0, :])) == (0, 4)
+        assert np.shape(quatRot(q[:0, :], y[0, :])) == (0, 3)
+        assert np.shape(lla2ned(lla_ref, llas[:0, :])) == (0, 3)
+    setBackend(previous)
+
     # Find the mean Quaternion
     mu = meanOfQuat(q)
     qarr = np.random.random((5000, 25, 4))
     qarr = normalize(qarr, axis=2)
     mu = meanOfQuatArray(qarr)
-    print(mu)
+    mu1 = np.concatenate([meanOfQuat(qarr[i, :, :]) for i in range(qarr.shape[0])])
+    assert np.max(np.abs(mu - mu1)) < 1e-8
 
     pass
 
@@ -0,0 +1,79 @@
+'''
+Compiled kernels for inertialsense_math.pose, used automatically when Numba is installed.
+
+Each kernel loops over the rows once and writes straight into out, without the temporary arrays of
+the NumPy implementation.  A row is read completely before it is written, so out may be one of the
+inputs.  Inputs with a single row are applied to every row of out.  Call through the pose functions,
+which handle shapes and allocate out when it is not given.
+'''
+import numba
+import numpy as np
+
+# Earth equatorial radius and first eccentricity squared, same as pose.lla2ned()
+R_EARTH = 6378137.0
+E2_EARTH = 0.08181919084262**2
+DEG2RAD = np.pi / 180.0
+
+
+@numba.njit(cache=True)
+def mulQuatQuat(q1, q2, out):
+    n1 = q1.shape[0]
+    n2 = q2.shape[0]
+    for i in range(out.shape[0]):
+        j = i if n1 > 1 else 0
+        k = i if n2 > 1 else 0
+        a0, a1, a2, a3 = q1[j,0], q1[j,1], q1[j,2], q1[j,3]
+        b0, b1, b2, b3 = q2[k,0], q2[k,1], q2[k,2], q2[k,3]
+        out[i,0] = a0*b0 - a1*b1 - a2*b2 - a3*b3
+        out[i,1] = a0*b1 + a1*b0 - a2*b3 + a3*b2
+        out[i,2] = a0*b2 + a1*b3 + a2*b0 - a3*b1
+        out[i,3] = a0*b3 - a1*b2 + a2*b1 + a3*b0
+    return out
+
+
+@numba.njit(cache=True)
+def quatRot(q, v, out):
+    nq = q.shape[0]
+    nv = v.shape[0]
+    for i in range(out.shape[0]):
+        j = i if nq > 1 else 0
+        k = i if nv > 1 else 0
+        w, x, y, z = q[j,0], q[j,1], q[j,2], q[j,3]
+        v0, v1, v2 = v[k,0], v[k,1], v[k,2]
+        # t = 2 * cross(q[1:4], v)
+        t0 = 2.0 * (y*v2 - z*v1)
+        t1 = 2.0 * (z*v0 - x*v2)
+        t2 = 2.0 * (x*v1 - y*v0)
+        # v + w * t + cross(q[1:4], t)
+        out[i,0] = v0 + w*t0 + (y*t2 - z*t1)
+        out[i,1] = v1 + w*t1 + (z*t0 - x*t2)
+        out[i,2] = v2 + w*t2 + (x*t1 - y*t0)
+    return out
+
+
+@numba.njit(cache=True)
+def lla2ned(lla_ref, lla, out):
+    nr = lla_ref.shape[0]
+    nl = lla.shape[0]
+    jRef = -1
+    for i in range(out.shape[0]):
+        j = i if nr > 1 else 0
+        k = i if nl > 1 else 0
+        if j != jRef:
+            # Reference terms, computed once for a single reference
+            jRef = j
+            lat_ref = lla_ref[j,0] * DEG2RAD
+            lon_ref = lla_ref[j,1] * DEG2RAD
+            alt_ref = lla_ref[j,2]
+            sin_lat_ref = np.sin(lat_ref)
+            # radius of curvature in the prime vertical and in the meridian
+            Rn = R_EARTH / np.sqrt(1.0 - E2_EARTH * sin_lat_ref**2)
+            Rm = Rn * (1.0 - E2_EARTH) / (1.0 - E2_EARTH * sin_lat_ref**2)
+            RnCos = Rn * np.cos(lat_ref)
+        dlat = lla[k,0] * DEG2RAD - lat_ref
+        dlon = lla[k,1] * DEG2RAD - lon_ref
+        dalt = lla[k,2] - alt_ref
+        out[i,0] =  dlat * Rm
+        out[i,1] =  dlon * RnCos
+        out[i,2] = -dalt
+    return out
@@ -9,6 +9,7 @@ import sys
 # import ctypes as ct
 import math
 import pylib.ISToolsDataSorted as itd
+from inertialsense_math.pose import continuousAngle
 import subprocess as subprocess
 import pdb
 
@@ -49,25 +50,7 @@ def checkRawDataDrop(log):
 
 # RMS Support Functions
 def handleHeadingWrapping(ins):
-    offset = 0
-    newData = []
-    for dIndex in range(0,len(ins.v['euler'])):
-        if dIndex == 0:
-            prevHeading = ins.v['euler'][0][2]
-            newData.append(ins.v['euler'][0][2])
-        else:
-            currHeading = ins.v['euler'][dIndex][2]
-            if prevHeading - currHeading > np.pi:
-                offset += 1
-            elif prevHeading - currHeading < -np.pi:
-                offset -= 1
-            prevHeading = currHeading
-            newData.append((currHeading + offset*2*np.pi))
-
-    #plt.plot(ins.v['tow'], newData)
-
-    for dIndex in range(0,len(ins.v['euler'])):
-        ins.v['euler'][dIndex][2] = newData[dIndex]
+    ins.v['euler'][:, 2] = continuousAngle(ins.v['euler'][:, 2])
     return ins
 
 # TODO: Compile this function into C-extension
@@ -36,6 +36,23 @@ def gpsTowToUtc(gps_week, gps_tow, gps_utc_offset=18):
     
     return utc_times
 
+def utcToGpsTow(utc, gps_utc_offset=18):
+    """
+    Convert a UTC datetime to GPS week and time of week in seconds.
+
+    Args:
+        utc (datetime.datetime): UTC time.  Timezone aware times are converted to UTC first.
+        gps_utc_offset (int): Difference between GPS time and UTC time in seconds. Default is 18.
+
+    Returns:
+        tuple: (GPS week, GPS time of week in seconds)
+    """
+    if utc.tzinfo is not None:
+        utc = utc.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    total_seconds = (utc - GPS_EPOCH).total_seconds() + gps_utc_offset
+    week = int(total_seconds // (7 * 24 * 3600))
+    return week, total_seconds - week * 7 * 24 * 3600
+
 # Set Reference latitude, longitude, height above ellipsoid (deg, deg, m) used for NED calculations
 def setRefLla(lla):
     global refLla
@@ -111,3 +128,137 @@ def getTimeFromGpsTow(s, fixTimeBeforeGnss=False, week=None):
 def getTimeFromGTime(gtime):
     GPS_start_Time = datetime.datetime.strptime('1/Jan/1970', "%d/%b/%Y")
     return [GPS_start_Time + datetime.timedelta(seconds=float(t['time'] + t['sec'])) for t in gtime]
+
+class GnssObservations:
+    """
+    Raw GNSS observations of all epochs in one flat obsd_t array, epoch j is obs[offsets[j]:offsets[j+1]].
+    Indexing and iterating yields the epoch arrays, like the list of per-epoch arrays it replaces.
+    """
+    def __init__(self, obs, offsets):
+        self.obs = obs
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return [self[i] for i in range(*j.indices(len(self)))]
+        if j < 0:
+            j += len(self)
+        if j < 0 or j >= len(self):
+            raise IndexError('epoch index out of range')
+        return self.obs[self.offsets[j]:self.offsets[j+1]]
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self.obs[self.offsets[j]:self.offsets[j+1]]
+
+    def epochIndex(self):
+        # Epoch of each observation in obs
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+def gnssEpochs(gps_data, tolerance=0.0):
+    """
+    Merges the chunks of raw GNSS observations into receiver epochs by time stamp.  A receiver may send an
+    epoch in several chunks, GnssObservations has one entry per chunk.  Chunks without a time stamp are
+    dropped and consecutive chunks with time stamps within tolerance are one epoch.
+
+    Args:
+        gps_data (GnssObservations): Raw observations.
+        tolerance (float): Largest time stamp difference (s) of chunks of the same epoch.
+
+    Returns:
+        tuple: (t epoch GPS time in seconds since 1970, taken from the first time stamped observation,
+                dt time between epochs, nsat observations in each epoch,
+                epoch of each observation in gps_data.obs, -1 where dropped)
+    """
+    obs = gps_data.obs
+    chunk = gps_data.epochIndex()
+    timed = np.flatnonzero(obs['time']['time'])
+    kept, first = np.unique(chunk[timed], return_index=True)
+    tChunk = obs['time']['time'][timed[first]] + obs['time']['sec'][timed[first]]
+    new = np.ones(len(tChunk), dtype=bool)
+    new[1:] = np.abs(np.diff(tChunk)) > tolerance
+    group = np.full(len(gps_data), -1, dtype=np.int64)
+    group[kept] = np.cumsum(new) - 1
+    epoch = group[chunk]
+    t = tChunk[new]
+    nsat = np.bincount(epoch[epoch >= 0], minlength=len(t))
+    return t, np.diff(t), nsat, epoch
+
+def gnssSatList(sat, valid=None, sort=False):
+    """
+    Unique non-zero satellite numbers, in order of first appearance unless sort is True.
+
+    Args:
+        sat (array-like): Satellite number of each observation.
+        valid (array-like): Optional mask of the observations to consider.
+        sort (bool): Return the satellites sorted by number.
+
+    Returns:
+        numpy.ndarray: Satellite numbers.
+    """
+    sat = np.asarray(sat)
+    mask = sat != 0
+    if valid is not None:
+        mask &= valid
+    sats, first = np.unique(sat[mask], return_index=True)
+    return sats if sort else sats[np.argsort(first)]
+
+def gnssObsIndex(epoch, sat, numEpochs, sats):
+    """
+    Index of the first observation of each satellite in each epoch.
+
+    Args:
+        epoch (array-like): Epoch of each observation, see GnssObservations.epochIndex().
+        sat (array-like): Satellite number of each observation.
+        numEpochs (int): Number of epochs.
+        sats (array-like): Satellite numbers of the columns, see gnssSatList().
+
+    Returns:
+        numpy.ndarray: [epoch, sat] observation index, -1 where the satellite was not observed.
+    """
+    sat = np.asarray(sat)
+    sats = np.asarray(sats)
+    index = np.full((numEpochs, len(sats)), -1, dtype=np.int64)
+    if len(sats) == 0 or len(sat) == 0:
+        return index
+    order = np.argsort(sats, kind='stable')
+    pos = np.clip(np.searchsorted(sats[order], sat), 0, len(sats) - 1)
+    found = (sats[order][pos] == sat) & (sat != 0)
+    obsIdx = np.flatnonzero(found)
+    col = order[pos[found]]
+    # Keep the first observation of a satellite in an epoch, like searching the epoch with np.where()
+    cell, first = np.unique(np.asarray(epoch)[obsIdx] * len(sats) + col, return_index=True)
+    index.flat[cell] = obsIdx[first]
+    return index
+
+def gnssObsCube(obs, epoch, numEpochs, sats):
+    """
+    Observation cubes of raw GNSS observations for plotting.  Pseudorange, carrier phase, doppler and
+    loss of lock are taken from observations with a non-zero L1 or L5 pseudorange and carrier phase.
+
+    Args:
+        obs (numpy.ndarray): Flat obsd_t array, see GnssObservations.
+        epoch (array-like): Epoch of each observation.
+        numEpochs (int): Number of epochs.
+        sats (array-like): Satellite numbers of the columns, see gnssSatList().
+
+    Returns:
+        tuple: (time [epoch, sat] GPS time in seconds since 1970 (0 where not observed),
+                P, L, D, LLI [freq, epoch, sat] (NaN where not available))
+    """
+    index = gnssObsIndex(epoch, obs['sat'], numEpochs, sats)
+    observed = index >= 0
+    o = obs[np.where(observed, index, 0)] if len(obs) else np.zeros(index.shape, dtype=obs.dtype)
+    t = np.where(observed, o['time']['time'] + o['time']['sec'], 0.0)
+    valid = observed & (o['P'] != 0).any(axis=-1) & (o['L'] != 0).any(axis=-1)
+
+    def cube(values, mask):
+        return np.where(mask, values, np.nan).transpose((2, 0, 1))
+    P = cube(o['P'], valid[..., None] & (o['P'] != 0))
+    L = cube(o['L'], valid[..., None] & (o['L'] != 0))
+    D = cube(o['D'], valid[..., None] & (o['D'] != 0))
+    LLI = cube(o['LLI'], np.broadcast_to(valid[..., None], o['LLI'].shape))
+    return t, P, L, D, LLI
@@ -2,9 +2,18 @@
 
 import os
 import re
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired, list2cmdline
 from os.path import normpath, basename
 from threading import Thread
+from queue import Queue
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import traceback
 import time
 from pathlib import Path
 import shutil
@@ -15,15 +24,180 @@ sys.path.insert(1, '../../SDK/python/logInspector')
 sys.path.insert(1, '../logInspector')
 sys.path.insert(1, '..')
 
-from logReader import Log
+from logReader import Log, RMS_DIDS
+
+# Return codes of NPP jobs that did not exit on their own
+NPP_TIMEOUT = 'timeout'
+NPP_ERROR = 'error'
+
+class NppJob():
+    def __init__(self, folder, serial, args):
+        self.folder = folder            # log folder
+        self.serial = serial
+        self.args = args                # navpp command line
+        self.attempts = 0
+        self.returncode = None          # exit code of the last attempt, NPP_TIMEOUT or NPP_ERROR
+        self.error = None               # why navpp could not be started or the job could not be finished
+        self.seconds = 0.0              # duration of all attempts
+
+    def passed(self):
+        return self.returncode == 0
+
+class NppScheduler():
+    """
+    Runs a queue of NPP jobs on a bounded number of workers, each running one navpp process at a time.
+    A job that fails, times out or cannot be started is queued again up to retries times.  A job whose
+    finished callback raises is marked NPP_ERROR, the worker goes on with the next job.
+    """
+    def __init__(self, cwd, workers=0, timeout=None, retries=0, finished=None):
+        self.cwd = cwd                  # working directory of navpp
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout          # seconds per attempt, None = no limit
+        self.retries = retries
+        self.finished = finished        # called with each job when it is done, from the worker thread
+        self._print_lock = threading.Lock()
+
+    def run(self, jobs):
+        queue = Queue()
+        for job in jobs:
+            queue.put(job)
+        workers = [Thread(target=self.worker, args=(queue,)) for _ in range(min(self.workers, len(jobs)))]
+        for worker in workers:
+            worker.start()
+        queue.join()
+        for worker in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        return jobs
+
+    def worker(self, queue):
+        while True:
+            job = queue.get()
+            if job is None:
+                return
+            try:
+                self.runJob(job)
+                if not job.passed() and job.attempts <= self.retries:
+                    self.print("NPP retry %d/%d (%s): SN%s %s" % (job.attempts, self.retries, job.returncode, job.serial, job.folder))
+                    queue.put(job)
+                elif self.finished:
+                    self.finished(job)
+            except Exception as e:
+                # An exception would end the worker thread and run() would wait for its jobs forever
+                self.print("NPP job error: SN%s %s\n%s" % (job.serial, job.folder, traceback.format_exc()))
+                job.returncode = NPP_ERROR
+                job.error = "%s: %s" % (type(e).__name__, e)
+            finally:
+                queue.task_done()
+
+    def runJob(self, job):
+        job.attempts += 1
+        self.print(list2cmdline(job.args))
+        start = time.time()
+        try:
+            process = Popen(job.args, cwd=self.cwd)
+        except OSError as e:
+            job.returncode = NPP_ERROR
+            job.error = str(e)
+        else:
+            try:
+                job.returncode = process.wait(timeout=self.timeout)
+            except TimeoutExpired:
+                process.kill()
+                process.wait()
+                job.returncode = NPP_TIMEOUT
+        job.seconds += time.time() - start
+
+    def print(self, str):
+        with self._print_lock:
+            print(str)
+
+def printNppSummary(jobs):
+    # Prints the count of NPP jobs by return code and the jobs that failed
+    failed = [job for job in jobs if not job.passed()]
+    retries = sum(job.attempts - 1 for job in jobs)
+    print("NPP jobs: %d, passed: %d, failed: %d, retries: %d" % (len(jobs), len(jobs) - len(failed), len(failed), retries))
+    for returncode, count in sorted(Counter(job.returncode for job in jobs).items(), key=lambda item: str(item[0])):
+        print("  %-8s %d" % (returncode if isinstance(returncode, str) else "exit %d" % returncode, count))
+    for job in failed:
+        print("  [FAILED %s] SN%s %s%s" % (job.returncode, job.serial, job.folder, (": " + job.error) if job.error else ""))
+
+# Manifest of an incremental SuperNPP run, in the log directory
+NPP_MANIFEST_FILENAME = 'supernpp_manifest.json'
+NPP_MANIFEST_VERSION = 1
+
+class NppManifest():
+    """
+    Inputs and results of the log folders processed by SuperNPP: the size and mtime of the log files, the
+    hash of the navpp binary, the navpp command lines and the RMS result.  A folder is up to date while its
+    inputs are the same as when it was processed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, NPP_MANIFEST_FILENAME)
+        self.folders = {}
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == NPP_MANIFEST_VERSION:
+                self.folders = manifest['folders']
+        except (OSError, ValueError, KeyError):
+            pass
+        exename = nppExecutable()
+        self.navpp = fileHash(exename) if os.path.exists(exename) else None
+
+    def inputs(self, folder, jobs):
+        # Inputs of a log folder, as stored in the manifest
+        sources = {}
+        for file in sorted(os.listdir(folder)):
+            path = os.path.join(folder, file)
+            if file.endswith(('.dat', '.raw', '.sdat')) and os.path.isfile(path):
+                st = os.stat(path)
+                sources[file] = [st.st_size, st.st_mtime_ns]
+        return {'navpp': self.navpp, 'commands': [job.args[1:] for job in jobs], 'sources': sources}
+
+    def result(self, folder, inputs):
+        # Returns the result recorded for the folder if its inputs are unchanged and its output exists, else None
+        entry = self.folders.get(os.path.relpath(folder, self.directory))
+        if entry is None or entry['inputs'] != inputs or not os.path.isdir(os.path.join(folder, 'post_processed')):
+            return None
+        return entry['result']
+
+    def update(self, folder, inputs, result):
+        # Records the inputs and result of a processed folder, or forgets the folder if result is None
+        key = os.path.relpath(folder, self.directory)
+        if result is None:
+            self.folders.pop(key, None)
+        else:
+            self.folders[key] = {'inputs': inputs, 'result': result}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': NPP_MANIFEST_VERSION, 'folders': self.folders}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+def fileHash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
 
 class SuperNPP():
-    def __init__(self, directory, config_serials, startMode=0, computeRMS=0):		# start mode 0=hot, 1=cold, 2=factory
+    def __init__(self, directory, config_serials, startMode=0, computeRMS=0, workers=0, timeout=None, retries=0, rmsWorkers=0, incremental=False):		# start mode 0=hot, 1=cold, 2=factory
         self.config_serials = config_serials
         self.directory = os.path.normpath(Path(directory))
         self.startMode = startMode
         self.computeRMS = computeRMS
+        self.workers = workers          # concurrent navpp processes, 0 = one per CPU core
+        self.timeout = timeout          # seconds per navpp run, None = no limit
+        self.retries = retries          # reruns of a navpp job that fails or times out
+        self.rmsWorkers = rmsWorkers    # RMS worker processes, 0 = one per CPU core
+        self.incremental = incremental  # only process log folders that changed since the last run, see NppManifest
         self.subdirs = []
+        self.jobs = []
         self.log = Log()
         self.rmsPassResults = []
         self.rmsFailResults = []
@@ -33,7 +207,8 @@ class SuperNPP():
         print("  Directory: ", self.directory)
         print("  config_serials:", self.config_serials)
         print("  startMode: ", self.startMode)
-        self.remove_post_processed_dirs(self.directory)
+        if not self.incremental:
+            self.remove_post_processed_dirs(self.directory)
         self.findLogFiles(self.directory)
             
     def getSerialNumbers(self):
@@ -51,8 +226,8 @@ class SuperNPP():
             if (".dat" in file or ".raw" in file) and (not "base_station.raw" in file):
                 self.subdirs.append(directory)
                 break
-        # Recursively search for data in sub directories
-        for subdir in os.listdir(directory):
+        # Recursively search for data in sub directories, sorted so the test summary order is the same on every run
+        for subdir in sorted(os.listdir(directory)):
             subdir2 = os.path.join(directory, subdir)
             if not os.path.isdir(subdir2):
                 continue
@@ -86,16 +261,62 @@ class SuperNPP():
         print('  log count: ' + str(len(self.subdirs)))
         for subdir in self.subdirs:
             print("   " + subdir)
-        time.sleep(2)	# seconds
         self.rmsFailResults = []
         self.rmsPassResults = []
 
-        # Start threads
-        threads = [Thread(target=self.run_log_folder, args=(folder, self.config_serials)) for folder in self.subdirs]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
+        # Jobs to run navpp for each serial number of each log folder.  In incremental mode folders whose
+        # inputs are unchanged keep their output and recorded result.
+        folderJobs = {folder: self.nppJobs(folder) for folder in self.subdirs}
+        manifest = NppManifest(self.directory) if self.incremental else None
+        inputs = {}
+        upToDate = {}       # folder: recorded result
+        rmsOnly = set()     # up to date folders processed without RMS
+        if manifest:
+            for folder in self.subdirs:
+                inputs[folder] = manifest.inputs(folder, folderJobs[folder])
+                result = manifest.result(folder, inputs[folder])
+                if result is None:
+                    shutil.rmtree(os.path.join(folder, "post_processed"), ignore_errors=True)
+                elif result == "[      ]" and self.computeRMS:
+                    rmsOnly.add(folder)
+                else:
+                    upToDate[folder] = result
+            print("Incremental: %d of %d log folders up to date" % (len(upToDate) + len(rmsOnly), len(self.subdirs)))
+        self.jobs = [job for folder in self.subdirs if folder not in upToDate and folder not in rmsOnly for job in folderJobs[folder]]
+
+        # The RMS of a folder is computed in a worker process as soon as all its navpp jobs are done, while
+        # navpp runs on the other folders.
+        remaining = Counter(job.folder for job in self.jobs)
+        rmsFutures = {}
+        rmsPool = None
+        if self.computeRMS:
+            # Spawned since forking while the scheduler threads run can deadlock the workers
+            rmsPool = ProcessPoolExecutor(self.rmsWorkers or os.cpu_count() or 1, multiprocessing.get_context('spawn'))
+
+        def submitRMS(folder):
+            # A pool broken by a worker process that died (e.g. out of memory) raises, the RMS of the folder fails
+            try:
+                rmsFutures[folder] = rmsPool.submit(folderRMS, folder)
+            except Exception as e:
+                rmsFutures[folder] = Future()
+                rmsFutures[folder].set_exception(e)
+
+        if rmsPool:
+            for folder in self.subdirs:
+                if folder not in upToDate and not remaining[folder]:
+                    submitRMS(folder)
+
+        def nppFinished(job):
+            with self._key_lock:
+                remaining[job.folder] -= 1
+                if rmsPool and not remaining[job.folder]:
+                    submitRMS(job.folder)
+
+        scheduler = NppScheduler(nppBuildFolder(), self.workers, self.timeout, self.retries, nppFinished)
+        print("Running NPP: %d jobs, %d workers..." % (len(self.jobs), min(scheduler.workers, len(self.jobs))))
+        scheduler.run(self.jobs)
+        print("All processes done!")
+        printNppSummary(self.jobs)
 
         # Record list of logs to be processed
         logListFilename = self.directory+"/test_summary.txt"        
@@ -104,29 +325,42 @@ class SuperNPP():
         except OSError:
             pass
 
+        # Results in the order of the log folders, not of the RMS completion
         results = []
         for subdir in self.subdirs:
             sdir = os.path.normpath(str(subdir) + "/post_processed")
             nppPrint("   " + sdir)
 
             ### Compute RMS ##################################################
-            if self.computeRMS:
-                passRMS = 0
-                if self.log.load(sdir):
-                    # Compute and output RMS Report
-                    self.log.calculateRMS()
-                    passRMS = self.log.printRMSReport()
-                    if passRMS == 1:
-                        results.append("[PASSED] " + sdir)
-                        self.rmsPassResults.append(sdir)
-                    else:
-                        results.append("[FAILED] " + sdir)
-                        self.rmsFailResults.append(sdir)
-                else:
-                    results.append("[NODATA] " + sdir)
+            rmsError = False
+            if subdir in upToDate:
+                result = upToDate[subdir] if self.computeRMS else "[      ]"
+            elif self.computeRMS:
+                try:
+                    result, output = rmsFutures[subdir].result()
+                    print(output, end='')
+                except Exception:
+                    print("RMS failed: " + sdir)
+                    traceback.print_exc()
+                    result = "[FAILED]"
+                    rmsError = True
             else:
-                results.append("[      ] " + sdir)
+                result = "[      ]"
+            if result == "[PASSED]":
+                self.rmsPassResults.append(sdir)
+            elif result == "[FAILED]":
+                self.rmsFailResults.append(sdir)
+            results.append(result + " " + sdir)
             ### Compute RMS ##################################################
+
+            # Record the processed folders whose navpp jobs and RMS did not fail
+            if manifest and subdir not in upToDate:
+                passed = subdir in rmsOnly or all(job.passed() for job in folderJobs[subdir])
+                manifest.update(subdir, inputs[subdir], result if passed and not rmsError else None)
+        if rmsPool:
+            rmsPool.shutdown()
+        if manifest:
+            manifest.save()
         with open(logListFilename, "w") as f:
             f.write("\n".join(results))
 
@@ -135,16 +369,15 @@ class SuperNPP():
         self.print_file_contents(logListFilename)
         print('-------------------------------------------------------------')
 
-    def run_log_folder(self, folder, config_serials):
-        # Find the serial numbers in the log
-        # subdir = os.path.basename(os.path.normpath(folder))
+    def nppJobs(self, folder):
+        # Returns the NPP jobs of a log folder, one per serial number
         (folder, subdir) = os.path.split(folder)
 
         # Find serial numbers, and determine the log type
         logType = "DAT"
-        if config_serials == ["ALL"]:
+        if self.config_serials == ["ALL"]:
             serials = []
-            for file in os.listdir(os.path.join(folder,subdir)):
+            for file in sorted(os.listdir(os.path.join(folder,subdir))):
                 if (".dat" in file or ".raw" in file) and (not "base_station.raw" in file):
                     if ".dat" in file:
                         logType = "DAT"
@@ -155,69 +388,44 @@ class SuperNPP():
                     if serNum and (serNum not in serials):
                         serials.append(serNum)
         else:
-            serials = config_serials
-
-        print("serial numbers")
-        print(serials)
-
-        if os.name == 'posix':
-            cmds = ['./navpp -d "' + folder + '" -s ' + str(s) + " -sd " + subdir + " -l " + logType for s in serials]
-        file_path = os.path.dirname(os.path.realpath(__file__))
-        npp_build_folder = os.path.normpath(file_path + '../../../../cpp/NavPostProcess/build')
-        if os.name == 'posix':  # Linux
-            exename = './navpp'
-        else:                   # Windows
-            exename = 'navpp.exe'
-            npp_build_folder += '/Release'
-        cmds = [exename + ' -d "' + folder + '" -s ' + str(s) + " -sd " + subdir + " -l " + logType for s in serials]
+            serials = self.config_serials
 
+        args = []
         if self.startMode == 1:
-            for i in range(len(cmds)):
-                cmds[i] += ' -mode COLD -kml'		# Cold init, enable KML output
-
+            args += ['-mode', 'COLD', '-kml']		# Cold init, enable KML output
         if self.startMode == 2:
-            for i in range(len(cmds)):
-                cmds[i] += ' -mode FACTORY -kml'	# Factory init, enable KML output
-
-        for i in range(len(cmds)):
-            cmds[i] += ' --outputoff'				# disable INS display output
-
-        for i in range(len(cmds)):
-            cmds[i] += ' --disableBaroFusion'		# disable barometer fusion
-
-        print("Running NPP...")
-
-        for cmd in cmds:
-            print(cmd)
-
-        processes = [Popen(cmd, shell=True, cwd=npp_build_folder) for cmd in cmds]
-        for p in processes:
-            p.wait()
-
-        ### Compute RMS ##################################################
-        # print("NPP done.  Running RMS calc...")
-        # sdir = os.path.join(folder, subdir, "post_processed")
-        #
-        # self._key_lock.acquire()
-        # log = Log()
-        # log.load(sdir)
-        # self._key_lock.release()
-        #
-        # # Compute and output RMS Report
-        # log.calculateRMS()
-        #
-        # self._key_lock.acquire()
-        # passRMS = log.printRMSReport()
-        # if passRMS == 1:
-        # 	self.rmsPassResults.append(sdir)
-        # 	print("RMS Test PASSED: " + sdir)
-        # else:
-        # 	self.rmsFailResults.append(sdir)
-        # 	print("RMS Test FAILED: " + sdir)
-        # self._key_lock.release()
-        ### Compute RMS ##################################################
-
-        print("All processes done!")
+            args += ['-mode', 'FACTORY', '-kml']	# Factory init, enable KML output
+        args += ['--outputoff']					# disable INS display output
+        args += ['--disableBaroFusion']			# disable barometer fusion
+
+        exename = nppExecutable()
+        return [NppJob(os.path.join(folder, subdir), s, [exename, '-d', folder, '-s', str(s), '-sd', subdir, '-l', logType] + args) for s in serials]
+
+def folderRMS(folder):
+    # Computes the RMS report of the post processed log of a folder in an RMS worker process.  Returns the
+    # test summary result and the printed output.  Only the DIDs of the RMS are decoded.  The log is not cached
+    # since post_processed is rewritten before SuperNPP computes its RMS again.
+    sdir = os.path.normpath(str(folder) + "/post_processed")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        log = Log()
+        if not log.load(sdir, dids=RMS_DIDS, cache=False):
+            return "[NODATA]", output.getvalue()
+        # Compute and output RMS Report
+        log.calculateRMS()
+        passRMS = log.printRMSReport()
+    return ("[PASSED]" if passRMS == 1 else "[FAILED]"), output.getvalue()
+
+def nppBuildFolder():
+    file_path = os.path.dirname(os.path.realpath(__file__))
+    npp_build_folder = os.path.normpath(file_path + '../../../../cpp/NavPostProcess/build')
+    if os.name != 'posix':      # Windows
+        npp_build_folder += '/Release'
+    return npp_build_folder
+
+def nppExecutable():
+    # navpp is run without a shell, so by full path so it can be killed on timeout
+    return os.path.join(nppBuildFolder(), 'navpp' if os.name == 'posix' else 'navpp.exe')
 
 def buildNPP(npp_build_folder):
     if not os.path.exists(npp_build_folder):
@@ -263,6 +471,17 @@ if __name__ == "__main__":
     # directory = config["directory"]
     # serials = config["serials"]
 
+    # Scheduler options, the remaining arguments are positional
+    import argparse
+    parser = argparse.ArgumentParser(usage='%(prog)s directory [serials] [computeRMS] [options]')
+    parser.add_argument('--jobs', type=int, default=0, help='concurrent navpp processes (default: one per CPU core)')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds before a navpp run is killed (default: no limit)')
+    parser.add_argument('--retries', type=int, default=0, help='reruns of a navpp run that fails or times out')
+    parser.add_argument('--rms-jobs', type=int, default=0, help='RMS worker processes (default: one per CPU core)')
+    parser.add_argument('--incremental', action='store_true', help='only process log folders whose logs, navpp or options changed since the last run')
+    opts, args = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + args
+
     # 2nd argument: Log Directory
     if len(sys.argv) >= 2:
         directory = sys.argv[1]
@@ -294,7 +513,7 @@ if __name__ == "__main__":
         computeRMS = 1
 
     # Run Super NPP
-    snpp = SuperNPP(directory, serials, computeRMS=computeRMS)
+    snpp = SuperNPP(directory, serials, computeRMS=computeRMS, workers=opts.jobs, timeout=opts.timeout, retries=opts.retries, rmsWorkers=opts.rms_jobs, incremental=opts.incremental)
     snpp.run()
 
     testSummaryFilename = directory+"/test_summary.txt"